@@ -1,8 +1,7 @@
 import pandas as pd
 import folium
 import os
-from sklearn.neighbors import BallTree
-import numpy as np
+from static.iroute_stops import load_stop_index, find_stops_file, nearest_stops
 
 # Define file paths
 data_dir = os.path.abspath(os.path.join(os.getcwd(), '.', 'data', 'iroute', 'service execution'))
@@ -13,11 +12,9 @@ bus_file_path = os.path.join(data_dir, 'req4', bus_file)
 # Load the bus data as a DataFrame
 bus_data = pd.read_csv(bus_file_path)
 
-stops_file = 'stops.csv'
-stops_file_path = os.path.join(data_dir, 'yyyymmdd_bus', stops_file)
-
-# Load the stops data as a DataFrame
-stops_data = pd.read_csv(stops_file_path)
+# Load the shared stop index (stops.csv, or stops.txt)
+stop_index = load_stop_index(find_stops_file(os.path.join(data_dir, 'yyyymmdd_bus')))
+stops_data = stop_index['stops']
 
 # Filter for buses E801 - E830
 bus_data = bus_data[bus_data['Veicolo'].astype(str).str.startswith('E80') & bus_data['Veicolo'].astype(str).isin([f'E80{i}' for i in range(1, 31)])]
@@ -25,28 +22,13 @@ bus_data = bus_data[bus_data['Veicolo'].astype(str).str.startswith('E80') & bus_
 # Normalize battery values (keep only first two digits if greater than 100)
 bus_data['Valore'] = bus_data['Valore'].apply(lambda x: int(str(int(x))[:2]) if x > 100 else x)
 
-# Prepare data for BallTree (convert lat/lon to radians)
-bus_coords = np.radians(bus_data[['Latitudine', 'Longitudine']].values)
-stop_coords = np.radians(stops_data[['stop_lat', 'stop_lon']].values)
-
-# Build BallTree for fast nearest neighbor search
-tree = BallTree(stop_coords, metric='haversine')
-
-# Query the nearest stop for each bus point (returns distances in radians and the index of nearest stop)
-distances, indices = tree.query(bus_coords, k=1)
-
-# Convert distances from radians to meters
-distances_in_meters = distances.flatten() * 6371000  # Earth's radius in meters
-indices = indices.flatten()
-
-# Set a threshold for proximity to bus stops (e.g., within 100 meters)
-bus_data['closest_stop_id'] = np.where(distances_in_meters <= 100, indices, np.nan)
+# Nearest stop of each bus point within 100 meters
+closest_stops, _ = nearest_stops(stop_index, bus_data['Latitudine'], bus_data['Longitudine'], max_distance_m=100)
 
 # Remove rows where no stop is found
-bus_data = bus_data.dropna(subset=['closest_stop_id'])
+bus_data = bus_data.assign(closest_stop_id=closest_stops)[closest_stops >= 0]
 
 # Map stop indices to stop details
-bus_data['closest_stop_id'] = bus_data['closest_stop_id'].astype(int)
 bus_data = bus_data.merge(stops_data[['stop_id', 'stop_name', 'stop_lat', 'stop_lon']], left_on='closest_stop_id', right_index=True)
 
 # Sort by DataOra to process stops in order
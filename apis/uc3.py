@@ -1,7 +1,16 @@
-from flask_restx import Namespace, Resource
+from flask_restx import Namespace, Resource, reqparse
 import static.load_trajectories as lt
+import static.ais_tiles as tiles
+import static.ais_stops as stops
+import static.ais_trips as trips
+import static.ais_encounters as encounters
+import static.ais_store as ais_store
+import static.ais_rf as ais_rf
+import static.ais_views as ais_views
+import static.ais_live as ais_live
+import static.ais_query as ais_query
 import static.authenticate as auth
-from flask import jsonify, Response, g
+from flask import jsonify, Response, g, request, stream_with_context
 import os
 import io
 import pandas as pd
@@ -16,10 +25,17 @@ def init_uc3():
     data_dir = os.path.abspath(os.path.join(os.getcwd(), '.', 'data'))
     decrypted_dataset_path = os.path.join(data_dir, 'ais.csv')
     mini_encrypted_dataset_path = os.path.join(data_dir, 'ais_mini_encrypted.csv')
+    # Datasets behind the role views of static.ais_views
+    role_datasets = {'plain': decrypted_dataset_path, 'encrypted': mini_encrypted_dataset_path}
 
     ais_dataset_path_2025 = os.path.join(data_dir, 'ais_data_2025', 'ais_data.csv')  # New AIS data
     rf_dataset_path_2025 = os.path.join(data_dir, 'ais_data_2025', 'doa_data.csv')   # RF data
 
+    # Live AIS fixes (an append-only CSV file or a drop directory) feeding the main dataset
+    live_source_path = os.environ.get('AIS_LIVE_SOURCE', os.path.join(data_dir, 'ais_live'))
+    if os.path.exists(live_source_path):
+        ais_live.start_live_ingest(decrypted_dataset_path, live_source_path)
+
     # Helper function for data export format
     def data_to_export_format(data, export_format):
         if export_format == "csv":
@@ -193,28 +209,16 @@ def init_uc3():
             if token_status != "valid":
                 return {"error": "Authentication Issue | Check User Credentials"}, 403
             
-            user_role = getattr(g, 'user_role', 'none')
-            print(user_role)
-            if user_role == "data-owner":
-                token_status = "valid"
-                dataset_path = decrypted_dataset_path
-            elif user_role == "pilot-user":
-                token_status = "invalid"
-                dataset_path = mini_encrypted_dataset_path
-            else:
-                return "Something went wrong with the authentication token"
             if export_format not in ALLOWED_FORMATS_MAP:
                 return {"error": "Invalid format. Allowed values are: 'div', 'html'."}, 400
-            # Get aggregated data and trajectory data
-            aggr_data = lt.get_aggregated_data(dataset_url=dataset_path)
-            traj_aggr_data = lt.get_aggregated_statistic_data(dataset_url=dataset_path)
-        
-            # Create map with markers and pop-ups
-            html_map = lt.create_map_with_markers_and_popups(
-                aggr_data=aggr_data,
-                traj_aggr_data=traj_aggr_data,
-                token_status = token_status
-            )
+
+            # Precomputed view holding only what the role is allowed to see
+            user_role = getattr(g, 'user_role', 'none')
+            view = ais_views.get_role_view(user_role, role_datasets)
+            if view is None:
+                return "Something went wrong with the authentication token"
+            html_map = view['map']
+
             if export_format == 'html':
                 return Response(
                     render_html_template(html_map),
@@ -335,11 +339,6 @@ def init_uc3():
     
     
     
-    def load_rf_data():
-        """Loads RF dataset and extracts necessary columns."""
-        rf_data = pd.read_csv(rf_dataset_path_2025, usecols=['t', 'lon', 'lat'])
-        return rf_data.to_dict(orient='records')
-
     @uc3_ns.route('/map/ais_rf')
     class ais_rf_map(Resource):
         @auth.require_token
@@ -351,7 +350,7 @@ def init_uc3():
             
             html_map = lt.create_map_with_ais_rf(
                 ais_dataset_url=ais_dataset_path_2025,
-                rf_data=load_rf_data(),
+                rf_dataset_url=rf_dataset_path_2025,
                 zoom_start=12
             )
             
@@ -361,5 +360,350 @@ def init_uc3():
                 headers={"Content-disposition": "attachment; filename=ais_rf_map.html"}
             ) 
         
-                       
-    return uc3_ns
\ No newline at end of file
+
+    # ### API for serving AIS positions and tracks as Mapbox Vector Tiles ###
+    ###########################################################
+    @uc3_ns.route('/tiles/<int:z>/<int:x>/<int:y>.mvt')
+    class ais_vector_tile(Resource):
+        @auth.require_token
+        def get(self, z, x, y, token_status="valid"):
+            token_status = getattr(g, 'token_status', 'none')
+
+            if token_status != "valid":
+                return {"error": "Authentication Issue | Check User Credentials"}, 403
+
+            if z > tiles.MAX_ZOOM or x >= (1 << z) or y >= (1 << z):
+                return {"error": "Invalid tile coordinates."}, 400
+
+            tile, tag = tiles.render_tile(decrypted_dataset_path, z, x, y)
+            # The tag names the data, not this process: it holds across restarts and workers
+            etag = '{}-{}-{}-{}'.format(tag, z, x, y)
+            if request.if_none_match.contains_weak(etag):
+                return Response(status=304, headers={"ETag": '"{}"'.format(etag)})
+
+            return Response(
+                tile,
+                mimetype="application/vnd.mapbox-vector-tile",
+                headers={"Cache-Control": "public, max-age=300", "ETag": '"{}"'.format(etag)}
+            )
+
+    def parse_stop_params():
+        parser = reqparse.RequestParser()
+        parser.add_argument('speed', type=float, default=stops.STOP_SPEED_KNOTS, help="Maximum speed (knots) of a stationary fix")
+        parser.add_argument('min_duration', type=float, default=stops.STOP_MIN_MINUTES, help="Minimum stay duration in minutes")
+        parser.add_argument('radius', type=float, default=stops.STOP_RADIUS_M, help="Maximum stay radius in metres")
+        args = parser.parse_args()
+        return stops.check_params(args['speed'], args['min_duration'], args['radius'])
+
+    # ### API for getting port calls and anchorage stays of all vessels ###
+    ###########################################################
+    @uc3_ns.route('/vessel/stops', defaults={'export_format': 'json'})
+    @uc3_ns.route('/vessel/stops/export/<export_format>')
+    class get_fleet_stops(Resource):
+        @auth.require_token
+        def get(self, export_format='json', token_status="valid"):
+            token_status = getattr(g, 'token_status', 'none')
+
+            if token_status != "valid":
+                return {"error": "Authentication Issue | Check User Credentials"}, 403
+
+            if export_format not in ALLOWED_FORMATS_DATA:
+                return {"error": "Invalid format. Allowed values are: 'json', 'csv', 'xlsx'."}, 400
+            try:
+                params = parse_stop_params()
+            except ValueError as e:
+                return {"error": str(e)}, 400
+            data = stops.get_fleet_stops(dataset_url=decrypted_dataset_path, **params)
+            return data_to_export_format(data, export_format)
+
+    # ### API for getting port calls and anchorage stays of a specific vessel ###
+    ###########################################################
+    @uc3_ns.route('/vessel/<shipid>/stops', defaults={'export_format': 'json'})
+    @uc3_ns.route('/vessel/<shipid>/stops/export/<export_format>')
+    class get_vessel_stops(Resource):
+        @auth.require_token
+        def get(self, shipid, export_format='json', token_status="valid"):
+            token_status = getattr(g, 'token_status', 'none')
+
+            if token_status != "valid":
+                return {"error": "Authentication Issue | Check User Credentials"}, 403
+
+            if export_format not in ALLOWED_FORMATS_DATA:
+                return {"error": "Invalid format. Allowed values are: 'json', 'csv', 'xlsx'."}, 400
+            try:
+                params = parse_stop_params()
+            except ValueError as e:
+                return {"error": str(e)}, 400
+            data = stops.get_vessel_stops(dataset_url=decrypted_dataset_path, shipid=shipid, **params)
+            return data_to_export_format(data, export_format)
+
+    # ### API for listing the trips of all vessels (or of one vessel) ###
+    ###########################################################
+    @uc3_ns.route('/trips', defaults={'export_format': 'json'})
+    @uc3_ns.route('/trips/export/<export_format>')
+    class get_trip_list(Resource):
+        @auth.require_token
+        def get(self, export_format='json', token_status="valid"):
+            token_status = getattr(g, 'token_status', 'none')
+
+            if token_status != "valid":
+                return {"error": "Authentication Issue | Check User Credentials"}, 403
+
+            if export_format not in ALLOWED_FORMATS_DATA:
+                return {"error": "Invalid format. Allowed values are: 'json', 'csv', 'xlsx'."}, 400
+            parser = reqparse.RequestParser()
+            parser.add_argument('shipid', type=str, required=False, help="Only list the trips of this vessel")
+            args = parser.parse_args()
+            data = trips.get_trip_list(dataset_url=decrypted_dataset_path, shipid=args.get('shipid'))
+            return data_to_export_format(data, export_format)
+
+    # ### API for rendering a single trip over map ###
+    ###########################################################
+    @uc3_ns.route('/trips/<trip_id>/map', defaults={'export_format': 'div'})
+    @uc3_ns.route('/trips/<trip_id>/map/export/<export_format>')
+    class trip_map(Resource):
+        @auth.require_token
+        def get(self, trip_id, export_format='div', token_status="valid"):
+            token_status = getattr(g, 'token_status', 'none')
+
+            if token_status != "valid":
+                return {"error": "Authentication Issue | Check User Credentials"}, 403
+
+            if export_format not in ALLOWED_FORMATS_MAP:
+                return {"error": "Invalid format. Allowed values are: 'div', 'html'."}, 400
+            html_map = trips.create_trip_map(dataset_url=decrypted_dataset_path, trip_id=trip_id)
+            if html_map is None:
+                return {"error": "Trip '{}' not found.".format(trip_id)}, 404
+            if export_format == 'html':
+                return Response(
+                    render_html_template(html_map),
+                    mimetype="text/html",
+                    headers={"Content-disposition": "attachment; filename=map.html"}
+                )
+            else:
+                return html_map
+
+    def parse_encounter_params():
+        parser = reqparse.RequestParser()
+        parser.add_argument('distance', type=float, default=encounters.ENCOUNTER_DISTANCE_M, help="Encounter distance in metres")
+        parser.add_argument('window', type=int, default=encounters.ENCOUNTER_SLOT_SECONDS, help="Time window in seconds")
+        args = parser.parse_args()
+        return encounters.check_params(args['distance'], args['window'])
+
+    # ### API for getting close encounters between vessels ###
+    ###########################################################
+    @uc3_ns.route('/encounters', defaults={'export_format': 'json'})
+    @uc3_ns.route('/encounters/export/<export_format>')
+    class get_fleet_encounters(Resource):
+        @auth.require_token
+        def get(self, export_format='json', token_status="valid"):
+            token_status = getattr(g, 'token_status', 'none')
+
+            if token_status != "valid":
+                return {"error": "Authentication Issue | Check User Credentials"}, 403
+
+            if export_format not in ALLOWED_FORMATS_DATA:
+                return {"error": "Invalid format. Allowed values are: 'json', 'csv', 'xlsx'."}, 400
+            try:
+                params = parse_encounter_params()
+            except ValueError as e:
+                return {"error": str(e)}, 400
+            data = encounters.get_fleet_encounters(dataset_url=decrypted_dataset_path, **params)
+            return data_to_export_format(data, export_format)
+
+    # ### API for getting close encounters of a specific vessel ###
+    ###########################################################
+    @uc3_ns.route('/vessel/<shipid>/encounters', defaults={'export_format': 'json'})
+    @uc3_ns.route('/vessel/<shipid>/encounters/export/<export_format>')
+    class get_vessel_encounters(Resource):
+        @auth.require_token
+        def get(self, shipid, export_format='json', token_status="valid"):
+            token_status = getattr(g, 'token_status', 'none')
+
+            if token_status != "valid":
+                return {"error": "Authentication Issue | Check User Credentials"}, 403
+
+            if export_format not in ALLOWED_FORMATS_DATA:
+                return {"error": "Invalid format. Allowed values are: 'json', 'csv', 'xlsx'."}, 400
+            try:
+                params = parse_encounter_params()
+            except ValueError as e:
+                return {"error": str(e)}, 400
+            data = encounters.get_vessel_encounters(dataset_url=decrypted_dataset_path, shipid=shipid, **params)
+            return data_to_export_format(data, export_format)
+
+    # ### API for getting the ingest quality report of the AIS dataset ###
+    ###########################################################
+    @uc3_ns.route('/data/quality')
+    class get_data_quality(Resource):
+        @auth.require_token
+        def get(self, token_status="valid"):
+            token_status = getattr(g, 'token_status', 'none')
+
+            if token_status != "valid":
+                return {"error": "Authentication Issue | Check User Credentials"}, 403
+
+            return ais_store.get_store(decrypted_dataset_path)['quality']
+
+    # ### API for exporting the fixes rejected at ingest, with the failed checks ###
+    ###########################################################
+    @uc3_ns.route('/data/quality/rejected', defaults={'export_format': 'json'})
+    @uc3_ns.route('/data/quality/rejected/export/<export_format>')
+    class get_rejected_data(Resource):
+        @auth.require_token
+        def get(self, export_format='json', token_status="valid"):
+            token_status = getattr(g, 'token_status', 'none')
+
+            if token_status != "valid":
+                return {"error": "Authentication Issue | Check User Credentials"}, 403
+
+            if export_format not in ALLOWED_FORMATS_DATA:
+                return {"error": "Invalid format. Allowed values are: 'json', 'csv', 'xlsx'."}, 400
+            rejected = ais_store.get_store(decrypted_dataset_path)['rejected'].copy()
+            rejected['t'] = rejected['t'].astype(str)
+            data = rejected.astype(object).where(rejected.notna(), None).to_dict('records')
+            return data_to_export_format(data, export_format)
+
+    def parse_rf_params():
+        parser = reqparse.RequestParser()
+        parser.add_argument('window', type=int, default=ais_rf.RF_MATCH_WINDOW_SECONDS, help="Maximum time difference in seconds")
+        parser.add_argument('radius', type=float, default=ais_rf.RF_MATCH_RADIUS_M, help="Maximum distance in metres")
+        args = parser.parse_args()
+        return ais_rf.check_params(args['window'], args['radius'])
+
+    # ### API for getting the association of RF (DOA) fixes with AIS vessels ###
+    ###########################################################
+    @uc3_ns.route('/rf/associations')
+    class get_rf_associations(Resource):
+        @auth.require_token
+        def get(self, token_status="valid"):
+            token_status = getattr(g, 'token_status', 'none')
+
+            if token_status != "valid":
+                return {"error": "Authentication Issue | Check User Credentials"}, 403
+
+            try:
+                params = parse_rf_params()
+            except ValueError as e:
+                return {"error": str(e)}, 400
+            return ais_rf.get_association_report(ais_dataset_path_2025, rf_dataset_path_2025, **params)
+
+    # ### API for getting the RF fixes not explained by any AIS vessel ###
+    ###########################################################
+    @uc3_ns.route('/rf/dark_vessels', defaults={'export_format': 'json'})
+    @uc3_ns.route('/rf/dark_vessels/export/<export_format>')
+    class get_rf_dark_vessels(Resource):
+        @auth.require_token
+        def get(self, export_format='json', token_status="valid"):
+            token_status = getattr(g, 'token_status', 'none')
+
+            if token_status != "valid":
+                return {"error": "Authentication Issue | Check User Credentials"}, 403
+
+            if export_format not in ALLOWED_FORMATS_DATA:
+                return {"error": "Invalid format. Allowed values are: 'json', 'csv', 'xlsx'."}, 400
+            try:
+                params = parse_rf_params()
+            except ValueError as e:
+                return {"error": str(e)}, 400
+            data = ais_rf.get_dark_vessels(ais_dataset_path_2025, rf_dataset_path_2025, **params)
+            return data_to_export_format(data, export_format)
+
+    # ### API for ingesting a batch of live AIS fixes ###
+    ###########################################################
+    @uc3_ns.route('/live/fixes')
+    class post_live_fixes(Resource):
+        @auth.require_token
+        def post(self, token_status="valid"):
+            token_status = getattr(g, 'token_status', 'none')
+
+            if token_status != "valid":
+                return {"error": "Authentication Issue | Check User Credentials"}, 403
+
+            if getattr(g, 'user_role', 'none') != "data-owner":
+                return {"error": "Only data owners can ingest AIS data."}, 403
+            try:
+                fixes = ais_live.parse_fixes(request.get_json(silent=True))
+            except ValueError as e:
+                return {"error": str(e)}, 400
+            if fixes is None:
+                return {"error": "Expected a JSON list of fixes."}, 400
+            missing = {'t', 'shipid', 'lat', 'lon'} - set(fixes.columns)
+            if fixes.empty or missing:
+                return {"error": "Every fix needs the fields t, shipid, lat and lon."}, 400
+            return ais_store.append_fixes(decrypted_dataset_path, fixes)
+
+    # ### API for streaming the vessel positions that changed (Server-Sent Events) ###
+    ###########################################################
+    @uc3_ns.route('/live/positions')
+    class stream_live_positions(Resource):
+        @auth.require_token
+        def get(self, token_status="valid"):
+            token_status = getattr(g, 'token_status', 'none')
+
+            if token_status != "valid":
+                return {"error": "Authentication Issue | Check User Credentials"}, 403
+
+            # Stream only the dataset and fields the role may see
+            policy = ais_views.ROLE_VIEWS.get(getattr(g, 'user_role', 'none'))
+            if policy is None:
+                return {"error": "Authentication Issue | Check User Credentials"}, 403
+            parser = reqparse.RequestParser()
+            parser.add_argument('since', type=str, help="Id of the last event received")
+            # Reconnecting EventSource clients resume from the last event id
+            since = request.headers.get('Last-Event-ID') or parser.parse_args()['since']
+            return Response(
+                stream_with_context(ais_live.stream_positions(role_datasets[policy['dataset']], since, policy['columns'])),
+                mimetype='text/event-stream',
+                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+            )
+
+    def parse_query_args():
+        parser = reqparse.RequestParser()
+        parser.add_argument('shipid', type=str, action='append', help="Vessel identifier (repeatable)")
+        parser.add_argument('shiptype', type=str, action='append', help="Ship type code or name (repeatable)")
+        parser.add_argument('status', type=float, action='append', help="Navigational status (repeatable)")
+        parser.add_argument('speed_min', type=float, help="Minimum speed in knots")
+        parser.add_argument('speed_max', type=float, help="Maximum speed in knots")
+        parser.add_argument('draught_min', type=float, help="Minimum draught in metres")
+        parser.add_argument('draught_max', type=float, help="Maximum draught in metres")
+        parser.add_argument('destination', type=str, help="Destination prefix (case-insensitive)")
+        parser.add_argument('bbox', type=str, help="min_lon,min_lat,max_lon,max_lat")
+        parser.add_argument('from', type=str, help="Start of the time window")
+        parser.add_argument('to', type=str, help="End of the time window")
+        parser.add_argument('fields', type=str, help="Comma separated fields to return")
+        parser.add_argument('order_by', type=str, help="Field to order by, prefixed with '-' for descending")
+        parser.add_argument('limit', type=int, help="Maximum number of fixes returned")
+        return parser.parse_args()
+
+    # ### API for querying AIS fixes with filters, projection, ordering and limit ###
+    ###########################################################
+    @uc3_ns.route('/query', defaults={'export_format': 'json'})
+    @uc3_ns.route('/query/export/<export_format>')
+    class query_ais_data(Resource):
+        @auth.require_token
+        def get(self, export_format='json', token_status="valid"):
+            token_status = getattr(g, 'token_status', 'none')
+
+            if token_status != "valid":
+                return {"error": "Authentication Issue | Check User Credentials"}, 403
+
+            if export_format not in ALLOWED_FORMATS_DATA:
+                return {"error": "Invalid format. Allowed values are: 'json', 'csv', 'xlsx'."}, 400
+            policy = ais_views.ROLE_VIEWS.get(getattr(g, 'user_role', 'none'))
+            if policy is None:
+                return {"error": "User Role is not allowed to access these fields."}, 403
+            try:
+                query = ais_query.compile_query(parse_query_args(), default_fields=policy['columns'])
+            except ValueError as e:
+                return {"error": str(e)}, 400
+            # Fields outside the role view can be neither returned nor filtered on
+            if not query['columns'] <= set(policy['columns']):
+                return {"error": "User Role is not allowed to access these fields."}, 403
+
+            result = ais_query.run_query(role_datasets[policy['dataset']], query)
+            if export_format == 'json':
+                return result
+            return data_to_export_format(result['rows'], export_format)
+
+    return uc3_ns
@@ -6,9 +6,10 @@ from apis.uc2_SKG import init_uc2_skg
 from apis.uc3 import init_uc3
 from apis.login import init_login
 from apis.uc1 import init_uc1
-from flask import send_file
-from static.ship_predictions import generate_prediction_map
+from flask import Response, request, jsonify
+from static.ship_predictions import generate_prediction_map, list_timestamps, get_accuracy_report, render_accuracy_chart
 import os
+import pandas as pd
 
 apidoc.apidoc.url_prefix = '/pava'
 app = Flask(__name__, static_folder='static', static_url_path='/pava/static')
@@ -20,13 +21,63 @@ def serve_swagger_ui():
     return app.send_static_file('swaggerui/index.html')
 
 
-@app.route('/pava/ship_prediction_map', methods=['GET'])
-def ship_prediction_map():
+def prediction_archive_path():
     # Point to the location of your dataset
     data_dir = os.path.abspath(os.path.join(os.getcwd(), '.', 'data'))
-    csv_path = os.path.join(data_dir, 'FLP_test_result.zip')
-    map_path = generate_prediction_map(csv_path)
-    return send_file(map_path, mimetype='text/html')
+    return os.path.join(data_dir, 'FLP_test_result.zip')
+
+
+def observed_ais_path():
+    # AIS tracks the predictions are evaluated against
+    data_dir = os.path.abspath(os.path.join(os.getcwd(), '.', 'data'))
+    return os.path.join(data_dir, 'ais.csv')
+
+
+@app.route('/pava/ship_prediction_map', methods=['GET'])
+def ship_prediction_map():
+    # Optional selection: ?timestamp=2023-01-01T10:00:00&oid=123&max_horizon=1800
+    # Only the query parameters are validated here, archive errors are not client errors
+    timestamp = request.args.get('timestamp')
+    if timestamp is not None:
+        try:
+            timestamp = pd.Timestamp(timestamp)
+        except ValueError:
+            timestamp = pd.NaT
+        if pd.isna(timestamp):
+            return jsonify({"error": "Invalid timestamp."}), 400
+    max_horizon = request.args.get('max_horizon')
+    if max_horizon is not None:
+        try:
+            max_horizon = int(max_horizon)
+        except ValueError:
+            return jsonify({"error": "Invalid max_horizon, expected a number of seconds."}), 400
+
+    html_map = generate_prediction_map(
+        prediction_archive_path(),
+        timestamp=timestamp,
+        oid=request.args.get('oid'),
+        max_horizon=max_horizon
+    )
+    if html_map is None:
+        return jsonify({"error": "No predictions available for this selection."}), 404
+    return Response(html_map, mimetype='text/html')
+
+
+@app.route('/pava/ship_prediction_map/timestamps', methods=['GET'])
+def ship_prediction_timestamps():
+    return jsonify(list_timestamps(prediction_archive_path()))
+
+@app.route('/pava/ship_prediction_accuracy', methods=['GET'])
+def ship_prediction_accuracy():
+    return jsonify(get_accuracy_report(prediction_archive_path(), observed_ais_path()))
+
+
+@app.route('/pava/ship_prediction_accuracy/chart', methods=['GET'])
+def ship_prediction_accuracy_chart():
+    chart = render_accuracy_chart(prediction_archive_path(), observed_ais_path())
+    if chart is None:
+        return jsonify({"error": "No prediction could be matched with observed AIS positions."}), 404
+    return Response(chart, mimetype='image/png')
 
 # Create the blueprint for your API without the prefix
 api_blueprint = Blueprint('api', __name__)
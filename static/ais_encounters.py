@@ -0,0 +1,247 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import static.ais_store as store
+import static.ais_trips as trips
+from static.geo import haversine_m
+
+ENCOUNTER_DISTANCE_M = 1000
+ENCOUNTER_SLOT_SECONDS = 60
+# Accepted query parameters: every window is cached per store, and short windows
+# interpolate one position per vessel per window
+ENCOUNTER_DISTANCE_RANGE_M = (10, 10000)
+ENCOUNTER_WINDOWS_SECONDS = (30, 60, 120, 300, 600, 900, 1800, 3600)
+# Pairs where both vessels are slower than this are berthed side by side, not encounters
+ENCOUNTER_MIN_SPEED_KNOTS = 0.5
+# Below this many interpolated positions the process pool costs more than it saves
+PARALLEL_MIN_POSITIONS = 200000
+ENCOUNTER_WORKERS = os.cpu_count() or 1
+
+METRES_PER_DEGREE = 111320.0
+# Half of the 3x3 neighbourhood: every pair of adjacent cells is compared exactly once
+NEIGHBOUR_OFFSETS = [(0, 0), (1, 0), (0, 1), (1, 1), (1, -1)]
+
+
+def interpolate_positions(df, trip_table, slot_seconds=ENCOUNTER_SLOT_SECONDS):
+    """
+    Resamples every trip onto a regular time grid by linear interpolation.
+
+    Positions are never interpolated across trip boundaries (reporting gaps or jumps).
+
+    Args:
+        df (DataFrame): AIS rows sorted by shipid and t.
+        trip_table (DataFrame): Trip table of df as returned by static.ais_trips.segment_trips.
+        slot_seconds (int): Width of a time slot.
+
+    Returns:
+        A pandas DataFrame with the columns slot, ship (integer code), lat, lon and speed,
+        and the array of shipids the codes refer to.
+    """
+    ship_codes, shipids = pd.factorize(df['shipid'])
+    seconds = store.epoch_seconds(df['t'])
+    lat = df['lat'].to_numpy(dtype=float)
+    lon = df['lon'].to_numpy(dtype=float)
+    speed = df['speed'].to_numpy(dtype=float)
+
+    starts = trip_table['start_row'].to_numpy(dtype=np.int64)
+    stops = trip_table['stop_row'].to_numpy(dtype=np.int64)
+    t_start, t_end = seconds[starts], seconds[stops - 1]
+    first_slot = np.round(t_start / slot_seconds).astype(np.int64)
+    last_slot = np.round(t_end / slot_seconds).astype(np.int64)
+    counts = last_slot - first_slot + 1
+
+    trip_idx = np.repeat(np.arange(len(starts)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    slots = first_slot[trip_idx] + offsets
+    query = np.clip(slots * slot_seconds, t_start[trip_idx], t_end[trip_idx])
+
+    # Searching (trip, time) keys finds the fix preceding each query inside its own trip
+    span = int(seconds.max() - seconds.min()) + 1
+    row_trip = np.repeat(np.arange(len(starts)), stops - starts)
+    row_keys = row_trip * span + (seconds - seconds.min())
+    query_keys = trip_idx * span + (query - seconds.min())
+    i = np.clip(np.searchsorted(row_keys, query_keys, side='right') - 1, starts[trip_idx], stops[trip_idx] - 1)
+    j = np.minimum(i + 1, stops[trip_idx] - 1)
+    dt = seconds[j] - seconds[i]
+    w = np.where(dt > 0, (query - seconds[i]) / np.where(dt > 0, dt, 1), 0.0)
+
+    positions = pd.DataFrame({
+        'slot': slots,
+        'ship': ship_codes[i],
+        'lat': lat[i] + w * (lat[j] - lat[i]),
+        'lon': lon[i] + w * (lon[j] - lon[i]),
+        'speed': np.fmax(speed[i], speed[j])
+    })
+    # Adjacent trips of a vessel may both round onto the same slot
+    positions = positions.drop_duplicates(subset=['slot', 'ship'])
+    return positions, np.asarray(shipids)
+
+
+def find_close_pairs(positions, distance_m, lat_cell, lon_cell, min_speed=ENCOUNTER_MIN_SPEED_KNOTS):
+    """
+    Finds vessel pairs closer than distance_m within the same slot using a (slot, cell) hash join.
+
+    Args:
+        positions (DataFrame): Interpolated positions (slot, ship, lat, lon, speed).
+        distance_m (float): Encounter distance.
+        lat_cell, lon_cell (float): Grid cell size in degrees, at least distance_m wide.
+        min_speed (float): At least one of the vessels must be this fast (knots).
+
+    Returns:
+        A pandas DataFrame with one row per close pair and slot.
+    """
+    cells = positions.assign(
+        cx=np.floor(positions['lon'].to_numpy() / lon_cell).astype(np.int64),
+        cy=np.floor(positions['lat'].to_numpy() / lat_cell).astype(np.int64)
+    )
+    pairs = []
+    for dx, dy in NEIGHBOUR_OFFSETS:
+        shifted = cells.assign(cx=cells['cx'] + dx, cy=cells['cy'] + dy)
+        merged = shifted.merge(cells, on=['slot', 'cx', 'cy'], suffixes=('_a', '_b'))
+        if (dx, dy) == (0, 0):
+            merged = merged[merged['ship_a'] < merged['ship_b']]
+        else:
+            merged = merged[merged['ship_a'] != merged['ship_b']]
+        if merged.empty:
+            continue
+        merged = merged[np.fmax(merged['speed_a'], merged['speed_b']) >= min_speed]
+        distance = haversine_m(merged['lat_a'], merged['lon_a'], merged['lat_b'], merged['lon_b'])
+        close = distance <= distance_m
+        merged = merged[close]
+        if merged.empty:
+            continue
+        swap = (merged['ship_a'] > merged['ship_b']).to_numpy()
+        pairs.append(pd.DataFrame({
+            'slot': merged['slot'].to_numpy(),
+            'ship_a': np.where(swap, merged['ship_b'], merged['ship_a']),
+            'ship_b': np.where(swap, merged['ship_a'], merged['ship_b']),
+            'distance_m': distance[close],
+            'lat': ((merged['lat_a'] + merged['lat_b']) / 2).to_numpy(),
+            'lon': ((merged['lon_a'] + merged['lon_b']) / 2).to_numpy()
+        }))
+    if not pairs:
+        return pd.DataFrame(columns=['slot', 'ship_a', 'ship_b', 'distance_m', 'lat', 'lon'])
+    return pd.concat(pairs, ignore_index=True)
+
+
+def _find_pairs_partitioned(positions, distance_m, lat_cell, lon_cell, min_speed):
+    if len(positions) < PARALLEL_MIN_POSITIONS or ENCOUNTER_WORKERS < 2:
+        return find_close_pairs(positions, distance_m, lat_cell, lon_cell, min_speed)
+
+    # Pairs never span slots, so hashing slots over the workers keeps partitions independent
+    partition = positions['slot'].to_numpy() % ENCOUNTER_WORKERS
+    chunks = [positions[partition == p] for p in range(ENCOUNTER_WORKERS)]
+    with ProcessPoolExecutor(max_workers=ENCOUNTER_WORKERS) as pool:
+        results = list(pool.map(
+            find_close_pairs, chunks,
+            [distance_m] * len(chunks), [lat_cell] * len(chunks),
+            [lon_cell] * len(chunks), [min_speed] * len(chunks)
+        ))
+    return pd.concat(results, ignore_index=True)
+
+
+def detect_encounters(df, trip_table, distance_m=ENCOUNTER_DISTANCE_M, slot_seconds=ENCOUNTER_SLOT_SECONDS,
+                      min_speed=ENCOUNTER_MIN_SPEED_KNOTS):
+    """
+    Detects close encounters between vessels.
+
+    Consecutive slots in which the same pair stays within distance_m are merged
+    into a single encounter.
+
+    Args:
+        df (DataFrame): AIS rows sorted by shipid and t.
+        trip_table (DataFrame): Trip table of df.
+        distance_m (float): Encounter distance.
+        slot_seconds (int): Time window within which positions are compared.
+        min_speed (float): At least one of the vessels must be this fast (knots).
+
+    Returns:
+        A pandas DataFrame with one row per encounter.
+    """
+    columns = ['ship_a', 'ship_b', 'start', 'end', 'duration_min', 'min_distance_m', 'lat', 'lon']
+    if df.empty:
+        return pd.DataFrame(columns=columns)
+
+    positions, shipids = interpolate_positions(df, trip_table, slot_seconds)
+    max_abs_lat = min(np.abs(positions['lat']).max(), 89.0)
+    lat_cell = distance_m / METRES_PER_DEGREE
+    lon_cell = distance_m / (METRES_PER_DEGREE * np.cos(np.radians(max_abs_lat)))
+
+    pairs = _find_pairs_partitioned(positions, distance_m, lat_cell, lon_cell, min_speed)
+    if pairs.empty:
+        return pd.DataFrame(columns=columns)
+
+    pairs = pairs.sort_values(['ship_a', 'ship_b', 'slot'], kind='mergesort').reset_index(drop=True)
+    ship_a, ship_b, slot = (pairs[c].to_numpy() for c in ('ship_a', 'ship_b', 'slot'))
+    new_encounter = np.r_[True, (ship_a[1:] != ship_a[:-1]) | (ship_b[1:] != ship_b[:-1]) | (np.diff(slot) > 1)]
+    pairs['encounter'] = np.cumsum(new_encounter) - 1
+
+    grouped = pairs.groupby('encounter')
+    closest = pairs.loc[grouped['distance_m'].idxmin()]
+    start = grouped['slot'].min().to_numpy() * slot_seconds
+    end = grouped['slot'].max().to_numpy() * slot_seconds
+    return pd.DataFrame({
+        'ship_a': shipids[closest['ship_a'].to_numpy(dtype=np.int64)],
+        'ship_b': shipids[closest['ship_b'].to_numpy(dtype=np.int64)],
+        'start': pd.to_datetime(start, unit='s', utc=True),
+        'end': pd.to_datetime(end, unit='s', utc=True),
+        'duration_min': (end - start) / 60,
+        'min_distance_m': closest['distance_m'].to_numpy().round(1),
+        'lat': closest['lat'].to_numpy(),
+        'lon': closest['lon'].to_numpy()
+    }, columns=columns)
+
+
+def check_params(distance_m, slot_seconds):
+    """
+    Validates the encounter parameters of a query.
+
+    Args:
+        distance_m (float): Encounter distance, within ENCOUNTER_DISTANCE_RANGE_M.
+        slot_seconds (int): Time window, one of ENCOUNTER_WINDOWS_SECONDS.
+
+    Returns:
+        A dict with distance_m (rounded to the metre) and slot_seconds.
+
+    Raises:
+        ValueError: If a parameter is out of range or not finite.
+    """
+    low, high = ENCOUNTER_DISTANCE_RANGE_M
+    if not np.isfinite(distance_m) or not low <= distance_m <= high:
+        raise ValueError("Distance must be between {} and {} metres.".format(low, high))
+    if slot_seconds not in ENCOUNTER_WINDOWS_SECONDS:
+        raise ValueError("Window must be one of {} seconds.".format(
+            ', '.join(str(window) for window in ENCOUNTER_WINDOWS_SECONDS)))
+    return {'distance_m': int(round(distance_m)), 'slot_seconds': int(slot_seconds)}
+
+
+def get_encounters(dataset_url, distance_m=ENCOUNTER_DISTANCE_M, slot_seconds=ENCOUNTER_SLOT_SECONDS):
+    """Returns the cached encounter table for the given distance and time window."""
+    key = ('encounters', distance_m, slot_seconds)
+    return store.get_derived(
+        dataset_url, key,
+        # The trips of the same snapshot as the positions
+        lambda ais_store: detect_encounters(
+            ais_store['df'], trips.get_trips(dataset_url, ais_store), distance_m, slot_seconds
+        )
+    )
+
+
+def encounters_to_records(encounters):
+    if encounters.empty:
+        return []
+    records = encounters.copy()
+    records['start'] = records['start'].dt.strftime('%Y-%m-%d %H:%M:%S')
+    records['end'] = records['end'].dt.strftime('%Y-%m-%d %H:%M:%S')
+    return records.to_dict('records')
+
+
+def get_fleet_encounters(dataset_url, **params):
+    return encounters_to_records(get_encounters(dataset_url, **params))
+
+
+def get_vessel_encounters(dataset_url, shipid, **params):
+    encounters = get_encounters(dataset_url, **params)
+    shipid = str(shipid)
+    return encounters_to_records(encounters[(encounters['ship_a'] == shipid) | (encounters['ship_b'] == shipid)])
@@ -0,0 +1,212 @@
+import io
+import os
+import sys
+import json
+import logging
+import base64
+import binascii
+import pickle
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from static.iroute_catalog import write_atomically
+
+ENCRYPTED_PREFIX = 'encrypted_'
+ENCRYPTED_CHUNK_ROWS = 50000
+COLUMNAR_SUFFIX = '_columnar.parquet'
+METADATA_KEY = b'ais_encrypted'
+
+# The only globals an encrypted cell may reference: a pickled numpy array and its dtype
+_ALLOWED_GLOBALS = {
+    ('numpy.core.multiarray', '_reconstruct'),
+    ('numpy._core.multiarray', '_reconstruct'),
+    ('numpy', 'ndarray'),
+    ('numpy', 'dtype')
+}
+
+
+class _ArrayUnpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        if (module, name) not in _ALLOWED_GLOBALS:
+            raise pickle.UnpicklingError("global '{}.{}' is not allowed".format(module, name))
+        return super().find_class(module, name)
+
+
+def decode_cell(text):
+    """
+    Decodes one base64 pickled ciphertext cell.
+
+    Only numpy arrays can be rebuilt, so a malicious cell cannot execute code.
+
+    Args:
+        text (str): The cell content, a (nonce bytes, ndarray) tuple or an ndarray.
+
+    Returns:
+        A tuple (nonce, ndarray), or None if the cell is empty or not a ciphertext.
+    """
+    if not isinstance(text, str) or not text.strip():
+        return None
+    try:
+        payload = _ArrayUnpickler(io.BytesIO(base64.b64decode(text))).load()
+    except (binascii.Error, pickle.UnpicklingError, ValueError, TypeError, EOFError, AttributeError):
+        return None
+    if isinstance(payload, np.ndarray):
+        return b'', payload
+    if (isinstance(payload, tuple) and len(payload) == 2
+            and isinstance(payload[0], bytes) and isinstance(payload[1], np.ndarray)):
+        return payload
+    return None
+
+
+def columnar_path(dataset_url):
+    return os.path.splitext(dataset_url)[0] + COLUMNAR_SUFFIX
+
+
+def _source_signature(dataset_url):
+    stat = os.stat(dataset_url)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def _read_metadata(path):
+    metadata = pq.read_schema(path).metadata or {}
+    if METADATA_KEY not in metadata:
+        return None
+    return json.loads(metadata[METADATA_KEY])
+
+
+def is_current(dataset_url):
+    """Tells whether the columnar file of a dataset exists and was built from its current version."""
+    path = columnar_path(dataset_url)
+    if not os.path.exists(path):
+        return False
+    metadata = _read_metadata(path)
+    return metadata is not None and metadata['source'] == _source_signature(dataset_url)
+
+
+def _smallest_int_dtype(low, high):
+    for dtype in (np.int8, np.int16, np.int32, np.int64):
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+def _pack_column(cells, name):
+    """
+    Packs the decoded cells of one column into fixed-width binary Arrow arrays.
+
+    Args:
+        cells (list): decode_cell results of a column with at least one ciphertext.
+        name (str): The column name, for errors.
+
+    Returns:
+        A tuple (nonces, values, layout).
+    """
+    decoded = [cell for cell in cells if cell is not None]
+    shape = decoded[0][1].shape
+    nonce_bytes = len(decoded[0][0])
+    if any(cell[1].shape != shape or len(cell[0]) != nonce_bytes for cell in decoded):
+        raise ValueError("{} holds ciphertexts of different shapes".format(name))
+
+    stacked = np.stack([cell[1] for cell in decoded])
+    dtype = stacked.dtype
+    if np.issubdtype(dtype, np.integer):
+        # Ciphertext digits are small integers, store them at the narrowest lossless width
+        dtype = _smallest_int_dtype(int(stacked.min()), int(stacked.max()))
+    width = int(np.prod(shape)) * dtype.itemsize
+    stacked = stacked.astype(dtype)
+
+    values, nonces = [], []
+    row = 0
+    for cell in cells:
+        if cell is None:
+            values.append(None)
+            nonces.append(None)
+        else:
+            values.append(stacked[row].tobytes())
+            nonces.append(cell[0])
+            row += 1
+    layout = {'shape': list(shape), 'dtype': dtype.str, 'nonce_bytes': nonce_bytes}
+    return (
+        pa.array(nonces, type=pa.binary(nonce_bytes)) if nonce_bytes else None,
+        pa.array(values, type=pa.binary(width)),
+        layout
+    )
+
+
+def ingest(dataset_url, output_path=None, chunk_rows=ENCRYPTED_CHUNK_ROWS):
+    """
+    Decodes the encrypted_* columns of a dataset once and writes a columnar copy.
+
+    The plaintext-safe columns are kept as they are; every encrypted column becomes a
+    fixed-width binary column (plus a <column>_nonce column) whose shape and dtype are
+    recorded in the file metadata. An encrypted column holding anything but ciphertexts
+    (or no ciphertext at all) is kept as its original text instead, with a 'raw' layout,
+    so that no column is lost.
+
+    Args:
+        dataset_url (str): The path to the encrypted AIS CSV file.
+        output_path (str): Target Parquet file, defaults to columnar_path(dataset_url).
+        chunk_rows (int): Rows parsed at a time.
+
+    Returns:
+        The path of the written Parquet file.
+    """
+    output_path = output_path or columnar_path(dataset_url)
+    source = _source_signature(dataset_url)
+
+    plain_chunks = []
+    cells, texts = {}, {}
+    for chunk in pd.read_csv(dataset_url, chunksize=chunk_rows):
+        encrypted = [c for c in chunk.columns if c.startswith(ENCRYPTED_PREFIX)]
+        plain_chunks.append(chunk.drop(columns=encrypted))
+        for column in encrypted:
+            column_texts = [text if isinstance(text, str) else None for text in chunk[column]]
+            texts.setdefault(column, []).extend(column_texts)
+            cells.setdefault(column, []).extend(decode_cell(text) for text in column_texts)
+
+    table = pa.Table.from_pandas(pd.concat(plain_chunks, ignore_index=True), preserve_index=False)
+    layouts = {}
+    for column, column_cells in cells.items():
+        undecoded = sum(
+            1 for cell, text in zip(column_cells, texts[column]) if cell is None and text is not None and text.strip()
+        )
+        if undecoded or all(cell is None for cell in column_cells):
+            if undecoded:
+                logging.warning(f"{column} of {dataset_url} holds {undecoded} cells that are not ciphertexts, kept as text")
+            table = table.append_column(column, pa.array(texts[column], type=pa.string()))
+            layouts[column] = {'raw': True}
+            continue
+        nonces, values, layouts[column] = _pack_column(column_cells, column)
+        table = table.append_column(column, values)
+        if nonces is not None:
+            table = table.append_column(column + '_nonce', nonces)
+
+    metadata = dict(table.schema.metadata or {})
+    metadata[METADATA_KEY] = json.dumps({'source': source, 'columns': layouts}).encode()
+    table = table.replace_schema_metadata(metadata)
+
+    # Readers only ever see a complete file
+    write_atomically(output_path, lambda tmp_path: pq.write_table(table, tmp_path))
+    return output_path
+
+
+def read_plain(dataset_url):
+    """
+    Reads the plaintext-safe columns of a dataset without touching the encrypted cells.
+
+    The columnar copy is used when it is current; otherwise the encrypted columns of
+    the CSV are skipped by the parser.
+    """
+    if is_current(dataset_url):
+        path = columnar_path(dataset_url)
+        layouts = _read_metadata(path)['columns']
+        names = [n for n in pq.read_schema(path).names
+                 if n not in layouts and not (n.endswith('_nonce') and n[:-len('_nonce')] in layouts)]
+        return pd.read_parquet(path, columns=names)
+    return pd.read_csv(dataset_url, usecols=lambda column: not column.startswith(ENCRYPTED_PREFIX))
+
+
+if __name__ == '__main__':
+    print(ingest(*sys.argv[1:3]))
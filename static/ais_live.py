@@ -0,0 +1,234 @@
+import io
+import os
+import json
+import time
+import logging
+import threading
+import numpy as np
+import pandas as pd
+import static.ais_store as store
+from static.ais_views import project_positions
+from static.ais_ship_types import ship_types
+
+# Seconds between two polls of a live source
+LIVE_POLL_SECONDS = 5
+# Position updates are coalesced and pushed to stream clients once per tick
+LIVE_STREAM_TICK_SECONDS = 2
+# Idle ticks after which a comment is sent to keep proxies from closing the stream
+LIVE_KEEPALIVE_TICKS = 15
+
+_sources = {}
+_sources_lock = threading.Lock()
+
+
+def parse_fixes(records):
+    """
+    Converts a batch of posted fixes into a frame.
+
+    Args:
+        records (list or dict): A list of fix objects, or a dict holding them under 'fixes'.
+
+    Returns:
+        A pandas DataFrame with t parsed and lat, lon numeric, or None if the payload is
+        not a list of objects.
+
+    Raises:
+        ValueError: If a fix has a t, lat or lon that cannot be read.
+    """
+    if isinstance(records, dict):
+        records = records.get('fixes')
+    if not isinstance(records, list) or not all(isinstance(r, dict) for r in records):
+        return None
+    fixes = pd.DataFrame.from_records(records)
+
+    parsers = {
+        't': lambda values: pd.to_datetime(values, errors='coerce', utc=True),
+        'lat': lambda values: pd.to_numeric(values, errors='coerce'),
+        'lon': lambda values: pd.to_numeric(values, errors='coerce')
+    }
+    for column, parse in parsers.items():
+        if column not in fixes:
+            continue
+        # Only JSON strings and numbers can hold a time or a coordinate
+        readable = fixes[column].map(lambda value: isinstance(value, (str, int, float)) and not isinstance(value, bool))
+        parsed = parse(fixes[column].where(readable))
+        unreadable = parsed.isna() & fixes[column].notna()
+        if unreadable.any():
+            raise ValueError("Fix {} has an invalid {}: {!r}.".format(
+                int(np.flatnonzero(unreadable.to_numpy())[0]), column, fixes[column][unreadable].iloc[0]))
+        fixes[column] = parsed
+    return fixes
+
+
+def _read_new_lines(state, path):
+    """Reads the complete lines appended to a file since the last poll."""
+    size = os.path.getsize(path)
+    if size < state['offset']:
+        # The file was truncated or replaced, start over
+        state['offset'], state['header'] = 0, None
+    if size == state['offset']:
+        return None
+    with open(path, 'rb') as f:
+        f.seek(state['offset'])
+        chunk = f.read(size - state['offset'])
+    complete = chunk.rfind(b'\n') + 1
+    if complete == 0:
+        return None
+    state['offset'] += complete
+    lines = chunk[:complete]
+    if state['header'] is None:
+        header, _, lines = lines.partition(b'\n')
+        state['header'] = header + b'\n'
+    if not lines.strip():
+        return None
+    return pd.read_csv(io.BytesIO(state['header'] + lines))
+
+
+def _read_new_files(state, path):
+    """
+    Reads the CSV files dropped in a directory and not ingested yet.
+
+    A file that cannot be read is logged and skipped until it is replaced.
+
+    Returns:
+        A tuple (fixes, names) with the concatenated fixes (None if there are none) and
+        the files they were read from.
+    """
+    names = sorted(
+        name for name in os.listdir(path)
+        if name.endswith('.csv') and name not in state['seen']
+    )
+    frames, read = [], []
+    for name in names:
+        file_path = os.path.join(path, name)
+        try:
+            stat = os.stat(file_path)
+            signature = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            continue
+        if state['failed'].get(name) == signature:
+            continue
+        try:
+            frames.append(pd.read_csv(file_path))
+        except (OSError, ValueError) as e:
+            logging.warning(f"Skipping unreadable live AIS file {file_path}: {e}")
+            state['failed'][name] = signature
+            continue
+        state['failed'].pop(name, None)
+        read.append(name)
+    if not frames:
+        return None, read
+    return pd.concat(frames, ignore_index=True), read
+
+
+def poll_source(dataset_url, source_path):
+    """
+    Ingests what arrived at a live source since the last poll.
+
+    A source is either an append-only CSV file, tailed from the last complete line,
+    or a directory where complete CSV files are dropped (written as *.tmp and renamed).
+    Dropped files count as ingested only once their fixes are in the store.
+
+    Args:
+        dataset_url (str): The dataset whose store receives the fixes.
+        source_path (str): The live file or directory.
+
+    Returns:
+        The result of static.ais_store.append_fixes, or None if nothing arrived.
+    """
+    with _sources_lock:
+        state = _sources.setdefault((dataset_url, source_path), {
+            'offset': 0, 'header': None, 'seen': set(), 'failed': {}, 'lock': threading.Lock()
+        })
+    with state['lock']:
+        names = []
+        if os.path.isdir(source_path):
+            fixes, names = _read_new_files(state, source_path)
+        elif os.path.exists(source_path):
+            fixes = _read_new_lines(state, source_path)
+        else:
+            fixes = None
+        result = None
+        if fixes is not None and not fixes.empty:
+            # Everything that arrived during one poll is applied as a single version
+            result = store.append_fixes(dataset_url, fixes)
+        state['seen'].update(names)
+        return result
+
+
+def start_live_ingest(dataset_url, source_path, interval=LIVE_POLL_SECONDS):
+    """
+    Polls a live source in a daemon thread.
+
+    Returns:
+        The threading.Event that stops the thread when set.
+    """
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(interval):
+            try:
+                poll_source(dataset_url, source_path)
+            except Exception:
+                # A bad batch must not end live ingest for the rest of the process
+                logging.exception("Live AIS ingest from %s failed", source_path)
+
+    threading.Thread(target=run, name='ais-live-ingest', daemon=True).start()
+    return stop
+
+
+def _position_records(latest, columns):
+    records = project_positions(latest, columns)
+    if 't' in records:
+        records['t'] = records['t'].dt.strftime('%Y-%m-%d %H:%M:%S')
+    if 'shiptype' in records:
+        records['shiptype'] = records['shiptype'].apply(lambda x: ship_types[x] if x in ship_types else 'Unknown')
+    return records.astype(object).where(records.notna(), None).to_dict('records')
+
+
+def get_position_deltas(dataset_url, since_version, columns):
+    """
+    Returns the latest positions that changed after a given store version.
+
+    Args:
+        dataset_url (str): The path to the AIS CSV file.
+        since_version (int): The last version the client has seen (0 for a full snapshot).
+        columns (list): The fields to send for every vessel.
+
+    Returns:
+        A tuple (version, tag, records) with the current store version, its tag (see
+        static.ais_store.store_tag) and the changed positions.
+    """
+    ais_store = store.get_store(dataset_url)
+    version = ais_store['version']
+    if since_version > version:
+        # The client saw a version of an earlier process, send it everything
+        since_version = 0
+    changed = ais_store['latest'][ais_store['latest_versions'].to_numpy() > since_version]
+    return version, store.store_tag(ais_store), _position_records(changed, columns)
+
+
+def stream_positions(dataset_url, since_tag, columns, tick=LIVE_STREAM_TICK_SECONDS,
+                     keepalive_ticks=LIVE_KEEPALIVE_TICKS):
+    """
+    Yields Server-Sent Events with the vessel positions that changed since the previous event.
+
+    All the store versions published during a tick are coalesced into one event whose
+    id is the store tag, so a reconnecting client resumes with Last-Event-ID, also
+    against another worker or after a restart. A tag that does not describe the data
+    of this process starts with a full snapshot.
+    """
+    since_version = store.version_of_tag(store.get_store(dataset_url), since_tag)
+    idle = 0
+    while True:
+        version, tag, records = get_position_deltas(dataset_url, since_version, columns)
+        if records:
+            yield 'id: {}\nevent: positions\ndata: {}\n\n'.format(tag, json.dumps(records))
+            idle = 0
+        else:
+            idle += 1
+            if idle >= keepalive_ticks:
+                yield ': keepalive\n\n'
+                idle = 0
+        since_version = version
+        time.sleep(tick)
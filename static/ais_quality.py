@@ -0,0 +1,151 @@
+import os
+import sys
+import json
+import numpy as np
+import pandas as pd
+from static.geo import haversine_m
+
+# Implied speed (knots) between consecutive fixes above which a fix is considered a teleport
+MAX_IMPLIED_SPEED_KNOTS = 60
+# Reporting gaps longer than this are reported (the fixes are kept)
+MAX_REPORTING_GAP_MINUTES = 30
+METRES_PER_SECOND_TO_KNOTS = 1.943844
+
+# Flags that remove a fix from the cleaned view
+REJECT_FLAGS = ['invalid_time', 'invalid_position', 'duplicate', 'teleport']
+
+
+def validate(df, seconds, max_speed_knots=MAX_IMPLIED_SPEED_KNOTS, max_gap_minutes=MAX_REPORTING_GAP_MINUTES):
+    """
+    Flags bad AIS fixes in one vectorized pass.
+
+    Args:
+        df (DataFrame): Raw AIS rows sorted by shipid and t.
+        seconds (ndarray): Epoch seconds of the t column (undefined where t is NaT).
+        max_speed_knots (float): Implied speed that marks a teleport.
+        max_gap_minutes (float): Reporting gap that is reported.
+
+    Returns:
+        A pandas DataFrame of boolean flags aligned with df (invalid_time, invalid_position,
+        duplicate, teleport, gap_before).
+    """
+    lat = df['lat'].to_numpy(dtype=float)
+    lon = df['lon'].to_numpy(dtype=float)
+    shipids = df['shipid'].to_numpy()
+
+    invalid_time = df['t'].isna().to_numpy()
+    invalid_position = (
+        np.isnan(lat) | np.isnan(lon)
+        | (np.abs(lat) > 90) | (np.abs(lon) > 180)
+        | ((lat == 0) & (lon == 0))
+    )
+    duplicate = df.duplicated(subset=['shipid', 't'], keep='first').to_numpy() & ~invalid_time
+
+    # Speeds and gaps are only measured between fixes that survive the checks above
+    usable = np.flatnonzero(~(invalid_time | invalid_position | duplicate))
+    teleport = np.zeros(len(df), dtype=bool)
+    gap_before = np.zeros(len(df), dtype=bool)
+    if len(usable) > 1:
+        same_ship = shipids[usable[1:]] == shipids[usable[:-1]]
+        dt = np.diff(seconds[usable])
+        distance = haversine_m(lat[usable[:-1]], lon[usable[:-1]], lat[usable[1:]], lon[usable[1:]])
+        too_fast = same_ship & (distance / np.maximum(dt, 1) * METRES_PER_SECOND_TO_KNOTS > max_speed_knots)
+
+        # A teleport is a spike: the fix is unreachable from its predecessor and its successor.
+        # The first and last fix of a vessel have one neighbour only, so they are spikes when
+        # unreachable from it while that neighbour agrees with its own other neighbour; with
+        # a single link (two fixes) nothing tells which end is wrong.
+        jump_in = np.r_[False, too_fast]
+        jump_out = np.r_[too_fast, False]
+        has_prev = np.r_[False, same_ship]
+        has_next = np.r_[same_ship, False]
+        steady_next = np.r_[same_ship[1:] & ~too_fast[1:], False, False]
+        steady_prev = np.r_[False, False, same_ship[:-1] & ~too_fast[:-1]]
+        teleport[usable] = (
+            (jump_in & jump_out)
+            | (~has_prev & jump_out & steady_next)
+            | (~has_next & jump_in & steady_prev)
+        )
+        gap_before[usable[1:]] = same_ship & (dt > max_gap_minutes * 60)
+
+    return pd.DataFrame({
+        'invalid_time': invalid_time,
+        'invalid_position': invalid_position,
+        'duplicate': duplicate,
+        'teleport': teleport,
+        'gap_before': gap_before
+    }, index=df.index)
+
+
+def build_report(df, flags):
+    """
+    Summarises the validation flags of a dataset.
+
+    Args:
+        df (DataFrame): Raw AIS rows.
+        flags (DataFrame): Flags returned by validate.
+
+    Returns:
+        A JSON serializable dict with the counts per check and the vessels with most issues.
+    """
+    rejected = flags[REJECT_FLAGS].any(axis=1)
+    issues = flags[REJECT_FLAGS + ['gap_before']].any(axis=1)
+    worst = df.loc[issues, 'shipid'].value_counts().head(20)
+    return {
+        'rows': int(len(df)),
+        'clean_rows': int((~rejected).sum()),
+        'rejected_rows': int(rejected.sum()),
+        'checks': {name: int(flags[name].sum()) for name in flags.columns},
+        'ships': int(df['shipid'].nunique()),
+        'ships_with_issues': int(df.loc[issues, 'shipid'].nunique()),
+        'worst_ships': [{'shipid': shipid, 'issues': int(count)} for shipid, count in worst.items()]
+    }
+
+
+def clean(df, seconds):
+    """
+    Validates a raw AIS frame and returns the cleaned view with its quality report.
+
+    Args:
+        df (DataFrame): Raw AIS rows sorted by shipid and t.
+        seconds (ndarray): Epoch seconds of the t column.
+
+    Returns:
+        A tuple (clean_df, flags, report).
+    """
+    flags = validate(df, seconds)
+    report = build_report(df, flags)
+    keep = ~flags[REJECT_FLAGS].any(axis=1).to_numpy()
+    return df[keep].reset_index(drop=True), flags, report
+
+
+def write_quality_outputs(dataset_url, output_dir=None):
+    """
+    Writes the quality report (JSON) and the cleaned view (CSV) of a dataset next to it.
+
+    Args:
+        dataset_url (str): The path to the AIS CSV file.
+        output_dir (str): Target directory, defaults to the directory of the dataset.
+
+    Returns:
+        A tuple with the paths of the report and of the cleaned CSV.
+    """
+    import static.ais_store as store
+
+    ais_store = store.get_store(dataset_url)
+    output_dir = output_dir or os.path.dirname(os.path.abspath(dataset_url))
+    stem = os.path.splitext(os.path.basename(dataset_url))[0]
+    report_path = os.path.join(output_dir, stem + '_quality.json')
+    clean_path = os.path.join(output_dir, stem + '_clean.csv')
+
+    with open(report_path, 'w') as f:
+        json.dump(ais_store['quality'], f, indent=2)
+    clean_df = ais_store['df'].copy()
+    clean_df['t'] = clean_df['t'].dt.strftime('%Y-%m-%dT%H:%M:%SZ')
+    clean_df.to_csv(clean_path, index=False)
+    return report_path, clean_path
+
+
+if __name__ == '__main__':
+    for path in write_quality_outputs(*sys.argv[1:3]):
+        print(path)
@@ -0,0 +1,230 @@
+import numpy as np
+import pandas as pd
+import static.ais_store as store
+from static.ais_views import vessel_keys
+from static.ais_ship_types import ship_types
+
+# vessel_key is derived from the shipid of the returned fixes only (see static.ais_views.vessel_keys)
+QUERY_FIELDS = ['t', 'shipid', 'vessel_key', 'lon', 'lat', 'heading', 'course', 'speed', 'status', 'shiptype',
+                'draught', 'destination']
+QUERY_DEFAULT_LIMIT = 1000
+QUERY_MAX_LIMIT = 50000
+
+
+def _ship_type_codes(values):
+    """Resolves ship type codes or names (case-insensitive, e.g. 'Cargo') to numeric codes."""
+    codes = set()
+    for value in values:
+        value = str(value).strip()
+        try:
+            codes.add(float(value))
+            continue
+        except ValueError:
+            pass
+        matches = {code for code, name in ship_types.items() if name.lower() == value.lower()}
+        if not matches:
+            raise ValueError("Unknown ship type '{}'.".format(value))
+        codes.update(matches)
+    return sorted(codes)
+
+
+def _timestamp(value, name):
+    try:
+        timestamp = pd.Timestamp(value)
+    except ValueError:
+        raise ValueError("Invalid {} timestamp.".format(name))
+    return timestamp.tz_localize('UTC') if timestamp.tzinfo is None else timestamp.tz_convert('UTC')
+
+
+def compile_query(args, default_fields=QUERY_FIELDS):
+    """
+    Validates the query parameters and compiles the filters into vectorized predicates.
+
+    Args:
+        args (dict): shipid, shiptype, status (lists), speed_min, speed_max, draught_min,
+            draught_max (numbers), destination (prefix), bbox ('min_lon,min_lat,max_lon,max_lat'),
+            from, to (timestamps), fields (comma separated), order_by (field, '-' for
+            descending) and limit. Missing or None entries are not applied.
+        default_fields (list): The projection when no fields are given.
+
+    Returns:
+        A dict with the predicates (functions from a frame to a boolean array), the index
+        lookups, the projection, the ordering, the limit and the set of columns involved.
+
+    Raises:
+        ValueError: With a message for the client when a parameter is invalid.
+    """
+    predicates, used = [], set()
+    lookups = {}
+
+    def add(column, predicate):
+        predicates.append(predicate)
+        used.add(column)
+
+    if args.get('shipid'):
+        shipids = [str(s) for s in args['shipid']]
+        lookups['shipid'] = shipids
+        add('shipid', lambda df: df['shipid'].isin(shipids).to_numpy())
+    if args.get('shiptype'):
+        codes = _ship_type_codes(args['shiptype'])
+        add('shiptype', lambda df: df['shiptype'].isin(codes).to_numpy())
+    if args.get('status'):
+        statuses = [float(s) for s in args['status']]
+        add('status', lambda df: df['status'].isin(statuses).to_numpy())
+
+    for column in ('speed', 'draught'):
+        low, high = args.get(column + '_min'), args.get(column + '_max')
+        if low is not None and high is not None and low > high:
+            raise ValueError("{0}_min must not be greater than {0}_max.".format(column))
+        # Comparisons with NaN are False, so fixes without a value never match a range
+        if low is not None:
+            add(column, lambda df, c=column, v=low: df[c].to_numpy(dtype=float) >= v)
+        if high is not None:
+            add(column, lambda df, c=column, v=high: df[c].to_numpy(dtype=float) <= v)
+
+    if args.get('destination'):
+        prefix = args['destination'].strip().upper()
+        add('destination', lambda df: (
+            df['destination'].notna() & df['destination'].astype(str).str.upper().str.startswith(prefix)
+        ).to_numpy(dtype=bool))
+
+    if args.get('bbox'):
+        try:
+            min_lon, min_lat, max_lon, max_lat = (float(v) for v in args['bbox'].split(','))
+        except ValueError:
+            raise ValueError("bbox must be 'min_lon,min_lat,max_lon,max_lat'.")
+        if min_lon > max_lon or min_lat > max_lat:
+            raise ValueError("bbox minimum must not be greater than its maximum.")
+        lookups['lat'] = (min_lat, max_lat)
+        add('lat', lambda df: (df['lat'].to_numpy() >= min_lat) & (df['lat'].to_numpy() <= max_lat))
+        add('lon', lambda df: (df['lon'].to_numpy() >= min_lon) & (df['lon'].to_numpy() <= max_lon))
+
+    start = _timestamp(args['from'], 'from') if args.get('from') else None
+    end = _timestamp(args['to'], 'to') if args.get('to') else None
+    if start is not None and end is not None and start > end:
+        raise ValueError("from must not be after to.")
+    if start is not None or end is not None:
+        lookups['t'] = (start, end)
+        if start is not None:
+            add('t', lambda df: (df['t'] >= start).to_numpy())
+        if end is not None:
+            add('t', lambda df: (df['t'] <= end).to_numpy())
+
+    fields = [f.strip() for f in args['fields'].split(',') if f.strip()] if args.get('fields') else list(default_fields)
+    unknown = [f for f in fields if f not in QUERY_FIELDS]
+    if unknown:
+        raise ValueError("Unknown fields: {}.".format(', '.join(unknown)))
+
+    order_by = args.get('order_by')
+    descending = False
+    if order_by:
+        descending = order_by.startswith('-')
+        order_by = order_by.lstrip('-')
+        if order_by not in QUERY_FIELDS:
+            raise ValueError("Unknown order_by field '{}'.".format(order_by))
+        if order_by == 'vessel_key':
+            raise ValueError("Fixes cannot be ordered by vessel_key.")
+        used.add(order_by)
+
+    limit = args.get('limit')
+    if limit is None:
+        limit = QUERY_DEFAULT_LIMIT
+    if limit < 1 or limit > QUERY_MAX_LIMIT:
+        raise ValueError("limit must be between 1 and {}.".format(QUERY_MAX_LIMIT))
+
+    return {
+        'predicates': predicates,
+        'lookups': lookups,
+        'fields': fields,
+        'order_by': order_by,
+        'descending': descending,
+        'limit': limit,
+        'columns': used | set(fields)
+    }
+
+
+def build_query_index(ais_store):
+    """
+    Builds the sorted time and latitude orders of a store used to narrow range filters.
+
+    Returns:
+        A dict with the sorted values and the store rows in that order for 't' and 'lat'.
+    """
+    df = ais_store['df']
+    seconds = store.epoch_seconds(df['t'])
+    lat = df['lat'].to_numpy(dtype=float)
+    time_rows = np.argsort(seconds, kind='stable')
+    lat_rows = np.argsort(lat, kind='stable')
+    return {
+        't': (seconds[time_rows], time_rows),
+        'lat': (lat[lat_rows], lat_rows)
+    }
+
+
+def _candidate_rows(ais_store, index, lookups):
+    """
+    Uses the most selective available index to pick the rows the predicates run on.
+
+    Returns:
+        A sorted array of store rows, or None when no index applies.
+    """
+    candidates = []
+    if 'shipid' in lookups:
+        bounds = [ais_store['ship_index'][s] for s in lookups['shipid'] if s in ais_store['ship_index']]
+        rows = np.concatenate([np.arange(*b) for b in bounds]) if bounds else np.empty(0, dtype=np.int64)
+        candidates.append(rows)
+    if 't' in lookups:
+        start, end = lookups['t']
+        values, rows = index['t']
+        lo = np.searchsorted(values, store.epoch_seconds(pd.Series([start]))[0], side='left') if start is not None else 0
+        hi = np.searchsorted(values, store.epoch_seconds(pd.Series([end]))[0], side='right') if end is not None else len(values)
+        candidates.append(rows[lo:hi])
+    if 'lat' in lookups:
+        low, high = lookups['lat']
+        values, rows = index['lat']
+        lo, hi = np.searchsorted(values, low, side='left'), np.searchsorted(values, high, side='right')
+        candidates.append(rows[lo:hi])
+    if not candidates:
+        return None
+    return np.sort(min(candidates, key=len))
+
+
+def run_query(dataset_url, query):
+    """
+    Runs a compiled query over the AIS store.
+
+    Args:
+        dataset_url (str): The path to the AIS CSV file.
+        query (dict): A query returned by compile_query.
+
+    Returns:
+        A dict with the store tag (see static.ais_store.store_tag), the number of matching
+        fixes and the first `limit` fixes (projected and ordered) as records.
+    """
+    ais_store = store.get_store(dataset_url)
+    df = ais_store['df']
+    index = store.derive(ais_store, 'query_index', build_query_index)
+
+    rows = _candidate_rows(ais_store, index, query['lookups'])
+    subset = df if rows is None else df.iloc[rows]
+    mask = np.ones(len(subset), dtype=bool)
+    for predicate in query['predicates']:
+        mask &= predicate(subset)
+    matches = subset[mask]
+
+    if query['order_by']:
+        matches = matches.sort_values(query['order_by'], ascending=not query['descending'],
+                                      kind='mergesort', na_position='last')
+    page = matches.head(query['limit'])
+    if 'vessel_key' in query['fields']:
+        page = page.assign(vessel_key=vessel_keys(page['shipid']))
+    result = page[query['fields']].copy()
+    if 't' in result:
+        result['t'] = result['t'].dt.strftime('%Y-%m-%d %H:%M:%S')
+    if 'shiptype' in result:
+        result['shiptype'] = result['shiptype'].apply(lambda x: ship_types[x] if x in ship_types else 'Unknown')
+    return {
+        'tag': store.store_tag(ais_store),
+        'total': int(len(matches)),
+        'rows': result.astype(object).where(result.notna(), None).to_dict('records')
+    }
@@ -0,0 +1,210 @@
+import os
+import threading
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import BallTree
+import static.ais_store as store
+from static.geo import haversine_m, EARTH_RADIUS_M
+
+# An RF direction-of-arrival fix is explained by an AIS vessel reporting within this window and distance
+RF_MATCH_WINDOW_SECONDS = 120
+RF_MATCH_RADIUS_M = 2000
+# Accepted query parameters: every association is cached per store
+RF_MATCH_RADIUS_RANGE_M = (10, 20000)
+RF_MATCH_WINDOWS_SECONDS = (30, 60, 120, 300, 600, 900, 1800, 3600)
+
+_rf_cache = {}
+_rf_lock = threading.Lock()
+
+
+def load_rf_fixes(rf_dataset_url):
+    """
+    Loads the RF (DOA) fixes once per file version.
+
+    Args:
+        rf_dataset_url (str): The path to the DOA CSV file.
+
+    Returns:
+        A tuple (signature, DataFrame) with the columns t, lon, lat and seconds.
+    """
+    stat = os.stat(rf_dataset_url)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    with _rf_lock:
+        cached = _rf_cache.get(rf_dataset_url)
+        if cached is not None and cached[0] == signature:
+            return cached
+
+        rf = pd.read_csv(rf_dataset_url, usecols=['t', 'lon', 'lat'])
+        rf['t'] = pd.to_datetime(rf['t'], errors='coerce', utc=True)
+        rf = rf.dropna(subset=['t', 'lon', 'lat']).reset_index(drop=True)
+        rf['seconds'] = store.epoch_seconds(rf['t'])
+        _rf_cache[rf_dataset_url] = (signature, rf)
+        return signature, rf
+
+
+def build_time_buckets(ais_store, window_seconds):
+    """
+    Indexes the AIS fixes of a store with one haversine BallTree per time bucket.
+
+    Args:
+        ais_store (dict): The store returned by static.ais_store.get_store.
+        window_seconds (int): Width of a time bucket.
+
+    Returns:
+        A dict mapping each bucket number to (BallTree, store rows of the bucket).
+    """
+    df = ais_store['df']
+    buckets = store.epoch_seconds(df['t']) // window_seconds
+    coords = np.radians(df[['lat', 'lon']].to_numpy(dtype=float))
+    order = np.argsort(buckets, kind='stable')
+    sorted_buckets = buckets[order]
+    bounds = np.flatnonzero(np.r_[True, sorted_buckets[1:] != sorted_buckets[:-1], True])
+    index = {}
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        rows = order[start:stop]
+        index[int(sorted_buckets[start])] = (BallTree(coords[rows], metric='haversine'), rows)
+    return index
+
+
+def associate(ais_store, rf, window_seconds=RF_MATCH_WINDOW_SECONDS, radius_m=RF_MATCH_RADIUS_M):
+    """
+    Matches every RF fix to the AIS vessels reporting near it in space and time.
+
+    Only the AIS time buckets adjacent to each RF bucket are searched; all candidate
+    pairs are then filtered and ranked with array operations.
+
+    Args:
+        ais_store (dict): The store returned by static.ais_store.get_store.
+        rf (DataFrame): RF fixes as returned by load_rf_fixes.
+        window_seconds (int): Maximum time difference between the RF and AIS fixes.
+        radius_m (float): Maximum distance between the RF and AIS fixes.
+
+    Returns:
+        A tuple (matches, rf_summary): every (RF fix, vessel) candidate with its nearest
+        AIS fix, and one row per RF fix with its best match (NaN when unmatched).
+    """
+    df = ais_store['df']
+    index = store.derive(
+        ais_store, ('rf_buckets', window_seconds),
+        lambda ais_store: build_time_buckets(ais_store, window_seconds)
+    )
+
+    rf_buckets = rf['seconds'].to_numpy() // window_seconds
+    rf_coords = np.radians(rf[['lat', 'lon']].to_numpy(dtype=float))
+    rf_rows, ais_rows = [], []
+    for bucket in np.unique(rf_buckets):
+        queries = np.flatnonzero(rf_buckets == bucket)
+        for neighbour in (bucket - 1, bucket, bucket + 1):
+            if int(neighbour) not in index:
+                continue
+            tree, rows = index[int(neighbour)]
+            hits = tree.query_radius(rf_coords[queries], r=radius_m / EARTH_RADIUS_M)
+            lengths = np.fromiter((len(h) for h in hits), dtype=np.int64, count=len(hits))
+            if lengths.sum() == 0:
+                continue
+            rf_rows.append(np.repeat(queries, lengths))
+            ais_rows.append(rows[np.concatenate(hits)])
+
+    match_columns = ['rf_id', 'shipid', 'distance_m', 'dt_s', 'ais_t', 'ais_lat', 'ais_lon']
+    if rf_rows:
+        rf_rows = np.concatenate(rf_rows)
+        ais_rows = np.concatenate(ais_rows)
+        ais_seconds = store.epoch_seconds(df['t'].iloc[ais_rows])
+        dt = ais_seconds - rf['seconds'].to_numpy()[rf_rows]
+        in_window = np.abs(dt) <= window_seconds
+        rf_rows, ais_rows, dt = rf_rows[in_window], ais_rows[in_window], dt[in_window]
+        candidates = pd.DataFrame({
+            'rf_id': rf_rows,
+            'shipid': df['shipid'].to_numpy()[ais_rows],
+            'distance_m': haversine_m(
+                rf['lat'].to_numpy()[rf_rows], rf['lon'].to_numpy()[rf_rows],
+                df['lat'].to_numpy()[ais_rows], df['lon'].to_numpy()[ais_rows]
+            ),
+            'dt_s': dt,
+            'ais_t': df['t'].iloc[ais_rows].array,
+            'ais_lat': df['lat'].to_numpy()[ais_rows],
+            'ais_lon': df['lon'].to_numpy()[ais_rows]
+        })
+        # Keep the nearest fix of each vessel per RF fix
+        matches = (
+            candidates.sort_values(['rf_id', 'distance_m'], kind='mergesort')
+            .drop_duplicates(subset=['rf_id', 'shipid'])
+            .reset_index(drop=True)
+        )
+    else:
+        matches = pd.DataFrame(columns=match_columns)
+
+    best = matches.drop_duplicates(subset=['rf_id']).set_index('rf_id')
+    counts = matches.groupby('rf_id').size()
+    rf_summary = rf[['t', 'lat', 'lon']].copy()
+    rf_summary.insert(0, 'rf_id', np.arange(len(rf)))
+    rf_summary['candidates'] = counts.reindex(rf_summary['rf_id']).fillna(0).astype(int).to_numpy()
+    for column in ['shipid', 'distance_m', 'dt_s', 'ais_lat', 'ais_lon']:
+        rf_summary['matched_' + column] = best[column].reindex(rf_summary['rf_id']).to_numpy()
+    rf_summary['matched'] = rf_summary['candidates'] > 0
+    return matches[match_columns], rf_summary
+
+
+def check_params(window_seconds, radius_m):
+    """
+    Validates the association parameters of a query.
+
+    Args:
+        window_seconds (int): Time window, one of RF_MATCH_WINDOWS_SECONDS.
+        radius_m (float): Match distance, within RF_MATCH_RADIUS_RANGE_M.
+
+    Returns:
+        A dict with window_seconds and radius_m (rounded to the metre).
+
+    Raises:
+        ValueError: If a parameter is out of range or not finite.
+    """
+    if window_seconds not in RF_MATCH_WINDOWS_SECONDS:
+        raise ValueError("Window must be one of {} seconds.".format(
+            ', '.join(str(window) for window in RF_MATCH_WINDOWS_SECONDS)))
+    low, high = RF_MATCH_RADIUS_RANGE_M
+    if not np.isfinite(radius_m) or not low <= radius_m <= high:
+        raise ValueError("Radius must be between {} and {} metres.".format(low, high))
+    return {'window_seconds': int(window_seconds), 'radius_m': int(round(radius_m))}
+
+
+def get_associations(ais_dataset_url, rf_dataset_url, window_seconds=RF_MATCH_WINDOW_SECONDS, radius_m=RF_MATCH_RADIUS_M):
+    """Returns the association of the RF file with the AIS store, cached per version of both."""
+    ais_store = store.get_store(ais_dataset_url)
+    rf_signature, rf = load_rf_fixes(rf_dataset_url)
+    return store.derive(
+        ais_store, ('rf_associations', rf_dataset_url, rf_signature, window_seconds, radius_m),
+        lambda snapshot: associate(snapshot, rf, window_seconds, radius_m)
+    )
+
+
+def _to_records(frame):
+    records = frame.copy()
+    for column in records.columns:
+        if pd.api.types.is_datetime64_any_dtype(records[column]):
+            records[column] = records[column].dt.strftime('%Y-%m-%d %H:%M:%S')
+    return records.astype(object).where(records.notna(), None).to_dict('records')
+
+
+def get_association_report(ais_dataset_url, rf_dataset_url, **params):
+    """
+    Returns the matched and unmatched ("dark vessel") RF fixes as JSON serializable data.
+    """
+    matches, rf_summary = get_associations(ais_dataset_url, rf_dataset_url, **params)
+    matched = rf_summary[rf_summary['matched']]
+    unmatched = rf_summary[~rf_summary['matched']][['rf_id', 't', 'lat', 'lon']]
+    return {
+        'summary': {
+            'rf_fixes': int(len(rf_summary)),
+            'matched': int(len(matched)),
+            'unmatched': int(len(unmatched)),
+            'vessels': int(matches['shipid'].nunique())
+        },
+        'matched': _to_records(matched.drop(columns=['matched'])),
+        'unmatched': _to_records(unmatched)
+    }
+
+
+def get_dark_vessels(ais_dataset_url, rf_dataset_url, **params):
+    _, rf_summary = get_associations(ais_dataset_url, rf_dataset_url, **params)
+    return _to_records(rf_summary[~rf_summary['matched']][['rf_id', 't', 'lat', 'lon']])
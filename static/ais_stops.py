@@ -0,0 +1,223 @@
+import numpy as np
+import pandas as pd
+import static.ais_store as store
+from static.geo import haversine_m
+
+# Default stop definition: slower than 0.5 knots for at least 10 minutes within 500 m
+STOP_SPEED_KNOTS = 0.5
+STOP_MIN_MINUTES = 10
+STOP_RADIUS_M = 500
+# A reporting gap longer than this ends a stay, we cannot tell what happened in between
+STOP_MAX_GAP_MINUTES = 60
+# Accepted query parameters (label, min, max, step): values are rounded to the step so
+# that close definitions share one cached table
+STOP_PARAM_RANGES = {
+    'speed_threshold': ('Speed (knots)', 0.0, 5.0, 0.1),
+    'min_minutes': ('Minimum duration (minutes)', 1, 1440, 1),
+    'radius_m': ('Radius (metres)', 50, 5000, 10)
+}
+# Fixes of a slow run checked at a time when splitting it into stays
+STOP_SPLIT_CHUNK_FIXES = 256
+
+# AIS navigational status codes used to label stays
+STATUS_AT_ANCHOR = 1
+STATUS_MOORED = 5
+
+
+def _run_spread(run_id, lat, lon, n_runs):
+    """Fix count, centroid and largest distance from the centroid (metres) of every run."""
+    fixes = np.bincount(run_id, minlength=n_runs)
+    centroid_lat = np.bincount(run_id, weights=lat, minlength=n_runs) / fixes
+    centroid_lon = np.bincount(run_id, weights=lon, minlength=n_runs) / fixes
+    distances = haversine_m(lat, lon, centroid_lat[run_id], centroid_lon[run_id])
+    max_radius = np.zeros(n_runs)
+    np.maximum.at(max_radius, run_id, distances)
+    return fixes, centroid_lat, centroid_lon, max_radius
+
+
+def _split_runs(run_id, lat, lon, runs, radius_m, chunk=STOP_SPLIT_CHUNK_FIXES):
+    """
+    Splits runs into stays: a fix farther than radius_m from the centroid of the fixes of
+    its stay so far starts a new stay.
+
+    All the runs advance together with array operations: in every pass each open stay
+    checks its next fixes against its running centroid and either splits at the first
+    one too far away or takes them all in. A stay checks twice as many fixes as it last
+    took in, up to chunk, so short stays waste little work. The number of passes grows
+    with the number of stays of the longest run, not with its fixes.
+
+    Args:
+        run_id (ndarray): Run of every slow fix, consecutive from 0.
+        lat, lon (ndarray): Coordinates of the slow fixes.
+        runs (ndarray): The runs to split.
+        radius_m (float): Maximum stay radius.
+        chunk (int): Most fixes checked per stay and pass.
+
+    Returns:
+        The new run of every slow fix, consecutive from 0.
+    """
+    run_start = np.r_[True, run_id[1:] != run_id[:-1]]
+    first = np.flatnonzero(run_start)
+    last = np.r_[first[1:], len(run_id)]
+
+    # State of every open stay: next fix to check, end of its run, sums and count of its fixes
+    position, end = first[runs] + 1, last[runs]
+    sum_lat, sum_lon = lat[first[runs]], lon[first[runs]]
+    count = np.ones(len(runs))
+    size = np.full(len(runs), min(chunk, 8))
+    while True:
+        open_ = position < end
+        position, end, sum_lat, sum_lon, count, size = (
+            position[open_], end[open_], sum_lat[open_], sum_lon[open_], count[open_], size[open_])
+        if not len(position):
+            break
+        lengths = np.minimum(end - position, size)
+        offsets = np.cumsum(lengths) - lengths
+        stay = np.repeat(np.arange(len(position)), lengths)
+        step = np.arange(lengths.sum()) - offsets[stay]
+        rows = position[stay] + step
+
+        # Centroid of the stay before each checked fix
+        cum_lat, cum_lon = np.cumsum(lat[rows]), np.cumsum(lon[rows])
+        before_lat = cum_lat - lat[rows] - (cum_lat[offsets] - lat[rows[offsets]])[stay]
+        before_lon = cum_lon - lon[rows] - (cum_lon[offsets] - lon[rows[offsets]])[stay]
+        n = count[stay] + step
+        far = haversine_m(lat[rows], lon[rows], (sum_lat[stay] + before_lat) / n, (sum_lon[stay] + before_lon) / n) > radius_m
+
+        split = np.minimum.reduceat(np.where(far, step, chunk), offsets)
+        splits = split < chunk
+        # A stay that split restarts from the far fix alone
+        split_rows = position[splits] + split[splits]
+        run_start[split_rows] = True
+        # The others take the whole chunk in
+        taken = lengths[~splits]
+        last_taken = offsets[~splits] + taken - 1
+        sum_lat[~splits] += (cum_lat[last_taken] - cum_lat[offsets[~splits]] + lat[rows[offsets[~splits]]])
+        sum_lon[~splits] += (cum_lon[last_taken] - cum_lon[offsets[~splits]] + lon[rows[offsets[~splits]]])
+        count[~splits] += taken
+        position[~splits] += taken
+        sum_lat[splits], sum_lon[splits], count[splits] = lat[split_rows], lon[split_rows], 1
+        position[splits] = split_rows + 1
+        size = np.minimum(np.where(splits, 2 * np.maximum(split, 1), 2 * size), chunk)
+    return np.cumsum(run_start) - 1
+
+
+def detect_stops(df, speed_threshold=STOP_SPEED_KNOTS, min_minutes=STOP_MIN_MINUTES,
+                 radius_m=STOP_RADIUS_M, max_gap_minutes=STOP_MAX_GAP_MINUTES):
+    """
+    Detects stays (port calls and anchorages) in AIS tracks in a single vectorized pass.
+
+    A stay is a run of consecutive slow fixes of one vessel, without reporting gaps,
+    that lasts at least min_minutes and whose fixes all lie within radius_m of the
+    run centroid. A run that spreads wider (a slow drift) is split into consecutive
+    stays first.
+
+    Args:
+        df (DataFrame): AIS rows sorted by shipid and t.
+        speed_threshold (float): Maximum speed in knots of a stationary fix.
+        min_minutes (float): Minimum duration of a stay.
+        radius_m (float): Maximum distance of any fix from the stay centroid.
+        max_gap_minutes (float): Reporting gap that splits a stay.
+
+    Returns:
+        A pandas DataFrame with one row per stay.
+    """
+    columns = ['shipid', 'start', 'end', 'duration_min', 'lat', 'lon', 'max_radius_m', 'fixes', 'kind']
+    slow = (df['speed'].to_numpy(dtype=float) <= speed_threshold)
+    if not slow.any():
+        return pd.DataFrame(columns=columns)
+
+    shipids = df['shipid'].to_numpy()
+    seconds = store.epoch_seconds(df['t'])
+    same_ship = np.zeros(len(df), dtype=bool)
+    same_ship[1:] = shipids[1:] == shipids[:-1]
+    short_gap = np.zeros(len(df), dtype=bool)
+    short_gap[1:] = np.diff(seconds) <= max_gap_minutes * 60
+    prev_slow = np.zeros(len(df), dtype=bool)
+    prev_slow[1:] = slow[:-1]
+
+    # A run starts on every slow fix that does not continue the previous one
+    run_start = slow & ~(prev_slow & same_ship & short_gap)
+    run_id = np.cumsum(run_start)[slow] - 1
+
+    slow_rows = df[slow]
+    lat = slow_rows['lat'].to_numpy(dtype=float)
+    lon = slow_rows['lon'].to_numpy(dtype=float)
+    status = slow_rows['status'].to_numpy(dtype=float)
+    n_runs = run_id[-1] + 1
+
+    fixes, centroid_lat, centroid_lon, max_radius = _run_spread(run_id, lat, lon, n_runs)
+    too_wide = np.flatnonzero(max_radius > radius_m)
+    if len(too_wide):
+        run_id = _split_runs(run_id, lat, lon, too_wide, radius_m)
+        n_runs = run_id[-1] + 1
+        fixes, centroid_lat, centroid_lon, max_radius = _run_spread(run_id, lat, lon, n_runs)
+
+    first = np.flatnonzero(np.r_[True, run_id[1:] != run_id[:-1]])
+    last = np.r_[first[1:] - 1, len(run_id) - 1]
+    run_seconds = seconds[slow]
+    duration_min = (run_seconds[last] - run_seconds[first]) / 60
+
+    anchored = np.bincount(run_id, weights=(status == STATUS_AT_ANCHOR), minlength=n_runs)
+    moored = np.bincount(run_id, weights=(status == STATUS_MOORED), minlength=n_runs)
+    kind = np.where(moored > fixes / 2, 'moored', np.where(anchored > fixes / 2, 'anchorage', 'stop'))
+
+    keep = (duration_min >= min_minutes) & (max_radius <= radius_m)
+    return pd.DataFrame({
+        'shipid': slow_rows['shipid'].to_numpy()[first][keep],
+        'start': slow_rows['t'].iloc[first[keep]].array,
+        'end': slow_rows['t'].iloc[last[keep]].array,
+        'duration_min': duration_min[keep].round(1),
+        'lat': centroid_lat[keep],
+        'lon': centroid_lon[keep],
+        'max_radius_m': max_radius[keep].round(1),
+        'fixes': fixes[keep],
+        'kind': kind[keep]
+    }, columns=columns)
+
+
+def check_params(speed_threshold, min_minutes, radius_m):
+    """
+    Validates the stop definition of a query.
+
+    Returns:
+        A dict with speed_threshold, min_minutes and radius_m rounded to the steps of
+        STOP_PARAM_RANGES.
+
+    Raises:
+        ValueError: If a parameter is out of its range or not finite.
+    """
+    params = {}
+    for name, value in (('speed_threshold', speed_threshold), ('min_minutes', min_minutes), ('radius_m', radius_m)):
+        label, low, high, step = STOP_PARAM_RANGES[name]
+        if not np.isfinite(value) or not low <= value <= high:
+            raise ValueError("{} must be between {} and {}.".format(label, low, high))
+        params[name] = round(round(value / step) * step, 1)
+    return params
+
+
+def get_stops(dataset_url, speed_threshold=STOP_SPEED_KNOTS, min_minutes=STOP_MIN_MINUTES, radius_m=STOP_RADIUS_M):
+    """Returns the cached fleet-wide stay table for the given stop definition."""
+    key = ('stops', speed_threshold, min_minutes, radius_m)
+    return store.get_derived(
+        dataset_url, key,
+        lambda ais_store: detect_stops(ais_store['df'], speed_threshold, min_minutes, radius_m)
+    )
+
+
+def stops_to_records(stops):
+    if stops.empty:
+        return []
+    records = stops.copy()
+    records['start'] = records['start'].dt.strftime('%Y-%m-%d %H:%M:%S')
+    records['end'] = records['end'].dt.strftime('%Y-%m-%d %H:%M:%S')
+    return records.to_dict('records')
+
+
+def get_fleet_stops(dataset_url, **params):
+    return stops_to_records(get_stops(dataset_url, **params))
+
+
+def get_vessel_stops(dataset_url, shipid, **params):
+    stops = get_stops(dataset_url, **params)
+    return stops_to_records(stops[stops['shipid'] == str(shipid)])
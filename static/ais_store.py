@@ -0,0 +1,413 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+import numpy as np
+import pandas as pd
+import static.ais_quality as quality
+import static.ais_encrypted as encrypted
+
+# One entry per dataset path, rebuilt only when the file on disk changes
+_stores = {}
+_lock = threading.RLock()
+# Guards the derived tables of the stores only, builders never run under it
+_derived_lock = threading.Lock()
+
+# Columns whose per-vessel means are maintained incrementally
+SUMMARY_COLUMNS = ['speed', 'course', 'draught']
+# Derived tables kept per store for every parameterized kind, e.g. ('stops', ...) keys
+DERIVED_VARIANTS = 8
+
+
+def _file_signature(dataset_url):
+    stat = os.stat(dataset_url)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def _build_ship_index(df):
+    """
+    Builds a shipid -> (start, stop) row range lookup over a frame sorted by shipid.
+
+    Args:
+        df (DataFrame): AIS rows sorted by shipid and t.
+
+    Returns:
+        A dict mapping each shipid to the slice bounds of its rows.
+    """
+    shipids = df['shipid'].to_numpy()
+    if len(shipids) == 0:
+        return {}
+    boundaries = np.flatnonzero(shipids[1:] != shipids[:-1]) + 1
+    starts = np.concatenate(([0], boundaries))
+    stops = np.concatenate((boundaries, [len(shipids)]))
+    return {shipids[start]: (int(start), int(stop)) for start, stop in zip(starts, stops)}
+
+
+def _prepare_frame(df):
+    """Normalizes raw AIS rows and sorts them by (shipid, t)."""
+    df['shipid'] = df['shipid'].astype(str)
+    df['t'] = pd.to_datetime(df['t'], errors='coerce', utc=True)
+    # Stable sort keeps the file order for fixes sharing a timestamp
+    return df.sort_values(['shipid', 't'], kind='mergesort').reset_index(drop=True)
+
+
+def _load_frame(dataset_url):
+    """
+    Reads and validates an AIS file once at ingest.
+
+    Returns:
+        A tuple (clean_df, rejected_df, report) where rejected_df holds the removed
+        fixes together with their quality flags.
+    """
+    # Ciphertext columns are never parsed here, see static.ais_encrypted
+    df = _prepare_frame(encrypted.read_plain(dataset_url))
+
+    clean_df, flags, report = quality.clean(df, epoch_seconds(df['t'].fillna(pd.Timestamp(0, tz='UTC'))))
+    rejected = flags[quality.REJECT_FLAGS].any(axis=1)
+    rejected_df = pd.concat([df[rejected], flags[rejected]], axis=1)
+    return clean_df, rejected_df, report
+
+
+def _coerce_like(batch, df):
+    """Gives the numeric columns of raw fixes the types of the store, unreadable values become NaN."""
+    for column in df.columns:
+        if pd.api.types.is_numeric_dtype(df[column].dtype) and column in batch:
+            batch[column] = pd.to_numeric(batch[column], errors='coerce')
+    return batch
+
+
+def _splice_ships(df, block):
+    """
+    Replaces the rows of some vessels in a frame sorted by (shipid, t).
+
+    Args:
+        df (DataFrame): The store frame.
+        block (DataFrame): The complete rows of the vessels to replace or add, sorted by
+            (shipid, t).
+
+    Returns:
+        The new frame, sorted by (shipid, t), built without sorting the rows of the
+        other vessels again.
+    """
+    shipids = df['shipid'].to_numpy()
+    block_ships = block['shipid'].unique()
+    replaced = np.zeros(len(df), dtype=bool)
+    for start, stop in zip(np.searchsorted(shipids, block_ships, side='left'),
+                           np.searchsorted(shipids, block_ships, side='right')):
+        replaced[start:stop] = True
+    rest = df[~replaced]
+
+    # Row j of the block goes before the first remaining row of a greater vessel
+    positions = np.searchsorted(rest['shipid'].to_numpy(), block['shipid'].to_numpy(), side='left')
+    from_block = np.zeros(len(rest) + len(block), dtype=bool)
+    from_block[positions + np.arange(len(block))] = True
+    order = np.empty(len(from_block), dtype=np.int64)
+    order[~from_block] = np.arange(len(rest))
+    order[from_block] = len(rest) + np.arange(len(block))
+    return pd.concat([rest, block], ignore_index=True).iloc[order].reset_index(drop=True)
+
+
+def _vessel_summary(df):
+    """
+    Per-vessel partial aggregates (fix count, sums and non-null counts) that can be
+    added together when new fixes arrive.
+    """
+    grouped = df.groupby('shipid')
+    summary = pd.DataFrame({'fixes': grouped.size()})
+    for column in SUMMARY_COLUMNS:
+        summary[column + '_sum'] = grouped[column].sum()
+        summary[column + '_count'] = grouped[column].count()
+    return summary
+
+
+def _latest_positions(df):
+    """Returns the latest fix of every vessel, indexed by shipid (df sorted by shipid and t)."""
+    return df.groupby('shipid', sort=False).tail(1).set_index('shipid', drop=False).rename_axis(None)
+
+
+def _new_store(signature, version, appends, df, quality_report, rejected, latest, latest_versions, summary):
+    return {
+        'signature': signature,
+        'version': version,
+        'appends': appends,
+        'df': df,
+        'ship_index': _build_ship_index(df),
+        'quality': quality_report,
+        'rejected': rejected,
+        'latest': latest,
+        'latest_versions': latest_versions,
+        'summary': summary,
+        'derived': OrderedDict()
+    }
+
+
+def get_store(dataset_url):
+    """
+    Returns the in-memory AIS store for a dataset, loading it on first use.
+
+    The store holds the validated frame sorted by (shipid, t), a shipid row index,
+    the latest position and summary of every vessel (with the version at which each
+    latest position last changed), the quality report of the file and a version number
+    that is bumped every time the data changes. A new version is a new dict, so readers
+    always see a consistent snapshot.
+
+    The version counts from 1 in every process; use store_tag to identify the data
+    outside of it (ETags, event ids).
+
+    Args:
+        dataset_url (str): The path to the AIS CSV file.
+
+    Returns:
+        A dict with the keys 'df', 'ship_index', 'latest', 'latest_versions', 'summary',
+        'quality', 'rejected', 'signature', 'version', 'appends' (live batches added since
+        the file was read) and 'derived'.
+    """
+    signature = _file_signature(dataset_url)
+    with _lock:
+        store = _stores.get(dataset_url)
+        if store is not None and store['signature'] == signature:
+            return store
+
+        df, rejected, report = _load_frame(dataset_url)
+        version = (store['version'] + 1) if store is not None else 1
+        latest = _latest_positions(df)
+        store = _new_store(
+            signature, version, 0, df, report, rejected,
+            latest, pd.Series(version, index=latest.index), _vessel_summary(df)
+        )
+        _stores[dataset_url] = store
+        return store
+
+
+def append_fixes(dataset_url, fixes):
+    """
+    Adds newly received fixes to the store of a dataset without re-reading the file.
+
+    The fixes are validated against the history of their vessels and merged into the
+    rows of those vessels only; the indexes, latest positions and vessel summaries are
+    updated from the accepted fixes only. Numeric fields that cannot be read become NaN
+    (a fix without a readable position is rejected). Derived tables are rebuilt lazily for the new version.
+
+    The last fixes of a vessel that were rejected as teleports only, while nothing came
+    after them, are validated again with the new fixes of the vessel, which may confirm them.
+
+    Args:
+        dataset_url (str): The path to the AIS CSV file the fixes belong to.
+        fixes (DataFrame): Raw AIS rows with at least the shipid, t, lat and lon columns.
+
+    Returns:
+        A dict with the number of accepted and rejected fixes, the number of earlier
+        fixes confirmed, and the store version.
+    """
+    with _lock:
+        store = get_store(dataset_url)
+        if fixes.empty:
+            return {'accepted': 0, 'rejected': 0, 'confirmed': 0, 'version': store['version']}
+        df = store['df']
+        batch = _prepare_frame(_coerce_like(fixes.reindex(columns=df.columns).copy(), df))
+
+        # Tail teleports of the batch vessels are taken back and validated as new fixes again
+        withdrawn = _tail_teleports(store, batch['shipid'].unique())
+        retried = store['rejected'][withdrawn]
+        previously_rejected = store['rejected'][~withdrawn].reset_index(drop=True)
+        report = dict(store['quality'])
+        report['rows'] -= len(retried)
+        report['rejected_rows'] -= len(retried)
+        report['checks'] = dict(report['checks'], teleport=report['checks']['teleport'] - len(retried))
+        batch = pd.concat([
+            retried[list(df.columns)].assign(_retried=True), batch.assign(_retried=False)
+        ], ignore_index=True)
+
+        # Validate the batch in the context of the known fixes of its vessels
+        bounds = [store['ship_index'][shipid] for shipid in batch['shipid'].unique() if shipid in store['ship_index']]
+        context = df.iloc[np.concatenate([np.arange(*b) for b in bounds])] if bounds else df.iloc[0:0]
+        combined = pd.concat([context.assign(_new=False, _retried=False), batch.assign(_new=True)], ignore_index=True)
+        combined = combined.sort_values(['shipid', 't', '_new'], kind='mergesort').reset_index(drop=True)
+        flags = quality.validate(combined, epoch_seconds(combined['t'].fillna(pd.Timestamp(0, tz='UTC'))))
+        is_new = combined.pop('_new').to_numpy()
+        is_retried = combined.pop('_retried').to_numpy(dtype=bool)
+        rejected = flags[quality.REJECT_FLAGS].any(axis=1).to_numpy()
+        accepted = combined[is_new & ~rejected]
+        rejected_df = pd.concat([combined[is_new & rejected], flags[is_new & rejected]], axis=1)
+
+        # The known fixes of the batch vessels with the accepted ones, already in (shipid, t) order
+        merged = _splice_ships(df, combined[~is_new | ~rejected]) if len(accepted) else df
+
+        latest = pd.concat([store['latest'], _latest_positions(accepted)])
+        latest = latest.sort_values(['shipid', 't'], kind='mergesort')
+        latest = latest[~latest.index.duplicated(keep='last')]
+        version = store['version'] + 1
+        changed = (latest['t'] != store['latest']['t'].reindex(latest.index)).to_numpy()
+        latest_versions = store['latest_versions'].reindex(latest.index).mask(changed, version).astype(np.int64)
+        summary = store['summary'].add(_vessel_summary(accepted), fill_value=0)
+        summary['fixes'] = summary['fixes'].astype(np.int64)
+
+        report['rows'] += int(is_new.sum())
+        report['clean_rows'] += len(accepted)
+        report['rejected_rows'] += len(rejected_df)
+        report['checks'] = {
+            name: count + int(flags.loc[is_new, name].sum()) for name, count in report['checks'].items()
+        }
+        report['ships'] = int(len(summary))
+
+        store = _new_store(
+            store['signature'], version, store['appends'] + 1, merged, report,
+            pd.concat([previously_rejected, rejected_df], ignore_index=True), latest, latest_versions, summary
+        )
+        _stores[dataset_url] = store
+        # Counts of the received fixes, plus the earlier fixes this batch confirmed
+        return {
+            'accepted': int((is_new & ~rejected & ~is_retried).sum()),
+            'rejected': int((is_new & rejected & ~is_retried).sum()),
+            'confirmed': int((is_retried & ~rejected).sum()),
+            'version': store['version']
+        }
+
+
+def _tail_teleports(store, shipids):
+    """
+    Marks the rejected fixes of some vessels that were rejected as teleports only and
+    come after the latest accepted fix of their vessel.
+    """
+    rejected = store['rejected']
+    marked = np.zeros(len(rejected), dtype=bool)
+    if rejected.empty:
+        return marked
+    other_flags = [flag for flag in quality.REJECT_FLAGS if flag != 'teleport']
+    rows = np.flatnonzero(
+        rejected['shipid'].isin(shipids).to_numpy()
+        & rejected['teleport'].to_numpy(dtype=bool)
+        & ~rejected[other_flags].to_numpy(dtype=bool).any(axis=1)
+    )
+    t = rejected['t'].iloc[rows].reset_index(drop=True)
+    latest_t = store['latest']['t'].reindex(rejected['shipid'].iloc[rows]).reset_index(drop=True)
+    # A vessel without any accepted fix has no latest position
+    marked[rows] = (latest_t.isna() | (t > latest_t)).to_numpy()
+    return marked
+
+
+def store_tag(ais_store):
+    """
+    Identifies the data of a store snapshot independently of the process holding it.
+
+    Built from the file signature and the number of live batches appended since the
+    file was read, so it survives restarts and is the same in every worker that read
+    the same file.
+    """
+    mtime_ns, size = ais_store['signature']
+    return '{:x}-{:x}-{}'.format(mtime_ns, size, ais_store['appends'])
+
+
+def version_of_tag(ais_store, tag):
+    """
+    Finds the version of a store snapshot that a tag received from a client stands for.
+
+    Args:
+        ais_store (dict): The current store.
+        tag (str): A tag returned by store_tag, possibly by another process.
+
+    Returns:
+        The version in this process, or 0 if the tag does not describe the data of this
+        store (another file version, or batches this process has not seen).
+    """
+    prefix, _, appends = (tag or '').rpartition('-')
+    current_prefix = store_tag(ais_store).rpartition('-')[0]
+    if prefix != current_prefix or not appends.isdigit() or int(appends) > ais_store['appends']:
+        return 0
+    # Every appended batch published one version
+    return ais_store['version'] - (ais_store['appends'] - int(appends))
+
+
+def epoch_seconds(times):
+    """Converts a datetime Series to an int64 numpy array of seconds since the epoch."""
+    times = pd.to_datetime(times, utc=True)
+    return ((times - pd.Timestamp(0, tz='UTC')) // pd.Timedelta(seconds=1)).to_numpy(dtype=np.int64)
+
+
+def get_frame(dataset_url):
+    return get_store(dataset_url)['df']
+
+
+def get_ship_frame(dataset_url, shipid):
+    """
+    Returns the time ordered rows of a single vessel without scanning the dataset.
+
+    Args:
+        dataset_url (str): The path to the AIS CSV file.
+        shipid (str): The vessel identifier.
+
+    Returns:
+        A pandas DataFrame with the rows of the vessel (empty if unknown).
+    """
+    store = get_store(dataset_url)
+    bounds = store['ship_index'].get(str(shipid))
+    if bounds is None:
+        return store['df'].iloc[0:0]
+    return store['df'].iloc[bounds[0]:bounds[1]]
+
+
+def _derived_kind(name):
+    return name[0] if isinstance(name, tuple) else name
+
+
+def derive(ais_store, name, builder):
+    """
+    Returns a table derived from a store snapshot, computing it once per snapshot.
+
+    The builder runs outside the store lock, so a slow build only holds up the callers
+    waiting for that same table. At most DERIVED_VARIANTS tables of a parameterized kind
+    (keys sharing their first element) are kept, least recently used first out.
+
+    Args:
+        ais_store (dict): A store returned by get_store.
+        name (hashable): Cache key of the derived table (include any parameters in it).
+        builder (callable): Function receiving the store dict and returning the table.
+
+    Returns:
+        Whatever the builder returns for this snapshot.
+    """
+    derived = ais_store['derived']
+    with _derived_lock:
+        future = derived.get(name)
+        building = future is None
+        if building:
+            future = derived[name] = Future()
+        else:
+            derived.move_to_end(name)
+    if not building:
+        return future.result()
+
+    try:
+        table = builder(ais_store)
+    except BaseException as e:
+        # Let a later call try again, and wake the callers waiting for this build
+        with _derived_lock:
+            if derived.get(name) is future:
+                del derived[name]
+        future.set_exception(e)
+        raise
+    future.set_result(table)
+
+    kind = _derived_kind(name)
+    with _derived_lock:
+        if derived.get(name) is future:
+            derived.move_to_end(name)
+        variants = [key for key, built in derived.items() if _derived_kind(key) == kind and built.done()]
+        for key in variants[:max(len(variants) - DERIVED_VARIANTS, 0)]:
+            del derived[key]
+    return table
+
+
+def get_derived(dataset_url, name, builder):
+    """
+    Returns a table derived from the current AIS store of a dataset (see derive).
+
+    Args:
+        dataset_url (str): The path to the AIS CSV file.
+        name (hashable): Cache key of the derived table (include any parameters in it).
+        builder (callable): Function receiving the store dict and returning the table.
+
+    Returns:
+        Whatever the builder returns, cached until the dataset changes.
+    """
+    return derive(get_store(dataset_url), name, builder)
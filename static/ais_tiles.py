@@ -0,0 +1,252 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import mapbox_vector_tile
+from shapely.geometry import Point, LineString, MultiLineString
+from shapely import clip_by_rect
+import static.ais_store as store
+
+EARTH_RADIUS = 6378137.0
+ORIGIN_SHIFT = np.pi * EARTH_RADIUS
+MAX_LAT = 85.0511287798
+
+# Zoom level of the quadkey index; deeper tiles are served from their ancestor cell
+INDEX_ZOOM = 20
+MAX_ZOOM = 24
+TILE_EXTENT = 4096
+# Points sharing a ship and a cell of this grid are collapsed into one marker
+POINT_GRID = 256
+# Fraction of the tile added around it before clipping, to avoid seams between tiles
+TILE_BUFFER = 1 / 64
+TILE_CACHE_SIZE = 2048
+
+_tile_cache = OrderedDict()
+_tile_cache_lock = threading.Lock()
+
+
+def _to_mercator(lon, lat):
+    lat = np.clip(lat, -MAX_LAT, MAX_LAT)
+    mx = np.radians(lon) * EARTH_RADIUS
+    my = np.log(np.tan(np.pi / 4 + np.radians(lat) / 2)) * EARTH_RADIUS
+    return mx, my
+
+
+def _spread_bits(v):
+    v = v & np.uint64(0xFFFFFFFF)
+    v = (v | (v << np.uint64(16))) & np.uint64(0x0000FFFF0000FFFF)
+    v = (v | (v << np.uint64(8))) & np.uint64(0x00FF00FF00FF00FF)
+    v = (v | (v << np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    v = (v | (v << np.uint64(2))) & np.uint64(0x3333333333333333)
+    v = (v | (v << np.uint64(1))) & np.uint64(0x5555555555555555)
+    return v
+
+
+def _quadkey(tx, ty):
+    """Interleaves tile x/y into a Morton code so every tile is one contiguous code range."""
+    return _spread_bits(np.asarray(tx, dtype=np.uint64)) | (_spread_bits(np.asarray(ty, dtype=np.uint64)) << np.uint64(1))
+
+
+def tile_bounds(z, x, y):
+    """
+    Returns the Web Mercator bounds of an XYZ tile.
+
+    Args:
+        z (int): Zoom level.
+        x (int): Tile column.
+        y (int): Tile row (counted from the top).
+
+    Returns:
+        A (minx, miny, maxx, maxy) tuple in metres.
+    """
+    size = 2 * ORIGIN_SHIFT / (1 << z)
+    minx = -ORIGIN_SHIFT + x * size
+    maxy = ORIGIN_SHIFT - y * size
+    return minx, maxy - size, minx + size, maxy
+
+
+def _node_offset(level):
+    """Number of quadtree cells above a level, so (level, quadkey) maps to one integer."""
+    return np.uint64(((1 << (2 * int(level))) - 1) // 3)
+
+
+def build_spatial_index(ais_store):
+    """
+    Builds the quadkey index over all AIS fixes and track segments of a store.
+
+    A track segment (two consecutive fixes of a ship) is indexed under the smallest
+    quadtree cell holding both of its ends, so a tile finds the segments passing
+    through it without a fix inside it.
+
+    Args:
+        ais_store (dict): The store returned by static.ais_store.get_store.
+
+    Returns:
+        A dict with the sorted quadkeys, the store rows in quadkey order, the mercator
+        coordinates of every store row, and the sorted cells of the segments with the
+        store row each segment starts at.
+    """
+    df = ais_store['df']
+    mx, my = _to_mercator(df['lon'].to_numpy(dtype=float), df['lat'].to_numpy(dtype=float))
+    n = 1 << INDEX_ZOOM
+    tx = np.clip(((mx + ORIGIN_SHIFT) / (2 * ORIGIN_SHIFT) * n).astype(np.int64), 0, n - 1)
+    ty = np.clip(((ORIGIN_SHIFT - my) / (2 * ORIGIN_SHIFT) * n).astype(np.int64), 0, n - 1)
+    codes = _quadkey(tx, ty)
+    order = np.argsort(codes, kind='stable')
+
+    shipids = df['shipid'].to_numpy()
+    starts = np.flatnonzero(shipids[1:] == shipids[:-1]) if len(df) else np.empty(0, dtype=np.int64)
+    # The levels below the common cell of both ends are the bits where their quadkeys differ
+    differing_bits = np.frexp((codes[starts] ^ codes[starts + 1]).astype(float))[1]
+    levels = INDEX_ZOOM - (differing_bits + 1) // 2
+    offsets = np.array([_node_offset(level) for level in range(INDEX_ZOOM + 1)], dtype=np.uint64)
+    cells = (codes[starts] >> (2 * (INDEX_ZOOM - levels)).astype(np.uint64)) + offsets[levels]
+    segment_order = np.argsort(cells, kind='stable')
+    return {
+        'codes': codes[order],
+        'rows': order,
+        'mx': mx,
+        'my': my,
+        'segment_cells': cells[segment_order],
+        'segment_rows': starts[segment_order]
+    }
+
+
+def _rows_in_tile(index, z, x, y):
+    if z <= INDEX_ZOOM:
+        shift = np.uint64(2 * (INDEX_ZOOM - z))
+        first = _quadkey(x, y)
+        lo, hi = first << shift, (first + np.uint64(1)) << shift
+    else:
+        shift = z - INDEX_ZOOM
+        first = _quadkey(x >> shift, y >> shift)
+        lo, hi = first, first + np.uint64(1)
+    start, stop = np.searchsorted(index['codes'], [lo, hi])
+    rows = np.sort(index['rows'][start:stop])
+
+    if z > INDEX_ZOOM and len(rows):
+        minx, miny, maxx, maxy = tile_bounds(z, x, y)
+        mx, my = index['mx'][rows], index['my'][rows]
+        rows = rows[(mx >= minx) & (mx < maxx) & (my > miny) & (my <= maxy)]
+    return rows
+
+
+def _segments_through_tile(index, z, x, y, bounds):
+    """
+    Finds the track segments indexed under the tile or one of its ancestors whose
+    bounding box meets the tile (the other segments near it have both ends inside it).
+
+    Returns:
+        The sorted store rows the segments start at.
+    """
+    level = min(z, INDEX_ZOOM)
+    shift = z - level
+    tile = _quadkey(x >> shift, y >> shift)
+    cells = np.array([
+        (tile >> np.uint64(2 * (level - ancestor))) + _node_offset(ancestor) for ancestor in range(level + 1)
+    ], dtype=np.uint64)
+    starts = np.searchsorted(index['segment_cells'], cells, side='left')
+    stops = np.searchsorted(index['segment_cells'], cells, side='right')
+    rows = np.concatenate([index['segment_rows'][start:stop] for start, stop in zip(starts, stops)])
+
+    minx, miny, maxx, maxy = bounds
+    pad = (maxx - minx) * TILE_BUFFER
+    mx, my = index['mx'], index['my']
+    meets = (
+        (np.minimum(mx[rows], mx[rows + 1]) <= maxx + pad) & (np.maximum(mx[rows], mx[rows + 1]) >= minx - pad)
+        & (np.minimum(my[rows], my[rows + 1]) <= maxy + pad) & (np.maximum(my[rows], my[rows + 1]) >= miny - pad)
+    )
+    return np.sort(rows[meets])
+
+
+def _point_features(df, rows, mx, my, bounds):
+    minx, miny, maxx, maxy = bounds
+    cells = pd.DataFrame({
+        'shipid': df['shipid'].to_numpy()[rows],
+        'cx': ((mx[rows] - minx) / (maxx - minx) * POINT_GRID).astype(np.int32),
+        'cy': ((my[rows] - miny) / (maxy - miny) * POINT_GRID).astype(np.int32)
+    })
+    # Rows are time ordered per ship, so keep the latest fix of each cell
+    rows = rows[~cells.duplicated(subset=['shipid', 'cx', 'cy'], keep='last').to_numpy()]
+
+    subset = df.iloc[rows]
+    timestamps = subset['t'].dt.strftime('%Y-%m-%dT%H:%M:%SZ').to_numpy()
+    speeds = subset['speed'].to_numpy(dtype=float)
+    features = []
+    for i, row in enumerate(rows):
+        properties = {'shipid': subset['shipid'].iat[i], 't': timestamps[i]}
+        if not np.isnan(speeds[i]):
+            properties['speed'] = float(speeds[i])
+        features.append({'geometry': Point(mx[row], my[row]), 'properties': properties})
+    return features
+
+
+def _track_features(df, ship_index, rows, segments, mx, my, bounds, z):
+    if len(rows) == 0 and len(segments) == 0:
+        return []
+    # Pull in the neighbouring fixes so segments crossing the tile edge are kept, and
+    # both ends of the segments passing through the tile
+    rows = np.unique(np.concatenate((rows - 1, rows, rows + 1, segments, segments + 1)))
+    rows = rows[(rows >= 0) & (rows < len(df))]
+
+    minx, miny, maxx, maxy = bounds
+    pad = (maxx - minx) * TILE_BUFFER
+    tolerance = (maxx - minx) / TILE_EXTENT
+    features = []
+    for shipid, (start, stop) in ((s, ship_index[s]) for s in pd.unique(df['shipid'].to_numpy()[rows])):
+        ship_rows = rows[(rows >= start) & (rows < stop)]
+        if len(ship_rows) < 2:
+            continue
+        # Split the track wherever the selection skips over fixes of the ship
+        parts = np.split(ship_rows, np.flatnonzero(np.diff(ship_rows) > 1) + 1)
+        lines = [LineString(np.column_stack((mx[p], my[p]))) for p in parts if len(p) > 1]
+        if not lines:
+            continue
+        geometry = MultiLineString(lines).simplify(tolerance, preserve_topology=False)
+        geometry = clip_by_rect(geometry, minx - pad, miny - pad, maxx + pad, maxy + pad)
+        if geometry.is_empty:
+            continue
+        features.append({'geometry': geometry, 'properties': {'shipid': shipid, 'zoom': z}})
+    return features
+
+
+def render_tile(dataset_url, z, x, y):
+    """
+    Encodes the AIS positions and tracks of an XYZ tile as a Mapbox Vector Tile.
+
+    Tiles are cached per dataset version, so repeated requests are served from memory.
+
+    Args:
+        dataset_url (str): The path to the AIS CSV file.
+        z (int): Zoom level.
+        x (int): Tile column.
+        y (int): Tile row (counted from the top).
+
+    Returns:
+        A (tile_bytes, tag) tuple, tag identifying the data (see static.ais_store.store_tag).
+    """
+    ais_store = store.get_store(dataset_url)
+    cache_key = (dataset_url, ais_store['version'], z, x, y)
+    with _tile_cache_lock:
+        if cache_key in _tile_cache:
+            _tile_cache.move_to_end(cache_key)
+            return _tile_cache[cache_key], store.store_tag(ais_store)
+
+    index = store.derive(ais_store, 'tile_index', build_spatial_index)
+    df = ais_store['df']
+    bounds = tile_bounds(z, x, y)
+    rows = _rows_in_tile(index, z, x, y)
+    segments = _segments_through_tile(index, z, x, y, bounds)
+
+    layers = [
+        {'name': 'ais_positions', 'features': _point_features(df, rows, index['mx'], index['my'], bounds)},
+        {'name': 'ais_tracks', 'features': _track_features(
+            df, ais_store['ship_index'], rows, segments, index['mx'], index['my'], bounds, z)}
+    ]
+    tile = mapbox_vector_tile.encode(layers, default_options={'quantize_bounds': bounds, 'extents': TILE_EXTENT})
+
+    with _tile_cache_lock:
+        _tile_cache[cache_key] = tile
+        if len(_tile_cache) > TILE_CACHE_SIZE:
+            _tile_cache.popitem(last=False)
+    return tile, store.store_tag(ais_store)
@@ -0,0 +1,157 @@
+import numpy as np
+import pandas as pd
+import folium
+import static.ais_store as store
+from static.geo import step_distances_m
+
+# A track is split into a new trip on a reporting gap or a jump longer than these
+TRIP_MAX_GAP_MINUTES = 30
+TRIP_MAX_JUMP_M = 10000
+
+
+def trip_breaks(df, max_gap_minutes=TRIP_MAX_GAP_MINUTES, max_jump_m=TRIP_MAX_JUMP_M):
+    """
+    Flags the rows that start a new trip.
+
+    Args:
+        df (DataFrame): AIS rows sorted by shipid and t.
+        max_gap_minutes (float): Reporting gap that ends a trip.
+        max_jump_m (float): Distance between consecutive fixes that ends a trip.
+
+    Returns:
+        A tuple (breaks, steps): a boolean array marking the first fix of every trip
+        and the distance in metres of every fix from the previous one.
+    """
+    shipids = df['shipid'].to_numpy()
+    seconds = store.epoch_seconds(df['t'])
+    steps = step_distances_m(df['lat'].to_numpy(dtype=float), df['lon'].to_numpy(dtype=float))
+
+    breaks = np.ones(len(df), dtype=bool)
+    if len(df) > 1:
+        breaks[1:] = (
+            (shipids[1:] != shipids[:-1])
+            | (np.diff(seconds) > max_gap_minutes * 60)
+            | (steps[1:] > max_jump_m)
+        )
+    return breaks, steps
+
+
+def segment_trips(df, max_gap_minutes=TRIP_MAX_GAP_MINUTES, max_jump_m=TRIP_MAX_JUMP_M):
+    """
+    Splits every vessel track into trips and summarises them in one vectorized pass.
+
+    Args:
+        df (DataFrame): AIS rows sorted by shipid and t.
+        max_gap_minutes (float): Reporting gap that ends a trip.
+        max_jump_m (float): Distance between consecutive fixes that ends a trip.
+
+    Returns:
+        A pandas DataFrame with one row per trip, including the [start_row, stop_row)
+        range of its fixes in df.
+    """
+    columns = ['trip_id', 'shipid', 'start', 'end', 'duration_min', 'fixes', 'length_km',
+               'min_lat', 'min_lon', 'max_lat', 'max_lon', 'start_row', 'stop_row']
+    if df.empty:
+        return pd.DataFrame(columns=columns)
+
+    breaks, steps = trip_breaks(df, max_gap_minutes, max_jump_m)
+    starts = np.flatnonzero(breaks)
+    stops = np.r_[starts[1:], len(df)]
+    trip_of_row = np.cumsum(breaks) - 1
+
+    lat = df['lat'].to_numpy(dtype=float)
+    lon = df['lon'].to_numpy(dtype=float)
+    seconds = store.epoch_seconds(df['t'])
+    length_km = np.bincount(trip_of_row, weights=np.where(breaks, 0, steps), minlength=len(starts)) / 1000
+
+    # Number the trips of each vessel 0, 1, 2, ...
+    shipids = df['shipid'].to_numpy()[starts]
+    new_ship = np.r_[True, shipids[1:] != shipids[:-1]]
+    first_trip_of_ship = np.maximum.accumulate(np.where(new_ship, np.arange(len(starts)), 0))
+    ordinal = np.arange(len(starts)) - first_trip_of_ship
+
+    return pd.DataFrame({
+        'trip_id': pd.Series(shipids).str.cat(ordinal.astype(str), sep='-').to_numpy(),
+        'shipid': shipids,
+        'start': df['t'].iloc[starts].array,
+        'end': df['t'].iloc[stops - 1].array,
+        'duration_min': ((seconds[stops - 1] - seconds[starts]) / 60).round(1),
+        'fixes': stops - starts,
+        'length_km': length_km.round(3),
+        'min_lat': np.minimum.reduceat(lat, starts),
+        'min_lon': np.minimum.reduceat(lon, starts),
+        'max_lat': np.maximum.reduceat(lat, starts),
+        'max_lon': np.maximum.reduceat(lon, starts),
+        'start_row': starts,
+        'stop_row': stops
+    }, columns=columns)
+
+
+def get_trips(dataset_url, ais_store=None):
+    """
+    Returns the cached trip table of the dataset, indexed by trip_id.
+
+    Pass ais_store to get the trips of that snapshot rather than of the current one.
+    """
+    if ais_store is None:
+        ais_store = store.get_store(dataset_url)
+    return store.derive(
+        ais_store, 'trips',
+        lambda snapshot: segment_trips(snapshot['df']).set_index('trip_id', drop=False)
+    )
+
+
+def get_trip_list(dataset_url, shipid=None):
+    trips = get_trips(dataset_url)
+    if shipid is not None:
+        trips = trips[trips['shipid'] == str(shipid)]
+    if trips.empty:
+        return []
+    records = trips.drop(columns=['start_row', 'stop_row'])
+    records['start'] = records['start'].dt.strftime('%Y-%m-%d %H:%M:%S')
+    records['end'] = records['end'].dt.strftime('%Y-%m-%d %H:%M:%S')
+    return records.to_dict('records')
+
+
+def get_trip_frame(dataset_url, trip_id):
+    """
+    Returns the fixes of a trip as a slice of the AIS store.
+
+    Args:
+        dataset_url (str): The path to the AIS CSV file.
+        trip_id (str): Identifier from the trip table.
+
+    Returns:
+        A pandas DataFrame, or None if the trip does not exist.
+    """
+    ais_store = store.get_store(dataset_url)
+    trips = get_trips(dataset_url, ais_store)
+    if trip_id not in trips.index:
+        return None
+    trip = trips.loc[trip_id]
+    return ais_store['df'].iloc[trip['start_row']:trip['stop_row']]
+
+
+def create_trip_map(dataset_url, trip_id, zoom_start=10):
+    df = get_trip_frame(dataset_url, trip_id)
+    if df is None:
+        return None
+
+    m = folium.Map(location=[df['lat'].mean(), df['lon'].mean()], zoom_start=zoom_start, scrollWheelZoom=False)
+    trip_coords = df[['lat', 'lon']].values.tolist()
+    folium.PolyLine(locations=trip_coords, color='blue', weight=4, tooltip="Trip: {}".format(trip_id)).add_to(m)
+
+    first, last = df.iloc[0], df.iloc[-1]
+    folium.Marker(
+        location=[first['lat'], first['lon']],
+        popup="Ship ID: {}<br>Trip start: {}".format(first['shipid'], first['t']),
+        icon=folium.Icon(color='green')
+    ).add_to(m)
+    folium.Marker(
+        location=[last['lat'], last['lon']],
+        popup="Ship ID: {}<br>Trip end: {}".format(last['shipid'], last['t']),
+        icon=folium.Icon(color='red')
+    ).add_to(m)
+    m.fit_bounds([[df['lat'].min(), df['lon'].min()], [df['lat'].max(), df['lon'].max()]])
+
+    return m._repr_html_()
@@ -0,0 +1,113 @@
+import os
+import hmac
+import logging
+import hashlib
+import pandas as pd
+import static.ais_store as store
+import static.load_trajectories as lt
+
+# Key of the opaque vessel identifiers (vessel_key) given to roles that may not see the
+# shipid. Use the same value in every worker, so that the identifiers agree between
+# workers and across restarts. Without it no vessel_key is served.
+VESSEL_KEY_SECRET = os.environ.get('AIS_VESSEL_KEY_SECRET', '')
+if not VESSEL_KEY_SECRET:
+    logging.warning("AIS_VESSEL_KEY_SECRET is not set, vessel_key will be empty")
+
+# What each role is allowed to see. Every role-dependent AIS view is built from this
+# table only, so the privacy boundary is enforced in one place.
+#   dataset:      key of the dataset the role reads (see get_role_view)
+#   columns:      projection of the latest position of every vessel (vessel_key is derived
+#                 from the shipid, see vessel_keys)
+#   statistics:   whether per-vessel statistics are exposed
+#   token_status: popup mode of create_map_with_markers_and_popups
+ROLE_VIEWS = {
+    'data-owner': {
+        'dataset': 'plain',
+        'columns': ['t', 'shipid', 'lon', 'lat', 'heading', 'course', 'speed', 'status', 'shiptype',
+                    'draught', 'destination'],
+        'statistics': True,
+        'token_status': 'valid'
+    },
+    'pilot-user': {
+        'dataset': 'encrypted',
+        'columns': ['vessel_key', 't', 'lon', 'lat'],
+        'statistics': False,
+        'token_status': 'invalid'
+    }
+}
+
+
+def vessel_keys(shipids):
+    """
+    Opaque vessel identifiers: a truncated HMAC-SHA256 of each shipid under VESSEL_KEY_SECRET.
+
+    They let a client tell vessels apart (e.g. to apply position updates) without
+    revealing the shipid. Without a secret anyone could rebuild them by hashing known
+    shipids, so every key is None then.
+    """
+    if not VESSEL_KEY_SECRET:
+        return [None] * len(shipids)
+    secret = VESSEL_KEY_SECRET.encode()
+    return [hmac.new(secret, str(shipid).encode(), hashlib.sha256).hexdigest()[:16] for shipid in shipids]
+
+
+def project_positions(latest, columns):
+    """
+    Projects vessel positions on the columns of a role.
+
+    Args:
+        latest (DataFrame): Positions with a shipid column.
+        columns (list): The columns of a ROLE_VIEWS entry.
+
+    Returns:
+        A pandas DataFrame with exactly these columns.
+    """
+    if 'vessel_key' in columns and 'shipid' in latest:
+        latest = latest.assign(vessel_key=vessel_keys(latest['shipid']))
+    return latest.reindex(columns=columns)
+
+
+def build_role_view(dataset_url, role):
+    """
+    Materializes everything a role may see of a dataset.
+
+    Args:
+        dataset_url (str): The path to the AIS CSV file of the role.
+        role (str): A key of ROLE_VIEWS.
+
+    Returns:
+        A dict with the projected latest positions, the statistics and the rendered map.
+    """
+    policy = ROLE_VIEWS[role]
+    latest = pd.DataFrame(lt.get_aggregated_data(dataset_url))
+    # Unexposed columns never leave this function
+    latest = project_positions(latest, policy['columns']).to_dict('records')
+    statistics = lt.get_aggregated_statistic_data(dataset_url) if policy['statistics'] else []
+    return {
+        'role': role,
+        'latest': latest,
+        'statistics': statistics,
+        'map': lt.create_map_with_markers_and_popups(
+            aggr_data=latest,
+            traj_aggr_data=statistics,
+            token_status=policy['token_status']
+        )
+    }
+
+
+def get_role_view(role, datasets):
+    """
+    Returns the materialized view of a role, built once per dataset version.
+
+    Args:
+        role (str): The role of the user.
+        datasets (dict): Maps the dataset keys of ROLE_VIEWS to file paths.
+
+    Returns:
+        The dict built by build_role_view, or None if the role has no view.
+    """
+    policy = ROLE_VIEWS.get(role)
+    if policy is None:
+        return None
+    dataset_url = datasets[policy['dataset']]
+    return store.get_derived(dataset_url, ('role_view', role), lambda ais_store: build_role_view(dataset_url, role))
@@ -0,0 +1,36 @@
+import numpy as np
+
+EARTH_RADIUS_M = 6371000.0
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """
+    Vectorized great-circle distance between coordinate arrays.
+
+    Args:
+        lat1, lon1, lat2, lon2 (array-like): Coordinates in degrees (broadcastable).
+
+    Returns:
+        A numpy array with the distances in metres.
+    """
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=float)) for v in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def step_distances_m(lat, lon):
+    """
+    Distance between consecutive fixes (the first element is 0).
+
+    Args:
+        lat, lon (array-like): Coordinates in degrees, in track order.
+
+    Returns:
+        A numpy array of the same length with the distance to the previous fix in metres.
+    """
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    steps = np.zeros(len(lat))
+    if len(lat) > 1:
+        steps[1:] = haversine_m(lat[:-1], lon[:-1], lat[1:], lon[1:])
+    return steps
@@ -0,0 +1,249 @@
+import os
+import sys
+import json
+import logging
+import threading
+from concurrent.futures import Future
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import static.iroute_catalog as catalog
+from static.iroute_canbus import read_signal
+from static.iroute_parsing import read_bus_file, parse_files, BATTERY_SIGNAL
+
+# The service execution directory the UC1 endpoints read, relative to the working directory
+DEFAULT_ROOT = os.path.join('data', 'iroute', 'service execution')
+SUMMARY_FILE_NAME = 'battery_daily_summary.parquet'
+SUMMARY_COLUMNS = ['bus_id', 'date', 'depot_exit_battery', 'depot_entry_battery', 'km']
+METADATA_KEY = b'battery_summary'
+
+_summaries = {}
+_reports = {}
+# Days being summarized, by (root, date): (day_signature, Future of the summary)
+_in_flight = {}
+# Only held to read or publish the tables above, never while files are parsed
+_lock = threading.Lock()
+_save_lock = threading.Lock()
+
+
+def _stat_signature(file_path):
+    stat = os.stat(file_path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def day_signature(root, date):
+    """The signatures of the service execution file and the CAN bus files a day summary is built from."""
+    files = catalog.get_catalog(root)['kinds']
+    bus_file = files['bus']['files'].get((date, None))
+    canbus = sorted(
+        (bus, _stat_signature(path)) for (day, bus), path in files['canbus']['files'].items() if day == date
+    )
+    return [_stat_signature(bus_file) if bus_file else None, [[bus, signature] for bus, signature in canbus]]
+
+
+def load_report_battery(report_path):
+    """
+    Reads the battery level rows of a vehicle report (YYYY-MM-DD_report.csv), once per
+    version of the file.
+
+    Returns:
+        A pandas DataFrame with the rows whose Segnale is the battery signal (Veicolo,
+        Valore, DataOra, Latitudine, Longitudine, ...).
+    """
+    signature = _stat_signature(report_path)
+    with _lock:
+        cached = _reports.get(report_path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    report = pd.read_csv(report_path)
+    report = report[report['Segnale'] == BATTERY_SIGNAL].reset_index(drop=True)
+    with _lock:
+        _reports[report_path] = (signature, report)
+    return report
+
+
+def summarize_day(bus_file_path):
+    """
+    Builds the battery summary of one day.
+
+    Args:
+        bus_file_path (str): The YYYYMMDD_bus.csv file of the day, inside the yyyymmdd_bus
+            directory of the service execution directory.
+
+    Returns:
+        A pandas DataFrame with SUMMARY_COLUMNS and one row per bus that has battery data
+        that day: the first (depot exit) and last (depot entry) battery level of the day
+        and the kilometres of its service lines.
+    """
+    root = os.path.dirname(os.path.dirname(bus_file_path))
+    date = os.path.basename(bus_file_path)[:8]
+    bus_data = read_bus_file(bus_file_path)
+    km = (bus_data['odometer_end'] - bus_data['odometer_start']).groupby(bus_data['bus_id'], sort=False).sum()
+
+    rows = []
+    for bus_id, distance in km.items():
+        canbus_path = catalog.find_file(root, 'canbus', date, 'E' + bus_id[2:])
+        if canbus_path is None:
+            continue
+        try:
+            battery = read_signal(canbus_path, BATTERY_SIGNAL)
+        except (OSError, ValueError, pd.errors.ParserError):
+            continue
+        if battery.empty:
+            continue
+        rows.append((bus_id, date, battery['Value'].iloc[0], battery['Value'].iloc[-1], distance))
+    return pd.DataFrame(rows, columns=SUMMARY_COLUMNS).astype({
+        'bus_id': object, 'date': object, 'depot_exit_battery': float, 'depot_entry_battery': float, 'km': float
+    })
+
+
+def _summary_path(root):
+    return os.path.join(root, SUMMARY_FILE_NAME)
+
+
+def _load(root):
+    """Reads the persisted summary table and the signatures of the days it holds."""
+    path = _summary_path(root)
+    try:
+        table = pq.read_table(path)
+        metadata = json.loads((table.schema.metadata or {})[METADATA_KEY])
+    except (OSError, KeyError, ValueError, pa.ArrowInvalid):
+        return pd.DataFrame(columns=SUMMARY_COLUMNS), {}
+    return table.to_pandas(), metadata
+
+
+def _save(root, table, signatures):
+    arrow_table = pa.Table.from_pandas(table, preserve_index=False)
+    metadata = dict(arrow_table.schema.metadata or {})
+    metadata[METADATA_KEY] = json.dumps(signatures).encode()
+    catalog.write_atomically(
+        _summary_path(root), lambda tmp_path: pq.write_table(arrow_table.replace_schema_metadata(metadata), tmp_path)
+    )
+
+
+def _summarize_days(root, dates):
+    """
+    Summarizes days on the process pool, sharing the work with concurrent refreshes.
+
+    Args:
+        root (str): The service execution directory.
+        dates (dict): Maps every day (YYYYMMDD) to summarize to its current day_signature.
+
+    Returns:
+        A dict mapping every day to its summary, or to the exception raised building it.
+    """
+    futures, mine = {}, []
+    with _lock:
+        for date, signature in dates.items():
+            entry = _in_flight.get((root, date))
+            if entry is None or entry[0] != signature:
+                entry = _in_flight[(root, date)] = (signature, Future())
+                mine.append(date)
+            futures[date] = entry[1]
+
+    try:
+        days = parse_files(summarize_day, [catalog.find_file(root, 'bus', date) for date in mine])
+    except BaseException as e:
+        days = [e] * len(mine)
+        raise
+    finally:
+        with _lock:
+            for date, day in zip(mine, days):
+                if _in_flight.get((root, date), (None, None))[1] is futures[date]:
+                    del _in_flight[(root, date)]
+                futures[date].set_result(day)
+    return {date: future.result() for date, future in futures.items()}
+
+
+def refresh_summaries(root, dates=None):
+    """
+    Brings the daily battery summaries of some days (all by default) up to date.
+
+    Days whose input files did not change are kept; the others are summarized again,
+    in parallel, and the table is persisted next to the data so that it survives restarts.
+    A day that cannot be summarized is logged and left out, and tried again next time.
+    The summaries are built without holding the module lock, and a day already being
+    summarized by another request is waited for instead of being built twice.
+
+    Args:
+        root (str): The service execution directory.
+        dates (iterable): Days (YYYYMMDD) to refresh, defaults to every day with a service
+            execution file.
+
+    Returns:
+        The summary table, a pandas DataFrame with SUMMARY_COLUMNS sorted by date.
+    """
+    root = os.path.abspath(root)
+    available = catalog.list_dates(root, 'bus')
+    dates = sorted(available if dates is None else set(dates) & available)
+    with _lock:
+        loaded = _summaries.get(root)
+    if loaded is None:
+        loaded = _load(root)
+        with _lock:
+            loaded = _summaries.setdefault(root, loaded)
+    signatures = loaded[1]
+
+    current = {date: day_signature(root, date) for date in dates}
+    stale = [date for date in dates if signatures.get(date) != current[date]]
+    if not stale:
+        return loaded[0]
+
+    days = _summarize_days(root, {date: current[date] for date in stale})
+    with _lock:
+        # Another request may have published days meanwhile, start from the latest table
+        table, signatures = _summaries[root]
+        summarized, frames = [], [table[~table['date'].isin(stale)]]
+        for date in stale:
+            if isinstance(days[date], Exception):
+                logging.error(f"Could not summarize the battery data of {date}: {days[date]}")
+                continue
+            summarized.append(date)
+            frames.append(days[date])
+        frames = [frame for frame in frames if not frame.empty]
+        if frames:
+            table = pd.concat(frames, ignore_index=True).sort_values('date', kind='mergesort', ignore_index=True)
+        else:
+            table = pd.DataFrame(columns=SUMMARY_COLUMNS)
+        signatures = {date: signature for date, signature in signatures.items() if date not in stale}
+        signatures.update({date: current[date] for date in summarized})
+        _summaries[root] = (table, signatures)
+
+    with _save_lock:
+        # Persist the latest published table, which may already include later refreshes
+        with _lock:
+            latest, latest_signatures = _summaries[root]
+        try:
+            _save(root, latest, latest_signatures)
+        except OSError as e:
+            logging.warning(f"Could not persist the battery summary of {root}: {e}")
+    return table
+
+
+def get_battery_summary(root, start, end):
+    """
+    Aggregates the daily battery summaries of a date range per bus.
+
+    Args:
+        root (str): The service execution directory.
+        start (str): First day (YYYYMMDD), inclusive.
+        end (str): Last day (YYYYMMDD), inclusive.
+
+    Returns:
+        A pandas DataFrame indexed by bus ID (in order of first appearance) with the mean
+        depot_entry_battery and depot_exit_battery, the total km and the number of days.
+    """
+    dates = [date for date in catalog.list_dates(root, 'bus') if start <= date <= end]
+    table = refresh_summaries(root, dates)
+    table = table[(table['date'] >= start) & (table['date'] <= end)]
+    grouped = table.groupby('bus_id', sort=False)
+    return pd.DataFrame({
+        'depot_entry_battery': grouped['depot_entry_battery'].mean(),
+        'depot_exit_battery': grouped['depot_exit_battery'].mean(),
+        'km': grouped['km'].sum(),
+        'days': grouped.size()
+    }, columns=['depot_entry_battery', 'depot_exit_battery', 'km', 'days'])
+
+
+if __name__ == '__main__':
+    print(len(refresh_summaries(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_ROOT)))
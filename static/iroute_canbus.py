@@ -0,0 +1,177 @@
+import os
+import re
+import sys
+import json
+import logging
+import pandas as pd
+from static.iroute_catalog import write_atomically
+from static.iroute_parsing import read_canbus_signals, parse_files
+
+SIGNAL_STORE_SUFFIX = '_signals'
+MANIFEST_NAME = '_source.json'
+# CAN bus exports are named YYYY-MM-DD_Exxx.csv
+CANBUS_FILE_PATTERN = re.compile(r'^(\d{4}-\d{2}-\d{2})_(E\d+)\.csv$')
+
+# Source signature of the partitions that could not be written, by partition directory
+_unwritable = {}
+
+
+def store_dir_for(canbus_dir):
+    """The signal store of a CAN bus directory, next to it (yyyymmdd_Exxx -> yyyymmdd_Exxx_signals)."""
+    return os.path.normpath(canbus_dir) + SIGNAL_STORE_SUFFIX
+
+
+def partition_dir(store_dir, date, bus):
+    return os.path.join(store_dir, date, bus)
+
+
+def _signal_file_name(signal):
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', str(signal)) + '.parquet'
+
+
+def _source_signature(file_path):
+    stat = os.stat(file_path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def _read_manifest(path):
+    try:
+        with open(os.path.join(path, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _split_file_name(file_path):
+    match = CANBUS_FILE_PATTERN.match(os.path.basename(file_path))
+    if match is None:
+        raise ValueError(f"{file_path} is not named YYYY-MM-DD_Exxx.csv")
+    return match.group(1), match.group(2)
+
+
+def is_current(file_path, store_dir=None):
+    """Tells whether the partition of a CAN bus file exists and was built from its current version."""
+    store_dir = store_dir or store_dir_for(os.path.dirname(file_path))
+    manifest = _read_manifest(partition_dir(store_dir, *_split_file_name(file_path)))
+    return manifest is not None and manifest['source'] == _source_signature(file_path)
+
+
+def _empty_signal(columns=('Date', 'Signal', 'Value')):
+    return pd.DataFrame(columns=list(columns))
+
+
+def _signal_columns(signals):
+    return list(next(iter(signals.values())).columns) if signals else ['Date', 'Signal', 'Value']
+
+
+def _write_partition(path, source, signals):
+    """Writes the signals parsed from a CAN bus export into its partition, the manifest last."""
+    files = {}
+    os.makedirs(path, exist_ok=True)
+    for signal, df in signals.items():
+        files[signal] = _signal_file_name(signal)
+        write_atomically(os.path.join(path, files[signal]), lambda tmp_path, df=df: df.to_parquet(tmp_path, index=False))
+
+    def write_manifest(tmp_path):
+        with open(tmp_path, 'w') as f:
+            json.dump({'source': source, 'columns': _signal_columns(signals), 'signals': files}, f)
+    write_atomically(os.path.join(path, MANIFEST_NAME), write_manifest)
+
+    # Signals of a previous version of the file that are gone now, once no new reader can see them
+    for name in os.listdir(path):
+        if name.endswith('.parquet') and name not in files.values():
+            try:
+                os.remove(os.path.join(path, name))
+            except FileNotFoundError:
+                pass
+
+
+def ingest_file(file_path, store_dir=None):
+    """
+    Converts one CAN bus export into a date/bus partition holding one Parquet file per signal.
+
+    Timestamps and values are stored typed, so a later read of a signal neither parses
+    the CSV nor touches the rows of the other signals. The partition manifest, written
+    last, records the source file signature and the signals it holds.
+
+    Args:
+        file_path (str): The path to a YYYY-MM-DD_Exxx.csv file.
+        store_dir (str): The signal store, defaults to store_dir_for the file's directory.
+
+    Returns:
+        The path of the partition directory.
+    """
+    store_dir = store_dir or store_dir_for(os.path.dirname(file_path))
+    path = partition_dir(store_dir, *_split_file_name(file_path))
+    source = _source_signature(file_path)
+    _write_partition(path, source, read_canbus_signals(file_path))
+    return path
+
+
+def ingest(canbus_dir, store_dir=None):
+    """
+    Ingests every new or changed CAN bus export of a directory, in parallel.
+
+    Returns:
+        The number of files ingested.
+    """
+    store_dir = store_dir or store_dir_for(canbus_dir)
+    file_paths = [
+        os.path.join(canbus_dir, name) for name in sorted(os.listdir(canbus_dir))
+        if CANBUS_FILE_PATTERN.match(name)
+    ]
+    stale = [file_path for file_path in file_paths if not is_current(file_path, store_dir)]
+    for file_path, result in zip(stale, parse_files(ingest_file, stale, store_dir)):
+        if isinstance(result, Exception):
+            logging.warning(f"Could not ingest {file_path}: {result}")
+    return len(stale)
+
+
+def read_signal(file_path, signal, store_dir=None):
+    """
+    Reads one signal of a CAN bus export from the signal store.
+
+    A file without a current partition is parsed and ingested first. If the store cannot
+    be written, the signal is taken from the parsed file, and later reads of that file
+    version parse the CSV without trying to write again.
+
+    Args:
+        file_path (str): The path to a YYYY-MM-DD_Exxx.csv file.
+        signal (str): The signal to read.
+        store_dir (str): The signal store, defaults to store_dir_for the file's directory.
+
+    Returns:
+        A pandas DataFrame with Date (datetime), Signal and Value (float) sorted by Date,
+        plus any other column of the file.
+
+    Raises:
+        ValueError: If the file lacks the Date, Signal or Value columns.
+    """
+    store_dir = store_dir or store_dir_for(os.path.dirname(file_path))
+    path = partition_dir(store_dir, *_split_file_name(file_path))
+    manifest = _read_manifest(path)
+    source = _source_signature(file_path)
+    if manifest is None or manifest['source'] != source:
+        signals = read_canbus_signals(file_path)
+        if _unwritable.get(path) != source:
+            try:
+                _write_partition(path, source, signals)
+            except OSError as e:
+                logging.warning(f"Could not store the signals of {file_path}, reading it from the CSV: {e}")
+                _unwritable[path] = source
+        return signals.get(signal, _empty_signal(_signal_columns(signals)))
+
+    for attempt in range(2):
+        if signal not in manifest['signals']:
+            return _empty_signal(manifest['columns'])
+        try:
+            return pd.read_parquet(os.path.join(path, manifest['signals'][signal]))
+        except FileNotFoundError:
+            # A newer version of the partition replaced the manifest read above
+            if attempt:
+                raise
+            manifest = _read_manifest(path)
+
+
+if __name__ == '__main__':
+    print(ingest(*sys.argv[1:3]))
@@ -0,0 +1,142 @@
+import os
+import re
+import time
+import uuid
+import threading
+
+# Seconds during which a catalog is answered without looking at the filesystem
+CATALOG_POLL_SECONDS = 10
+
+# Kind of file -> (subdirectory of the service execution directory, file name pattern)
+CATALOG_LAYOUT = {
+    'bus': ('yyyymmdd_bus', re.compile(r'^(?P<year>\d{4})(?P<month>\d{2})(?P<day>\d{2})_bus\.csv$')),
+    'canbus': ('yyyymmdd_Exxx', re.compile(r'^(?P<year>\d{4})-(?P<month>\d{2})-(?P<day>\d{2})_(?P<bus>E\d+)\.csv$')),
+    'report': ('req4', re.compile(r'^(?P<year>\d{4})-(?P<month>\d{2})-(?P<day>\d{2})_report\.csv$'))
+}
+
+_catalogs = {}
+_lock = threading.Lock()
+
+
+def _dir_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _scan_dir(kind, path):
+    """Indexes the files of one kind in a directory by (date, bus)."""
+    pattern = CATALOG_LAYOUT[kind][1]
+    files = {}
+    try:
+        names = os.listdir(path)
+    except OSError:
+        return files
+    for name in names:
+        match = pattern.match(name)
+        if match is None:
+            continue
+        date = match.group('year') + match.group('month') + match.group('day')
+        bus = match.group('bus') if 'bus' in pattern.groupindex else None
+        files[(date, bus)] = os.path.join(path, name)
+    return files
+
+
+def _build_catalog(root, previous=None):
+    kinds = {}
+    for kind, (subdir, _) in CATALOG_LAYOUT.items():
+        path = os.path.join(root, subdir)
+        mtime = _dir_mtime(path)
+        # A directory whose mtime did not change has the same entries
+        if previous is not None and previous['kinds'][kind]['mtime'] == mtime:
+            kinds[kind] = previous['kinds'][kind]
+            continue
+        files = _scan_dir(kind, path)
+        buses = {}
+        for date, bus in files:
+            buses.setdefault(date, set())
+            if bus is not None:
+                buses[date].add(bus)
+        kinds[kind] = {
+            'mtime': mtime,
+            'files': files,
+            'dates': frozenset(buses),
+            'buses': {date: frozenset(ids) for date, ids in buses.items()}
+        }
+    return {'root': root, 'checked': time.monotonic(), 'kinds': kinds}
+
+
+def get_catalog(root, max_age=CATALOG_POLL_SECONDS):
+    """
+    Returns the catalog of a service execution directory.
+
+    The directory is scanned once; afterwards the mtimes of its subdirectories are
+    polled at most every max_age seconds and only the ones that changed are scanned
+    again, so files that arrive later are picked up without a restart.
+
+    Args:
+        root (str): The service execution directory.
+        max_age (float): Seconds a catalog is trusted before polling.
+
+    Returns:
+        A dict whose 'kinds' map every kind of file (bus, canbus, report) to its
+        'files' indexed by (YYYYMMDD date, bus ID or None), its 'dates' and the
+        'buses' of every date. The dict is never modified once returned.
+    """
+    root = os.path.abspath(root)
+    with _lock:
+        catalog = _catalogs.get(root)
+        if catalog is None or time.monotonic() - catalog['checked'] >= max_age:
+            catalog = _build_catalog(root, catalog)
+            _catalogs[root] = catalog
+    return catalog
+
+
+def find_file(root, kind, date, bus=None):
+    """
+    Looks up a file in the catalog.
+
+    Args:
+        root (str): The service execution directory.
+        kind (str): 'bus', 'canbus' or 'report'.
+        date (str): The day as YYYYMMDD.
+        bus (str): The bus ID (e.g. 'E801') for per-bus files.
+
+    Returns:
+        The path of the file, or None if there is no such file.
+    """
+    return get_catalog(root)['kinds'][kind]['files'].get((date, bus))
+
+
+def list_dates(root, kind):
+    """Returns the days (YYYYMMDD) for which files of a kind exist."""
+    return get_catalog(root)['kinds'][kind]['dates']
+
+
+def list_buses(root, kind, date):
+    """Returns the bus IDs that have a file of a kind on a day."""
+    return get_catalog(root)['kinds'][kind]['buses'].get(date, frozenset())
+
+
+def write_atomically(path, write):
+    """
+    Writes a file through a temporary file of its own next to it, then moves it in place.
+
+    Readers only ever see complete files, and concurrent writers (threads or processes)
+    never share a temporary file.
+
+    Args:
+        path (str): The file to write.
+        write (callable): Function receiving the temporary path and writing the content there.
+    """
+    tmp_path = '{}.{}.tmp'.format(path, uuid.uuid4().hex)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
@@ -0,0 +1,114 @@
+import io
+import os
+import pickle
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import seaborn as sns
+
+CHART_FORMATS = {'png': 'image/png', 'svg': 'image/svg+xml'}
+# Rendered charts kept in memory, least recently used first out
+CHART_CACHE_SIZE = 64
+# Processes rendering charts, 0 renders in the request thread
+CHART_WORKERS = int(os.environ.get('UC1_CHART_WORKERS', '0'))
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _draw_battery_heatmap(fig, battery_data, title):
+    ax = fig.subplots()
+    sns.heatmap(battery_data, annot=True, cmap="YlGnBu", cbar=True, linewidths=0.5, ax=ax)
+
+    # Rotate the x-axis labels for clarity
+    for label in ax.get_xticklabels():
+        label.set_rotation(45)
+        label.set_horizontalalignment('right')
+
+    ax.set_title(title)
+    ax.set_xlabel('Battery Levels')
+    ax.set_ylabel('Bus ID')
+
+
+def _draw_average_delays(fig, average_delays, punctuality_percentages):
+    bus_lines = list(average_delays.keys())
+    delays = list(average_delays.values())
+    punctualities = [punctuality_percentages[bus_line] for bus_line in bus_lines]
+
+    # Plot average delays
+    ax1 = fig.subplots()
+    sns.barplot(x=bus_lines, y=delays, hue=bus_lines, palette="viridis", legend=False, ax=ax1)
+    ax1.set_xlabel('Bus Line')
+    ax1.set_ylabel('Average Delay (minutes)', color='b')
+    ax1.tick_params(axis='y', labelcolor='b')
+    ax1.tick_params(axis='x', labelrotation=45)
+
+    # Create another y-axis for punctuality percentages
+    ax2 = ax1.twinx()
+    sns.lineplot(x=bus_lines, y=punctualities, marker='o', color='r', ax=ax2)
+    ax2.set_ylabel('Punctuality (%)', color='r')
+    ax2.tick_params(axis='y', labelcolor='r')
+
+    ax2.set_title('Average Delay per Bus Line with Punctuality Percentage (0E801 - 0E830)')
+
+
+CHARTS = {
+    'battery_heatmap': _draw_battery_heatmap,
+    'average_delays': _draw_average_delays
+}
+
+
+def _render(chart, args, fmt):
+    # A figure of its own per render: no pyplot state is shared between threads,
+    # and the figure is garbage once the bytes are out
+    fig = Figure(figsize=(10, 6))
+    FigureCanvasAgg(fig)
+    CHARTS[chart](fig, *args)
+    fig.tight_layout()
+    output = io.BytesIO()
+    fig.savefig(output, format=fmt)
+    return output.getvalue()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=CHART_WORKERS)
+        return _pool
+
+
+def render_chart(chart, *args, fmt='png'):
+    """
+    Renders a chart, or returns it from the cache if it was rendered from the same data.
+
+    Args:
+        chart (str): A key of CHARTS ('battery_heatmap' or 'average_delays').
+        *args: The data of the chart, passed to its drawing function.
+        fmt (str): 'png' or 'svg'.
+
+    Returns:
+        The bytes of the image.
+    """
+    # The data itself is the version of a chart
+    key = hashlib.sha1(pickle.dumps((chart, args, fmt))).hexdigest()
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+
+    if CHART_WORKERS > 0:
+        image = _get_pool().submit(_render, chart, args, fmt).result()
+    else:
+        image = _render(chart, args, fmt)
+
+    with _cache_lock:
+        _cache[key] = image
+        while len(_cache) > CHART_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return image
@@ -0,0 +1,104 @@
+import os
+import threading
+import pandas as pd
+from static.iroute_parsing import read_bus_file, parse_files
+
+# An event is punctual when its delay is within this many seconds
+PUNCTUALITY_WINDOW_SECONDS = 300
+BUS_FILE_SUFFIX = '_bus.csv'
+
+# Per-file partial aggregates and the last merged result, keyed by file signatures
+_partials = {}
+_totals = {}
+_lock = threading.Lock()
+
+
+def _file_signature(file_path):
+    stat = os.stat(file_path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def compute_file_partials(file_path):
+    """
+    Aggregates the delays of one service execution file per bus line.
+
+    Args:
+        file_path (str): The path to a *_bus.csv file.
+
+    Returns:
+        A pandas DataFrame indexed by bus line (in order of first appearance) with the
+        columns delay_sum (seconds), events and punctual.
+    """
+    bus_data = read_bus_file(file_path)
+    bus_data = bus_data[bus_data['delay_seconds'].notna()]  # Skip delays that could not be parsed
+    punctual = bus_data['delay_seconds'].between(-PUNCTUALITY_WINDOW_SECONDS, PUNCTUALITY_WINDOW_SECONDS)
+    grouped = bus_data.assign(punctual=punctual).groupby('bus_line', sort=False)
+    return pd.DataFrame({
+        'delay_sum': grouped['delay_seconds'].sum(),
+        'events': grouped.size(),
+        'punctual': grouped['punctual'].sum()
+    }, columns=['delay_sum', 'events', 'punctual'])
+
+
+def _cached_partials(file_path, signature):
+    with _lock:
+        cached = _partials.get(file_path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    return None
+
+
+def list_bus_files(bus_dir):
+    return [
+        os.path.join(bus_dir, filename)
+        for filename in os.listdir(bus_dir) if filename.endswith(BUS_FILE_SUFFIX)
+    ]
+
+
+def get_average_delays(bus_dir):
+    """
+    Average delay (minutes) and punctuality (%) per bus line over all service execution files.
+
+    Only new or changed files are parsed (in parallel); the merged result is reused while
+    no file changed.
+
+    Args:
+        bus_dir (str): The yyyymmdd_bus directory.
+
+    Returns:
+        A tuple of dicts (average_delays, punctuality_percentages) keyed by bus line.
+    """
+    file_paths = list_bus_files(bus_dir)
+    signatures = [_file_signature(file_path) for file_path in file_paths]
+    frames = [_cached_partials(file_path, signature) for file_path, signature in zip(file_paths, signatures)]
+
+    # New or changed files are parsed on the process pool
+    stale = [i for i, frame in enumerate(frames) if frame is None]
+    for i, result in zip(stale, parse_files(compute_file_partials, [file_paths[i] for i in stale])):
+        if isinstance(result, Exception):
+            raise result
+        frames[i] = result
+        with _lock:
+            _partials[file_paths[i]] = (signatures[i], result)
+
+    key = tuple(zip(file_paths, signatures))
+    with _lock:
+        cached = _totals.get(bus_dir)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        # Files that disappeared from the directory are not merged again
+        for removed in [p for p in _partials if os.path.dirname(p) == bus_dir and p not in file_paths]:
+            del _partials[removed]
+
+    if frames:
+        totals = pd.concat(frames).groupby(level=0, sort=False).sum()
+        totals = totals[totals['events'] > 0]
+    else:
+        totals = pd.DataFrame(columns=['delay_sum', 'events', 'punctual'])
+    average_delays = (totals['delay_sum'] / totals['events'] / 60).to_dict()  # Convert to minutes
+    punctuality_percentages = (totals['punctual'] / totals['events'] * 100).to_dict()
+
+    result = (average_delays, punctuality_percentages)
+    with _lock:
+        _totals[bus_dir] = (key, result)
+    return result
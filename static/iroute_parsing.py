@@ -0,0 +1,241 @@
+import io
+import os
+import csv
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+# Buses 0E801 - 0E830 are the ones covered by the service execution reports
+VALID_BUS_IDS = {f"0E{str(i).zfill(3)}" for i in range(801, 831)}
+# Service execution lines with fewer fields are incomplete
+BUS_FILE_MIN_FIELDS = 27
+BATTERY_SIGNAL = 'tractionBatterySocSOLEL'
+
+# Below this many files the process pool costs more than it saves
+PARALLEL_MIN_FILES = 4
+PARSE_WORKERS = os.cpu_count() or 1
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+# Delays are written as hh:mm:ss, mm:ss or ss with an optional leading minus
+_TIME_PATTERN = r'-*[0-9]+(?::[0-9]+){0,2}'
+
+
+def _parse_time(value):
+    """Parses one time that does not follow _TIME_PATTERN, with the rules of int() per part."""
+    is_negative = value.startswith('-')
+    parts = value.lstrip('-').split(':')
+    try:
+        if len(parts) == 3:
+            h, m, s = map(int, parts)
+        elif len(parts) == 2:
+            h, m, s = 0, *map(int, parts)
+        elif len(parts) == 1:
+            h, m, s = 0, 0, int(parts[0])
+        else:
+            return None
+    except ValueError:
+        return None
+    total_seconds = h * 3600 + m * 60 + s
+    return -total_seconds if is_negative else total_seconds
+
+
+def parse_times_to_seconds(values):
+    """
+    Converts a column of hh:mm:ss (or mm:ss, ss) times to seconds, handling negative values.
+
+    Empty values count as 0 seconds. Values that are not times are masked instead of
+    being logged one by one. Values in the usual form are parsed all at once; the
+    rare others (signs or spaces inside a part, e.g. '+5' or '00:-1:00') follow the
+    rules of int() for every part. Unlike plain int(), values that do not fit in an
+    int32 are masked too.
+
+    Args:
+        values (array-like): The time strings.
+
+    Returns:
+        A tuple (seconds, valid) of an int32 array (0 where invalid) and a boolean mask.
+    """
+    text = pd.Series(values, dtype=object)
+    text = text.where(text.map(lambda value: isinstance(value, str)), '')
+    if text.empty:
+        return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=bool)
+    regular = (text.str.fullmatch(_TIME_PATTERN).to_numpy(dtype=bool) | (text == '').to_numpy())
+    negative = text.str.startswith('-').to_numpy(dtype=bool)
+
+    # Walk the characters of all the regular times at once: digits build the current part,
+    # a colon carries the parts read so far into the next unit
+    chars = np.array(text.where(regular, '').str.lstrip('-').tolist(), dtype=str)
+    chars = chars.view(np.uint32).reshape(len(text), -1)
+    seconds = np.zeros(len(text))
+    part = np.zeros(len(text))
+    for column in chars.T:
+        digit = (column >= ord('0')) & (column <= ord('9'))
+        colon = column == ord(':')
+        part = np.where(digit, part * 10 + (column - ord('0')), part)
+        seconds = np.where(colon, (seconds + part) * 60, seconds)
+        part = np.where(colon, 0, part)
+    seconds = np.where(negative, -(seconds + part), seconds + part)
+
+    valid = regular.copy()
+    for i in np.flatnonzero(~regular):
+        parsed = _parse_time(text.iat[i])
+        if parsed is not None:
+            seconds[i] = parsed
+            valid[i] = True
+
+    valid &= np.abs(seconds) <= np.iinfo(np.int32).max
+    return np.where(valid, seconds, 0).astype(np.int32), valid
+
+
+def read_bus_file(file_path, bus_ids=VALID_BUS_IDS):
+    """
+    Reads a service execution file (*_bus.csv, no header) into a typed frame.
+
+    Only complete lines are kept, by default those of buses 0E801 - 0E830. Fields are split
+    on every comma, like the reports are written.
+
+    Args:
+        file_path (str): The path to the *_bus.csv file.
+        bus_ids (set): The buses to keep, None for all of them.
+
+    Returns:
+        A pandas DataFrame with the columns bus_id, trip_block_id, block_id, stop_code, bus_line,
+        odometer_start, odometer_end, depot_entry_time, depot_exit_time and
+        delay_seconds (nullable Int32, missing when the delay cannot be parsed), in file order.
+    """
+    # Universal newlines, like reading the file line by line: \r\n and lone \r end a line too
+    with open(file_path, 'rb') as f:
+        data = f.read().replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+
+    # Count the fields of every line (blank ones included) straight from the bytes, so that
+    # the counts stay aligned with the rows of the parser below
+    raw = np.frombuffer(data, dtype=np.uint8)
+    ends = np.flatnonzero(raw == ord('\n'))
+    if len(raw) and raw[-1] != ord('\n'):
+        ends = np.r_[ends, len(raw)]
+    starts = np.r_[0, ends[:-1] + 1] if len(ends) else ends
+    commas = np.r_[0, np.cumsum(raw == ord(','))]
+    field_counts = commas[ends] - commas[starts] + 1
+    if len(field_counts) == 0:
+        field_counts = np.zeros(0, dtype=np.int64)
+
+    fields = pd.read_csv(
+        io.BytesIO(data), header=None, names=range(max(int(field_counts.max(initial=0)), BUS_FILE_MIN_FIELDS)),
+        dtype=str, keep_default_na=False, quoting=csv.QUOTE_NONE, skip_blank_lines=False
+    )
+    keep = field_counts >= BUS_FILE_MIN_FIELDS
+    if bus_ids is not None:
+        keep &= fields[0].isin(bus_ids).to_numpy()
+    fields = fields[keep]
+
+    # An empty start reads as 0, an empty end as the start, anything unparsable as 0 km
+    start = pd.to_numeric(fields[12].replace('', '0'), errors='coerce')
+    end = pd.to_numeric(fields[13].where(fields[13] != '', fields[12].replace('', '0')), errors='coerce')
+    unparsable = (start.isna() | end.isna()).to_numpy()
+    start = np.where(unparsable, 0.0, start.to_numpy(dtype=float))
+    end = np.where(unparsable, 0.0, end.to_numpy(dtype=float))
+
+    delay_seconds, delay_valid = parse_times_to_seconds(fields[25].to_numpy(dtype=object))
+
+    return pd.DataFrame({
+        'bus_id': fields[0].to_numpy(dtype=object),
+        'trip_block_id': fields[3].to_numpy(dtype=object),  # The block the trajectory map groups trips by
+        'block_id': fields[4].to_numpy(dtype=object),
+        'stop_code': fields[8].to_numpy(dtype=object),
+        'bus_line': fields[10].to_numpy(dtype=object),
+        'odometer_start': start,
+        'odometer_end': end,
+        'depot_entry_time': fields[13].to_numpy(dtype=object),
+        'depot_exit_time': fields[14].to_numpy(dtype=object),
+        'delay_seconds': pd.arrays.IntegerArray(delay_seconds, ~delay_valid)
+    })
+
+
+def _read_canbus_csv(file_path):
+    df = pd.read_csv(file_path, skiprows=1)  # Skip the first line containing "sep=,"
+    if 'Date' not in df.columns or 'Signal' not in df.columns or 'Value' not in df.columns:
+        raise ValueError(f"Required columns not found in {file_path}. Columns found: {df.columns.tolist()}")
+    return df
+
+
+def _typed_canbus_frame(df):
+    df = df.assign(
+        Date=pd.to_datetime(df['Date'], format='%Y/%m/%d %H:%M:%S', errors='coerce'),
+        Value=pd.to_numeric(df['Value'], errors='coerce')
+    )
+    return df.dropna(subset=['Date']).sort_values(by='Date').reset_index(drop=True)
+
+
+def read_canbus_file(file_path, signal=None):
+    """
+    Reads a CAN bus export (YYYY-MM-DD_Exxx.csv) into a typed frame.
+
+    Args:
+        file_path (str): The path to the CAN bus file.
+        signal (str): Optional signal to keep.
+
+    Returns:
+        A pandas DataFrame with Date (datetime), Signal and Value (float) sorted by Date,
+        plus any other column of the file.
+
+    Raises:
+        ValueError: If the file lacks the Date, Signal or Value columns.
+    """
+    df = _read_canbus_csv(file_path)
+    if signal is not None:
+        df = df[df['Signal'] == signal]
+    return _typed_canbus_frame(df)
+
+
+def read_canbus_signals(file_path):
+    """
+    Reads a CAN bus export once and splits it by signal.
+
+    Returns:
+        A dict mapping every signal of the file to the frame read_canbus_file would return
+        for it.
+
+    Raises:
+        ValueError: If the file lacks the Date, Signal or Value columns.
+    """
+    df = _read_canbus_csv(file_path)
+    return {signal: _typed_canbus_frame(group) for signal, group in df.groupby('Signal', sort=True)}
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=PARSE_WORKERS)
+        return _pool
+
+
+def _parse_one(parser, file_path, args):
+    try:
+        return parser(file_path, *args)
+    except Exception as e:
+        return e
+
+
+def parse_files(parser, file_paths, *args):
+    """
+    Applies a parser to many files, on a shared process pool when there are enough of them.
+
+    Args:
+        parser (callable): A module level function taking a file path (and args).
+        file_paths (list): The files to parse.
+        *args: Extra arguments passed to every call.
+
+    Returns:
+        A list aligned with file_paths holding each result, or the exception raised
+        while parsing that file.
+    """
+    file_paths = list(file_paths)
+    if len(file_paths) < PARALLEL_MIN_FILES or PARSE_WORKERS < 2:
+        return [_parse_one(parser, file_path, args) for file_path in file_paths]
+    n = len(file_paths)
+    return list(_get_pool().map(_parse_one, [parser] * n, file_paths, [args] * n))
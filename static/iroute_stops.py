@@ -0,0 +1,114 @@
+import os
+import threading
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import BallTree
+from static.geo import EARTH_RADIUS_M
+
+# Files tried, in order, in a directory holding the stop list
+STOPS_FILE_NAMES = ['stops.csv', 'stops.txt']
+
+_indexes = {}
+_lock = threading.Lock()
+
+
+def find_stops_file(directory):
+    """Returns the stops.csv (or GTFS stops.txt) of a directory, or None."""
+    for name in STOPS_FILE_NAMES:
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def _source_signature(file_path):
+    stat = os.stat(file_path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def build_stop_index(stops_path):
+    """
+    Loads a stop list and builds its haversine BallTree.
+
+    Args:
+        stops_path (str): A stops.csv or stops.txt file (stop_id, stop_code, stop_name,
+            stop_lat, stop_lon).
+
+    Returns:
+        A dict with the stops (a DataFrame with a positional index, stops without
+        coordinates left out), their coordinates in radians and the BallTree over them.
+    """
+    stops = pd.read_csv(stops_path)
+    stops = stops[stops['stop_lat'].notna() & stops['stop_lon'].notna()].reset_index(drop=True)
+    coords = np.radians(stops[['stop_lat', 'stop_lon']].to_numpy(dtype=float))
+    return {'stops': stops, 'coords': coords, 'tree': BallTree(coords, metric='haversine')}
+
+
+def load_stop_index(stops_path):
+    """Returns the stop index of a file, built once per version of the file (see build_stop_index)."""
+    signature = _source_signature(stops_path)
+    with _lock:
+        cached = _indexes.get(stops_path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    index = build_stop_index(stops_path)
+    with _lock:
+        _indexes[stops_path] = (signature, index)
+    return index
+
+
+def _query_coords(lat, lon):
+    coords = np.radians(np.column_stack([np.asarray(lat, dtype=float), np.asarray(lon, dtype=float)]))
+    return coords, np.isfinite(coords).all(axis=1)
+
+
+def nearest_stops(index, lat, lon, max_distance_m=None):
+    """
+    Finds the nearest stop of every GPS point.
+
+    Args:
+        index (dict): A stop index (see load_stop_index).
+        lat, lon (array-like): Coordinates in degrees.
+        max_distance_m (float): Points farther than this from every stop get no stop.
+
+    Returns:
+        A tuple (positions, distances): the row of the nearest stop in index['stops']
+        (-1 when there is none) and the distance to it in metres (inf when there is none).
+    """
+    coords, valid = _query_coords(lat, lon)
+    positions = np.full(len(coords), -1, dtype=np.int64)
+    distances = np.full(len(coords), np.inf)
+    if valid.any() and len(index['stops']):
+        found, rows = index['tree'].query(coords[valid], k=1)
+        distances[valid] = found[:, 0] * EARTH_RADIUS_M
+        positions[valid] = rows[:, 0]
+    if max_distance_m is not None:
+        far = distances > max_distance_m
+        positions[far] = -1
+        distances[far] = np.inf
+    return positions, distances
+
+
+def stops_within(index, lat, lon, radius_m):
+    """
+    Finds all the stops within a radius of every GPS point.
+
+    Args:
+        index (dict): A stop index (see load_stop_index).
+        lat, lon (array-like): Coordinates in degrees.
+        radius_m (float): The radius in metres.
+
+    Returns:
+        A tuple (positions, distances) of lists with, for every point, the rows of the stops
+        in index['stops'] and their distances in metres, nearest first.
+    """
+    coords, valid = _query_coords(lat, lon)
+    positions = [np.empty(0, dtype=np.int64)] * len(coords)
+    distances = [np.empty(0)] * len(coords)
+    if valid.any() and len(index['stops']):
+        rows, found = index['tree'].query_radius(coords[valid], r=radius_m / EARTH_RADIUS_M,
+                                                 return_distance=True, sort_results=True)
+        for i, point_rows, point_distances in zip(np.flatnonzero(valid), rows, found):
+            positions[i] = point_rows.astype(np.int64)
+            distances[i] = point_distances * EARTH_RADIUS_M
+    return positions, distances
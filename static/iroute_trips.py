@@ -0,0 +1,173 @@
+import os
+import json
+import logging
+import threading
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from static.iroute_catalog import write_atomically
+from static.iroute_parsing import read_bus_file
+from static.iroute_stops import load_stop_index
+
+PATHS_CACHE_SUFFIX = '.parquet'
+METADATA_KEY = b'iroute_source'
+# Days whose trip geometries are kept in memory
+TRIP_CACHE_DAYS = 8
+
+_paths = {}
+_trips = {}
+_lock = threading.Lock()
+
+
+def _source_signature(file_path):
+    stat = os.stat(file_path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def load_paths(xlsx_path):
+    """
+    Reads the path table (Percorsi_bus.xlsx: ID_PERCORSO, LINEA, ...).
+
+    The workbook is parsed once per version and kept as a Parquet file next to it
+    (Percorsi_bus.parquet), so later processes skip the Excel parser entirely.
+
+    Returns:
+        A pandas DataFrame with LINEA as text (e.g. '003').
+    """
+    signature = _source_signature(xlsx_path)
+    with _lock:
+        cached = _paths.get(xlsx_path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+
+    cache_path = os.path.splitext(xlsx_path)[0] + PATHS_CACHE_SUFFIX
+    paths = None
+    try:
+        table = pq.read_table(cache_path)
+        if json.loads((table.schema.metadata or {})[METADATA_KEY]) == signature:
+            paths = table.to_pandas()
+    except (OSError, KeyError, ValueError, pa.ArrowInvalid):
+        pass
+    if paths is None:
+        paths = pd.read_excel(xlsx_path, dtype={'LINEA': str})
+        table = pa.Table.from_pandas(paths, preserve_index=False)
+        metadata = dict(table.schema.metadata or {})
+        metadata[METADATA_KEY] = json.dumps(signature).encode()
+        try:
+            write_atomically(cache_path, lambda tmp_path: pq.write_table(table.replace_schema_metadata(metadata), tmp_path))
+        except OSError as e:
+            logging.warning(f"Could not cache {xlsx_path}: {e}")
+
+    with _lock:
+        _paths[xlsx_path] = (signature, paths)
+    return paths
+
+
+def load_stops(stops_path):
+    """Returns the stops of stops.csv (or stops.txt) from the shared stop index."""
+    return load_stop_index(stops_path)['stops']
+
+
+def build_trip_geometries(bus_file_path, paths_path, stops_path):
+    """
+    Builds the geometry of every trip of a service execution file.
+
+    A trip is the stop visits of one block on one path; its geometry is the ordered
+    coordinates of the visited stops.
+
+    Args:
+        bus_file_path (str): A YYYYMMDD_bus.csv file.
+        paths_path (str): Percorsi_bus.xlsx.
+        stops_path (str): stops.csv or stops.txt.
+
+    Returns:
+        A pandas DataFrame indexed by (block_id, path_id) with the columns line, bus_ids
+        (the buses that ran the trip), average_delay (minutes, rounded to 2 decimals, NaN without delays), and lat, lon,
+        stop_name holding the visited stops in file order (stops without coordinates
+        are skipped).
+    """
+    paths = load_paths(paths_path)
+    stops = load_stops(stops_path)
+    bus_data = read_bus_file(bus_file_path, bus_ids=None)
+
+    line_by_path = dict(zip(paths['ID_PERCORSO'], paths['LINEA']))
+    path_id = pd.to_numeric(bus_data['bus_line'], errors='coerce')
+    known = path_id.isin(paths['ID_PERCORSO']).to_numpy()
+    visits = pd.DataFrame({
+        'bus_id': bus_data['bus_id'].to_numpy()[known],
+        'block_id': bus_data['trip_block_id'].to_numpy()[known],
+        'path_id': path_id.to_numpy()[known].astype(np.int64),
+        'stop_code': pd.to_numeric(bus_data['stop_code'], errors='coerce').to_numpy()[known],
+        'delay_seconds': bus_data['delay_seconds'].to_numpy(dtype=float, na_value=np.nan)[known]
+    })
+    visits = visits.merge(stops[['stop_code', 'stop_name', 'stop_lat', 'stop_lon']], on='stop_code', how='left')
+
+    rows, keys = [], []
+    for key, positions in visits.groupby(['block_id', 'path_id'], sort=True).indices.items():
+        trip = visits.iloc[positions]
+        delays = trip['delay_seconds'].dropna()
+        located = trip[trip['stop_lat'].notna() & trip['stop_lon'].notna()]
+        keys.append(key)
+        rows.append({
+            'line': line_by_path[key[1]],
+            'bus_ids': sorted(trip['bus_id'].unique()),
+            'average_delay': round(delays.mean() / 60, 2) if len(delays) else np.nan,  # Convert to minutes
+            'lat': located['stop_lat'].to_numpy(),
+            'lon': located['stop_lon'].to_numpy(),
+            'stop_name': located['stop_name'].tolist()
+        })
+    index = pd.MultiIndex.from_tuples(keys, names=['block_id', 'path_id'])
+    return pd.DataFrame(rows, index=index, columns=['line', 'bus_ids', 'average_delay', 'lat', 'lon', 'stop_name'])
+
+
+def get_trip_geometries(bus_file_path, paths_path, stops_path):
+    """
+    Returns the trip geometries of a day, built once per version of its input files.
+
+    See build_trip_geometries for the arguments and the result.
+    """
+    key = (bus_file_path, paths_path, stops_path)
+    signature = [_source_signature(path) for path in key]
+    with _lock:
+        cached = _trips.get(key)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+
+    geometries = build_trip_geometries(*key)
+    with _lock:
+        _trips.pop(key, None)
+        _trips[key] = (signature, geometries)
+        # Dicts keep insertion order, the first entry is the least recently built day
+        while len(_trips) > TRIP_CACHE_DAYS:
+            del _trips[next(iter(_trips))]
+    return geometries
+
+
+def trips_geojson(geometries):
+    """
+    Converts trip geometries into two GeoJSON feature collections.
+
+    Returns:
+        A tuple (lines, stops): a LineString per trip with at least two located stops,
+        and a Point per located stop visit, each with the label to show.
+    """
+    lines, stops = [], []
+    for (block_id, path_id), trip in geometries.iterrows():
+        label = f"Block ID: {block_id}, Path ID: {path_id}"
+        coordinates = np.column_stack([trip['lon'], trip['lat']]).tolist()
+        if len(coordinates) > 1:
+            tooltip = label if pd.isna(trip['average_delay']) or not trip['average_delay'] else \
+                f"{label}, Avg Delay: {trip['average_delay']} mins"
+            lines.append({
+                'type': 'Feature',
+                'geometry': {'type': 'LineString', 'coordinates': coordinates},
+                'properties': {'block_id': block_id, 'path_id': int(path_id), 'line': trip['line'], 'label': tooltip}
+            })
+        for point, stop_name in zip(coordinates, trip['stop_name']):
+            stops.append({
+                'type': 'Feature',
+                'geometry': {'type': 'Point', 'coordinates': point},
+                'properties': {'label': f"{label}, Stop Name: {stop_name}"}
+            })
+    return {'type': 'FeatureCollection', 'features': lines}, {'type': 'FeatureCollection', 'features': stops}
@@ -4,6 +4,9 @@ import folium
 from folium.plugins import MarkerCluster, AntPath
 from haversine import haversine
 from static.ais_ship_types import ship_types
+from static.ais_trips import trip_breaks
+import static.ais_store as store
+import static.ais_rf as ais_rf
 
 
 def read_csv_nrows(dataset_url, n):
@@ -73,9 +76,12 @@ def create_map_with_trip(dataset_url, zoom_start, marker_limit):
         popup_text = "Ship ID: {}<br>Timestamp: {}".format(row['shipid'], row['t'])
         folium.Marker(location=[row['lat'], row['lon']], popup=popup_text).add_to(marker_cluster)
 
-    # Create a polyline to show the vessel's trip
-    trip_coords = df[['lat', 'lon']].values.tolist()
-    folium.PolyLine(locations=trip_coords, color='blue').add_to(m)
+    # Create one polyline per trip, so unrelated vessels and data gaps are not connected
+    df = df.sort_values(['shipid', 't'], kind='mergesort')
+    breaks, _ = trip_breaks(df)
+    for _, trip in df.groupby(np.cumsum(breaks), sort=False):
+        if len(trip) > 1:
+            folium.PolyLine(locations=trip[['lat', 'lon']].values.tolist(), color='blue').add_to(m)
 
     html_string = m._repr_html_()
     # Save the map to an HTML file
@@ -85,16 +91,8 @@ def create_map_with_trip(dataset_url, zoom_start, marker_limit):
 
 
 def get_aggregated_data(dataset_url):
-    # Load the dataset
-    df = pd.read_csv(dataset_url)
-    df = df.dropna(subset=['lon', 'lat'])
-
-    # Convert the BaseDateTime column to a datetime object
-    df['t'] = pd.to_datetime(df['t'])
-    # Group the data by vessel ID and get the latest timestamp for each vessel
-    latest_df = df.groupby('shipid')['t'].max().reset_index()
-    # Merge the latest timestamp with the original dataframe to get the latest data for each vessel
-    latest_data = pd.merge(latest_df, df, on=['shipid', 't'])
+    # Latest fix of every vessel, maintained by the AIS store
+    latest_data = store.get_store(dataset_url)['latest'].sort_values(['shipid', 't']).copy()
     # Convert the BaseDateTime values to strings
     latest_data['t'] = latest_data['t'].dt.strftime('%Y-%m-%d %H:%M:%S')
     # Select the columns to include in the output
@@ -109,14 +107,11 @@ def get_aggregated_data(dataset_url):
 
 
 def get_aggregated_vessel_data(dataset_url, shipid):
-    # Load the dataset
-    df = pd.read_csv(dataset_url)
-    df = df.dropna(subset=['lon', 'lat'])
+    # Load the time ordered rows of the given shipid from the AIS store
+    vessel_data = store.get_ship_frame(dataset_url, shipid).copy()
 
-    # Convert the BaseDateTime column to a datetime object and then to a string
-    df['t'] = pd.to_datetime(df['t']).astype(str)
-    # Filter the data for the given shipid
-    vessel_data = df[df['shipid'] == shipid]
+    # Convert the BaseDateTime column to a string
+    vessel_data['t'] = vessel_data['t'].astype(str)
     # Check if the vessel is moving on the latest data
     moving = False
     latest_data = vessel_data.iloc[-1]
@@ -157,14 +152,11 @@ def get_aggregated_vessel_data(dataset_url, shipid):
     return latest_data[output_columns + ['moving', 'avg_speed', 'min_speed', 'max_speed', 'avg_draught', 'min_draught', 'max_draught', 'distance']].to_dict('records')
 
 def get_all_vessel_data(dataset_url, shipid):
-    # Load the dataset
-    df = pd.read_csv(dataset_url)
-    df = df.dropna(subset=['lon', 'lat'])
+    # Load the time ordered rows of the given shipid from the AIS store
+    vessel_data = store.get_ship_frame(dataset_url, shipid).copy()
 
-    # Convert the BaseDateTime column to a datetime object and then to a string
-    df['t'] = pd.to_datetime(df['t']).astype(str)
-    # Filter the data for the given shipid
-    vessel_data = df[df['shipid'] == shipid]
+    # Convert the BaseDateTime column to a string
+    vessel_data['t'] = vessel_data['t'].astype(str)
 
     # Replace the shiptype number with the corresponding ship type name from the shipTypes mapping object
     vessel_data['shiptype'] = vessel_data['shiptype'].apply(lambda x: ship_types[x] if x in ship_types else 'Unknown')
@@ -176,12 +168,14 @@ def get_all_vessel_data(dataset_url, shipid):
 
 
 def get_aggregated_statistic_data(dataset_url):
-    # Load the dataset
-    df = pd.read_csv(dataset_url)
-    #df = df.dropna(subset=['lon', 'lat'])
-
-    # Group the data by shipid and calculate the average speed, course, and draft for each vessel
-    agg_df = df.groupby('shipid').agg({'speed': 'mean', 'course': 'mean', 'draught': 'mean'})
+    # Per-vessel sums and counts, maintained by the AIS store
+    summary = store.get_store(dataset_url)['summary']
+
+    # Average speed, course, and draft of each vessel
+    agg_df = pd.DataFrame({
+        column: summary[column + '_sum'] / summary[column + '_count'].where(summary[column + '_count'] > 0)
+        for column in ['speed', 'course', 'draught']
+    })
     
     # Convert the average course values to degrees (0-360)
     agg_df['course'] = agg_df['course'].apply(lambda x: x % 360)
@@ -249,9 +243,7 @@ def create_map_with_markers_and_popups(aggr_data, traj_aggr_data, token_status):
 #######################################################
 
 def create_vessel_trajectory(dataset_url, shipid):
-    df = pd.read_csv(dataset_url)
-    df = df[df['shipid'] == str(shipid)]
-    df = df.dropna(subset=['lon', 'lat'])
+    df = store.get_ship_frame(dataset_url, shipid)
 
     if df.empty:
         return "No data available for this ship ID."
@@ -267,57 +259,100 @@ def create_vessel_trajectory(dataset_url, shipid):
     trip_coords = df[['lat', 'lon']].values.tolist()
     earliest_timestamp = df['t'].min()
     latest_timestamp = df['t'].max()
-    antpath = AntPath(
-        locations=trip_coords,
-        dash_array=[10, 20],
-        delay=800,
-        weight=5,
-        color='#FF0000',
-        pulse_color='#FFFFFF',
-        reverse=False,
-        # Set the heading of the first arrow based on the direction from the first to the last point
-        heading=np.arctan2(trip_coords[-1][1]-trip_coords[0][1], trip_coords[-1][0]-trip_coords[0][0]) * 180/np.pi,
-        # Set the heading of the last arrow based on the direction from the second to the last point
-        heading_toward_end=np.arctan2(trip_coords[-1][1]-trip_coords[-2][1], trip_coords[-1][0]-trip_coords[-2][0]) * 180/np.pi
-    )
-    antpath.add_to(m)
+    # A path needs at least two fixes
+    if len(trip_coords) > 1:
+        antpath = AntPath(
+            locations=trip_coords,
+            dash_array=[10, 20],
+            delay=800,
+            weight=5,
+            color='#FF0000',
+            pulse_color='#FFFFFF',
+            reverse=False,
+            # Set the heading of the first arrow based on the direction from the first to the last point
+            heading=np.arctan2(trip_coords[-1][1]-trip_coords[0][1], trip_coords[-1][0]-trip_coords[0][0]) * 180/np.pi,
+            # Set the heading of the last arrow based on the direction from the second to the last point
+            heading_toward_end=np.arctan2(trip_coords[-1][1]-trip_coords[-2][1], trip_coords[-1][0]-trip_coords[-2][0]) * 180/np.pi
+        )
+        antpath.add_to(m)
 
     html_string = m._repr_html_()
     return html_string
 
 
-def create_map_with_ais_rf(ais_dataset_url, rf_data, zoom_start):
-    """Creates a map with AIS data in yellow and RF data in red."""
-    df_ais = pd.read_csv(ais_dataset_url).dropna(subset=['lon', 'lat'])
-    df_rf = pd.DataFrame(rf_data)
+def _points_geojson(df, properties):
+    """Builds a GeoJSON FeatureCollection of points from the lat/lon columns of a DataFrame."""
+    values = df[properties].astype(object).where(df[properties].notna(), None).to_dict('records')
+    return {
+        'type': 'FeatureCollection',
+        'features': [
+            {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [lon, lat]}, 'properties': props}
+            for lat, lon, props in zip(df['lat'].tolist(), df['lon'].tolist(), values)
+        ]
+    }
+
+
+def create_map_with_ais_rf(ais_dataset_url, rf_dataset_url, zoom_start):
+    """Creates a map with AIS data in yellow, RF data matched to AIS vessels in orange and unmatched RF data in red."""
+    df_ais = store.get_frame(ais_dataset_url)
+    _, rf_summary = ais_rf.get_associations(ais_dataset_url, rf_dataset_url)
+    rf_summary = rf_summary.assign(t=rf_summary['t'].dt.strftime('%Y-%m-%d %H:%M:%S'))
+    matched = rf_summary[rf_summary['matched']]
+    unmatched = rf_summary[~rf_summary['matched']]
 
     # Create map centered on the AIS data
     center_lat = df_ais['lat'].mean()
     center_lon = df_ais['lon'].mean()
     my_map = folium.Map(location=[center_lat, center_lon], zoom_start=zoom_start)
 
-    # Add AIS data markers (Yellow)
-    for _, row in df_ais.iterrows():
-        folium.CircleMarker(
-            [row['lat'], row['lon']],
-            radius=4,
-            color="yellow",
-            fill=True,
-            fill_color="yellow",
-            fill_opacity=0.7,
-            tooltip=f"AIS | Ship ID: {row['shipid']} | Time: {row['t']}"
-        ).add_to(my_map)
+    def circle(color):
+        return folium.CircleMarker(radius=4, color=color, fill=True, fill_color=color, fill_opacity=0.7)
 
-    # Add RF data markers (Red)
-    for _, row in df_rf.iterrows():
-        folium.CircleMarker(
-            [row['lat'], row['lon']],
-            radius=4,
-            color="red",
-            fill=True,
-            fill_color="red",
-            fill_opacity=0.7,
-            tooltip=f"RF | Time: {row['t']}"
+    # Add AIS data markers (Yellow)
+    ais_points = df_ais[['lat', 'lon', 'shipid', 't']].assign(t=df_ais['t'].dt.strftime('%Y-%m-%d %H:%M:%S'))
+    folium.GeoJson(
+        _points_geojson(ais_points, ['shipid', 't']),
+        name='AIS',
+        marker=circle('yellow'),
+        tooltip=folium.GeoJsonTooltip(fields=['shipid', 't'], aliases=['AIS | Ship ID:', 'Time:'])
+    ).add_to(my_map)
+
+    # Link every matched RF fix to the AIS position that explains it
+    if not matched.empty:
+        links = {
+            'type': 'FeatureCollection',
+            'features': [
+                {'type': 'Feature', 'properties': {},
+                 'geometry': {'type': 'LineString', 'coordinates': [[rf_lon, rf_lat], [ais_lon, ais_lat]]}}
+                for rf_lat, rf_lon, ais_lat, ais_lon in zip(
+                    matched['lat'].tolist(), matched['lon'].tolist(),
+                    matched['matched_ais_lat'].tolist(), matched['matched_ais_lon'].tolist()
+                )
+            ]
+        }
+        folium.GeoJson(
+            links, name='RF to AIS association',
+            style_function=lambda feature: {'color': 'orange', 'weight': 2}
         ).add_to(my_map)
 
+    # Add RF data markers matched to a vessel (Orange)
+    matched_fields = ['t', 'matched_shipid', 'matched_distance_m', 'candidates']
+    folium.GeoJson(
+        _points_geojson(matched, matched_fields),
+        name='RF matched to AIS',
+        marker=circle('orange'),
+        tooltip=folium.GeoJsonTooltip(
+            fields=matched_fields, aliases=['RF | Time:', 'Ship ID:', 'Distance (m):', 'Candidates:']
+        ) if not matched.empty else None
+    ).add_to(my_map)
+
+    # Add RF data markers without any AIS vessel nearby, i.e. dark vessels (Red)
+    folium.GeoJson(
+        _points_geojson(unmatched, ['t']),
+        name='RF dark vessels',
+        marker=circle('red'),
+        tooltip=folium.GeoJsonTooltip(fields=['t'], aliases=['RF (dark) | Time:']) if not unmatched.empty else None
+    ).add_to(my_map)
+
+    folium.LayerControl().add_to(my_map)
     return my_map._repr_html_()
@@ -1,41 +1,222 @@
+import os
+import io
+import threading
+import numpy as np
 import pandas as pd
 import folium
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import static.ais_store as store
+from static.geo import haversine_m
 
-def generate_prediction_map(csv_path):
-    use_cols = [
-        'timestamp', 'oid', 'lat', 'lon', 'lh',
-        'predicted_lat', 'predicted_lon', 'bearing'
-    ]
-    df = pd.read_csv(csv_path, usecols=use_cols, parse_dates=['timestamp'])
-    df = df.drop_duplicates(subset=['timestamp', 'oid', 'lat', 'lon', 'lh'])
-
-    # Group by timestamp and ship
-    agg_result = (
-        df.groupby(['timestamp', 'oid'])
-        .agg(
-            lat=('lat', 'first'),
-            lon=('lon', 'first'),
-            bearing=('bearing', 'first'),
-            predictions=('lh', list),
-            pred_lats=('predicted_lat', list),
-            pred_lons=('predicted_lon', list)
-        )
-        .reset_index()
-    )
+USE_COLS = [
+    'timestamp', 'oid', 'lat', 'lon', 'lh',
+    'predicted_lat', 'predicted_lon', 'bearing'
+]
+DTYPES = {
+    'oid': 'str',
+    'lat': 'float64',
+    'lon': 'float64',
+    'lh': 'Int32',  # Nullable, an archive may lack the horizon of some rows
+    'predicted_lat': 'float64',
+    'predicted_lon': 'float64',
+    'bearing': 'float64'
+}
+DEDUP_COLS = ['timestamp', 'oid', 'lat', 'lon', 'lh']
+# Rows parsed at a time when streaming an archive
+PREDICTION_CHUNK_ROWS = 500000
+# Rendered maps kept per archive version (oldest selections are evicted first)
+MAP_CACHE_SIZE = 64
+# Observed positions are only interpolated between AIS fixes closer in time than this
+MAX_INTERPOLATION_GAP_SECONDS = 1800
+ERROR_QUANTILES = [0.1, 0.25, 0.5, 0.75, 0.9, 0.95]
+
+# One entry per prediction archive, rebuilt only when the archive changes
+_predictions = {}
+_lock = threading.Lock()
+
+
+def _same_keys(a, b):
+    """Compares the DEDUP_COLS of two aligned frames row by row, missing values matching each other."""
+    same = np.ones(len(a), dtype=bool)
+    for column in DEDUP_COLS:
+        left, right = a[column].reset_index(drop=True), b[column].reset_index(drop=True)
+        equal = left.eq(right).fillna(False).to_numpy(dtype=bool)
+        same &= equal | (left.isna() & right.isna()).to_numpy()
+    return same
+
+
+def _read_predictions(csv_path, chunk_rows=PREDICTION_CHUNK_ROWS):
+    """
+    Streams a prediction archive chunk by chunk, keeping only typed, unique rows.
+
+    Only the needed columns are parsed. Every chunk is de-duplicated on its own, then
+    against the rows kept so far through a sorted array of their DEDUP_COLS hashes; a
+    matching hash is confirmed on the values themselves. Kept rows are held as column
+    arrays and joined one column at a time, so the archive is never held twice.
+
+    Args:
+        csv_path (str): The path to the prediction archive (CSV or zipped CSV).
+        chunk_rows (int): Rows parsed at a time.
+
+    Returns:
+        A pandas DataFrame with the unique predictions in file order.
+    """
+    parts = {column: [] for column in USE_COLS}
+    starts = []  # First kept row of every chunk
+    kept = 0
+    seen_hashes = np.empty(0, dtype=np.uint64)
+    seen_rows = np.empty(0, dtype=np.int64)
+
+    def kept_keys(rows):
+        # The DEDUP_COLS of kept rows, looked up in the chunk holding each of them
+        chunk_of = np.searchsorted(starts, rows, side='right') - 1
+        pieces, positions = [], []
+        for chunk in np.unique(chunk_of):
+            where = np.flatnonzero(chunk_of == chunk)
+            local = rows[where] - starts[chunk]
+            pieces.append(pd.DataFrame({column: parts[column][chunk].take(local) for column in DEDUP_COLS}))
+            positions.append(where)
+        keys = pd.concat(pieces, ignore_index=True)
+        return keys.iloc[np.argsort(np.concatenate(positions))].reset_index(drop=True)
+
+    reader = pd.read_csv(csv_path, usecols=USE_COLS, dtype=DTYPES, parse_dates=['timestamp'], chunksize=chunk_rows)
+    for chunk in reader:
+        chunk = chunk.drop_duplicates(DEDUP_COLS, ignore_index=True)
+        hashes = pd.util.hash_pandas_object(chunk[DEDUP_COLS], index=False).to_numpy()
+
+        new = np.ones(len(chunk), dtype=bool)
+        if len(seen_hashes):
+            position = np.minimum(np.searchsorted(seen_hashes, hashes), len(seen_hashes) - 1)
+            hits = np.flatnonzero(seen_hashes[position] == hashes)
+            if len(hits):
+                same = _same_keys(chunk.iloc[hits], kept_keys(seen_rows[position[hits]]))
+                new[hits[same]] = False
+                # A different row with the same hash, compare it with all the rows of that hash
+                for hit in hits[~same]:
+                    lo, hi = np.searchsorted(seen_hashes, hashes[hit], side='left'), np.searchsorted(seen_hashes, hashes[hit], side='right')
+                    candidates = kept_keys(seen_rows[lo:hi])
+                    row = chunk.iloc[[hit] * len(candidates)]
+                    new[hit] = not _same_keys(row, candidates).any()
+        chunk = chunk[new]
+
+        starts.append(kept)
+        for column in USE_COLS:
+            # A copy of its own, so every column is released on its own at the end
+            parts[column].append(chunk[column].array.copy())
+        hashes, rows = hashes[new], kept + np.arange(len(chunk))
+        order = np.argsort(hashes, kind='stable')
+        # Both arrays are sorted runs now, so the stable sort merges them in linear time
+        hashes = np.concatenate((seen_hashes, hashes[order]))
+        rows = np.concatenate((seen_rows, rows[order]))
+        order = np.argsort(hashes, kind='stable')
+        seen_hashes, seen_rows = hashes[order], rows[order]
+        kept += len(chunk)
+
+    if not starts:
+        return pd.DataFrame({column: pd.Series(dtype=DTYPES.get(column, 'datetime64[ns]')) for column in USE_COLS})
+    columns = {}
+    for column in USE_COLS:
+        columns[column] = pd.concat([pd.Series(array, copy=False) for array in parts[column]], ignore_index=True)
+        parts[column] = None
+    return pd.DataFrame(columns, copy=False)
+
+
+def _sort_by_columns(df, by):
+    """Sorts a frame (stable) one column at a time, so it is never held twice."""
+    order = df[by].sort_values(by, kind='mergesort').index.to_numpy()
+    columns = {}
+    for column in list(df.columns):
+        columns[column] = df.pop(column).take(order).reset_index(drop=True)
+    return pd.DataFrame(columns, copy=False)
+
+
+def _build_timestamp_index(df):
+    """
+    Builds a timestamp -> (start, stop) row range lookup over a frame sorted by timestamp.
 
-    # Select first timestamp with more than one ship
-    timestamp_counts = agg_result['timestamp'].value_counts()
-    timestamp_to_plot = timestamp_counts[timestamp_counts > 1].index[0]
-    subset = agg_result[agg_result['timestamp'] == timestamp_to_plot]
+    Returns:
+        A tuple (index, ships) where ships is a Series with the number of distinct
+        ships per timestamp, in timestamp order.
+    """
+    if df.empty:
+        return {}, pd.Series([], index=pd.DatetimeIndex([]), dtype=np.int64)
 
+    timestamps = df['timestamp'].to_numpy()
+    oids = df['oid'].to_numpy()
+    new_timestamp = np.r_[True, timestamps[1:] != timestamps[:-1]]
+    new_ship = new_timestamp | np.r_[True, oids[1:] != oids[:-1]]
+
+    starts = np.flatnonzero(new_timestamp)
+    stops = np.r_[starts[1:], len(df)]
+    keys = pd.DatetimeIndex(timestamps[starts])
+    index = {key: (int(start), int(stop)) for key, start, stop in zip(keys, starts, stops)}
+    ships = pd.Series(np.add.reduceat(new_ship.astype(np.int64), starts), index=keys)
+    return index, ships
+
+
+def load_predictions(csv_path):
+    """
+    Returns the prediction table of an archive, loading it once per archive version.
+
+    The table is typed, de-duplicated and sorted by (timestamp, oid, lh) and comes
+    with a timestamp index so any moment can be sliced without scanning.
+
+    Args:
+        csv_path (str): The path to the prediction archive (CSV or zipped CSV).
+
+    Returns:
+        A dict with the keys 'df', 'timestamp_index', 'ships_per_timestamp', 'version',
+        'maps' and 'evaluations'.
+    """
+    stat = os.stat(csv_path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    with _lock:
+        cached = _predictions.get(csv_path)
+        if cached is not None and cached['signature'] == signature:
+            return cached
+
+        df = _sort_by_columns(_read_predictions(csv_path), ['timestamp', 'oid', 'lh'])
+        timestamp_index, ships = _build_timestamp_index(df)
+        cached = {
+            'signature': signature,
+            'version': (cached['version'] + 1) if cached is not None else 1,
+            'df': df,
+            'timestamp_index': timestamp_index,
+            'ships_per_timestamp': ships,
+            'maps': {},
+            'evaluations': {}
+        }
+        _predictions[csv_path] = cached
+        return cached
+
+
+def get_timestamp_rows(predictions, timestamp):
+    bounds = predictions['timestamp_index'].get(pd.Timestamp(timestamp))
+    if bounds is None:
+        return predictions['df'].iloc[0:0]
+    return predictions['df'].iloc[bounds[0]:bounds[1]]
+
+
+def render_prediction_map(subset):
+    """
+    Renders the actual positions and predicted positions of the ships of one timestamp.
+
+    Args:
+        subset (DataFrame): Prediction rows of a single timestamp sorted by oid and lh.
+
+    Returns:
+        The folium map as an HTML document string.
+    """
     # Initialize folium map
     map_center = [subset['lat'].mean(), subset['lon'].mean()]
     m = folium.Map(location=map_center, zoom_start=7)
 
-    for _, row in subset.iterrows():
-        actual_pos = (row['lat'], row['lon'])
-        predicted_positions = list(zip(row['pred_lats'], row['pred_lons'], row['predictions']))
-        bearing = row['bearing'] if not pd.isna(row['bearing']) else 0
+    for oid, rows in subset.groupby('oid', sort=False):
+        first = rows.iloc[0]
+        actual_pos = (first['lat'], first['lon'])
+        predicted_positions = list(zip(rows['predicted_lat'], rows['predicted_lon'], rows['lh']))
+        bearing = first['bearing'] if not pd.isna(first['bearing']) else 0
 
         # Add rotated triangle to indicate actual position + direction
         folium.RegularPolygonMarker(
@@ -48,8 +229,8 @@ def generate_prediction_map(csv_path):
             fill_opacity=0.9,
             popup=folium.Popup(
                 f"""
-                <b>Ship ID:</b> {row['oid']}<br>
-                <b>Timestamp:</b> {row['timestamp']}<br>
+                <b>Ship ID:</b> {oid}<br>
+                <b>Timestamp:</b> {first['timestamp']}<br>
                 <b>Bearing:</b> {int(bearing)}°<br>
                 <b>This is the actual position of the ship at this time.</b>
                 """,
@@ -69,6 +250,9 @@ def generate_prediction_map(csv_path):
                     f"""
                     <b>Prediction Horizon:</b> {lh_val} seconds<br>
                     <b>This is the predicted position of the ship {lh_val // 60} minutes after the actual timestamp.</b>
+                    """ if not pd.isna(lh_val) else """
+                    <b>Prediction Horizon:</b> unknown<br>
+                    <b>This is a predicted position of the ship.</b>
                     """,
                     max_width=300
                 )
@@ -78,7 +262,236 @@ def generate_prediction_map(csv_path):
         path_coords = [actual_pos] + [(lat, lon) for lat, lon, _ in predicted_positions]
         folium.PolyLine(locations=path_coords, color='blue', weight=2).add_to(m)
 
-    # Save and return path
-    map_file_path = 'static/ship_predictions_map.html'
-    m.save(map_file_path)
-    return map_file_path
+    return m.get_root().render()
+
+
+def default_timestamp(predictions):
+    """Returns the first timestamp with more than one ship (or the first timestamp at all)."""
+    ships = predictions['ships_per_timestamp']
+    crowded = ships[ships > 1]
+    if not crowded.empty:
+        return crowded.index[0]
+    return ships.index[0] if not ships.empty else None
+
+
+def select_predictions(predictions, timestamp, oid=None, max_horizon=None):
+    """
+    Slices the predictions of one timestamp, optionally for one ship and up to a horizon.
+
+    Args:
+        predictions (dict): The table returned by load_predictions.
+        timestamp: The timestamp to show.
+        oid (str): Only keep this ship.
+        max_horizon (int): Only keep horizons lh (seconds) up to this value.
+
+    Returns:
+        A pandas DataFrame sorted by oid and lh.
+    """
+    subset = get_timestamp_rows(predictions, timestamp)
+    if oid is not None:
+        subset = subset[subset['oid'] == str(oid)]
+    if max_horizon is not None:
+        # Rows without a horizon are left out, like NaN horizons used to be
+        subset = subset[(subset['lh'] <= max_horizon).fillna(False).to_numpy(dtype=bool)]
+    return subset
+
+
+def list_timestamps(csv_path):
+    """
+    Lists the timestamps of a prediction archive with the number of ships at each.
+
+    Args:
+        csv_path (str): The path to the prediction archive.
+
+    Returns:
+        A list of dictionaries with the keys 'timestamp' and 'ships'.
+    """
+    ships = load_predictions(csv_path)['ships_per_timestamp']
+    return [
+        {'timestamp': timestamp, 'ships': int(count)}
+        for timestamp, count in zip(ships.index.strftime('%Y-%m-%dT%H:%M:%S'), ships.to_numpy())
+    ]
+
+
+def generate_prediction_map(csv_path, timestamp=None, oid=None, max_horizon=None):
+    """
+    Returns the prediction map of a timestamp, optionally for one ship and up to a horizon.
+
+    Without a timestamp the first timestamp with more than one ship is shown. Maps
+    are rendered in memory and cached per archive version and selection.
+
+    Args:
+        csv_path (str): The path to the prediction archive.
+        timestamp: The timestamp to show.
+        oid (str): Only show this ship.
+        max_horizon (int): Only show horizons lh (seconds) up to this value.
+
+    Returns:
+        The map as an HTML document string, or None if the selection is empty.
+    """
+    predictions = load_predictions(csv_path)
+    timestamp = pd.Timestamp(timestamp) if timestamp is not None else default_timestamp(predictions)
+    if timestamp is None:
+        return None
+
+    key = (timestamp, oid, max_horizon)
+    maps = predictions['maps']
+    with _lock:
+        if key in maps:
+            return maps[key]
+
+    subset = select_predictions(predictions, timestamp, oid, max_horizon)
+    if subset.empty:
+        return None
+    html_map = render_prediction_map(subset)
+
+    with _lock:
+        maps[key] = html_map
+        if len(maps) > MAP_CACHE_SIZE:
+            del maps[next(iter(maps))]
+    return html_map
+
+
+def observed_positions(ais_dataset_url, oids, seconds, max_gap_seconds=MAX_INTERPOLATION_GAP_SECONDS):
+    """
+    Interpolates where each ship actually was at the given times, in one vectorized pass.
+
+    Args:
+        ais_dataset_url (str): The path to the AIS CSV file (shipid must match the prediction oid).
+        oids (array-like): Ship identifiers.
+        seconds (ndarray): Epoch seconds at which the positions are needed.
+        max_gap_seconds (int): Largest gap between the bracketing AIS fixes.
+
+    Returns:
+        A tuple (lat, lon) of arrays, NaN where no observation brackets the time.
+    """
+    ais_store = store.get_store(ais_dataset_url)
+    df = ais_store['df']
+    lat_out = np.full(len(seconds), np.nan)
+    lon_out = np.full(len(seconds), np.nan)
+    if df.empty or len(seconds) == 0:
+        return lat_out, lon_out
+
+    # The store is sorted by shipid, so factorized codes increase with the rows
+    ship_codes, shipids = pd.factorize(df['shipid'])
+    ais_seconds = store.epoch_seconds(df['t'])
+    lat = df['lat'].to_numpy(dtype=float)
+    lon = df['lon'].to_numpy(dtype=float)
+
+    query_codes = pd.Index(shipids).get_indexer(pd.Index(np.asarray(oids, dtype=str)))
+    known = query_codes >= 0
+    origin = min(ais_seconds.min(), seconds.min())
+    span = int(max(ais_seconds.max(), seconds.max()) - origin) + 1
+    row_keys = ship_codes.astype(np.int64) * span + (ais_seconds - origin)
+    query_keys = query_codes.astype(np.int64) * span + (seconds - origin)
+
+    i = np.searchsorted(row_keys, query_keys, side='right') - 1
+    j = np.minimum(i + 1, len(df) - 1)
+    i = np.maximum(i, 0)
+    exact = known & (ship_codes[i] == query_codes) & (ais_seconds[i] == seconds)
+    bracketed = (
+        known & (ship_codes[i] == query_codes) & (ship_codes[j] == query_codes)
+        & (ais_seconds[i] <= seconds) & (ais_seconds[j] >= seconds)
+        & (ais_seconds[j] - ais_seconds[i] <= max_gap_seconds)
+    )
+    dt = np.where(ais_seconds[j] > ais_seconds[i], ais_seconds[j] - ais_seconds[i], 1)
+    w = np.where(exact, 0.0, (seconds - ais_seconds[i]) / dt)
+    valid = exact | bracketed
+    lat_out[valid] = (lat[i] + w * (lat[j] - lat[i]))[valid]
+    lon_out[valid] = (lon[i] + w * (lon[j] - lon[i]))[valid]
+    return lat_out, lon_out
+
+
+def _error_summary(errors, by):
+    if errors.empty:
+        columns = [by, 'count', 'mean', 'max'] + ['p{}'.format(int(q * 100)) for q in ERROR_QUANTILES]
+        return pd.DataFrame(columns=columns)
+    grouped = errors.groupby(by)['error_m']
+    summary = grouped.agg(['count', 'mean', 'max'])
+    quantiles = grouped.quantile(ERROR_QUANTILES).unstack()
+    quantiles.columns = ['p{}'.format(int(q * 100)) for q in ERROR_QUANTILES]
+    return summary.join(quantiles).round(1).reset_index()
+
+
+def evaluate_predictions(csv_path, ais_dataset_url):
+    """
+    Compares every prediction with the observed AIS position at timestamp + lh.
+
+    The result is cached per archive and AIS store version.
+
+    Args:
+        csv_path (str): The path to the prediction archive.
+        ais_dataset_url (str): The path to the AIS CSV file.
+
+    Returns:
+        A dict with the number of predictions and of evaluated ones, and the error
+        distributions per horizon ('by_horizon') and per vessel ('by_vessel').
+        The error of every single prediction is not kept.
+    """
+    predictions = load_predictions(csv_path)
+    key = (ais_dataset_url, store.get_store(ais_dataset_url)['version'])
+    if key in predictions['evaluations']:
+        return predictions['evaluations'][key]
+
+    # A prediction without a horizon has no time to be compared at
+    df = predictions['df']
+    df = df[df['lh'].notna().to_numpy()]
+    target_seconds = store.epoch_seconds(df['timestamp']) + df['lh'].to_numpy(dtype=np.int64)
+    actual_lat, actual_lon = observed_positions(ais_dataset_url, df['oid'].to_numpy(), target_seconds)
+    errors = pd.DataFrame({
+        'timestamp': df['timestamp'].to_numpy(),
+        'oid': df['oid'].to_numpy(),
+        'lh': df['lh'].to_numpy(dtype=np.int64),
+        'error_m': haversine_m(df['predicted_lat'], df['predicted_lon'], actual_lat, actual_lon)
+    })
+    errors = errors[~np.isnan(actual_lat)].reset_index(drop=True)
+
+    result = {
+        'predictions': int(len(predictions['df'])),
+        'evaluated': int(len(errors)),
+        'by_horizon': _error_summary(errors, 'lh'),
+        'by_vessel': _error_summary(errors, 'oid')
+    }
+    with _lock:
+        predictions['evaluations'] = {key: result}
+    return result
+
+
+def get_accuracy_report(csv_path, ais_dataset_url):
+    result = evaluate_predictions(csv_path, ais_dataset_url)
+    return {
+        'predictions': result['predictions'],
+        'evaluated': result['evaluated'],
+        'by_horizon': result['by_horizon'].to_dict('records'),
+        'by_vessel': result['by_vessel'].to_dict('records')
+    }
+
+
+def render_accuracy_chart(csv_path, ais_dataset_url):
+    """
+    Plots the median and p10-p90 band of the prediction error against the horizon.
+
+    Returns:
+        The chart as PNG bytes, or None if nothing could be evaluated.
+    """
+    result = evaluate_predictions(csv_path, ais_dataset_url)
+    by_horizon = result['by_horizon']
+    if by_horizon.empty:
+        return None
+    if 'chart' not in result:
+        minutes = by_horizon['lh'] / 60
+        fig = Figure(figsize=(10, 6))
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot()
+        ax.fill_between(minutes, by_horizon['p10'] / 1000, by_horizon['p90'] / 1000, alpha=0.3, label='p10 - p90')
+        ax.plot(minutes, by_horizon['p50'] / 1000, marker='o', label='Median')
+        ax.plot(minutes, by_horizon['mean'] / 1000, linestyle='--', label='Mean')
+        ax.set_xlabel('Prediction horizon (minutes)')
+        ax.set_ylabel('Error (km)')
+        ax.set_title('Prediction error per horizon ({} predictions)'.format(result['evaluated']))
+        ax.legend()
+        fig.tight_layout()
+        img = io.BytesIO()
+        fig.savefig(img, format='png')
+        result['chart'] = img.getvalue()
+    return result['chart']